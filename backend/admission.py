@@ -0,0 +1,223 @@
+# admission.py
+# Admission control: under a spike, keep orders fast by turning away the requests
+# that matter least, instead of letting everything slow down together.
+#
+# Every endpoint belongs to a priority class:
+#   checkout   placing orders and the cart (checkout, create_sale, ...)   highest
+#   browse     everything not listed elsewhere (book lists, search, ...)
+#   reports    the expensive admin reads (get_all_sales, get_sales_count, ...)  lowest
+# and each class has, per worker process:
+#   limit      requests of the class running at the same time
+#   queue      requests allowed to wait for a slot; more are rejected straight away
+#   wait       seconds a request may wait before it is rejected
+#   retry_after  the Retry-After sent with the rejection
+# On top of that ADMISSION_MAX_ACTIVE caps all classes together. When a request
+# finishes, its slot goes to the waiting request with the highest priority (oldest
+# first within a class) whose class is under its own limit. A rejected request gets
+# 503 Service Unavailable with a Retry-After header right away, which costs almost
+# nothing, instead of holding a thread until it times out.
+#
+# The default limits keep at least one of the worker's threads for checkout: browse
+# may use all but one (ADMISSION_MAX_ACTIVE - 1) and reports only one.
+#
+# Health checks, the frontend files and the admin status pages are never limited, so
+# you can still look at the server while it is shedding load.
+#
+# Usage (in app.py):
+#   admission.init_app(app)
+#   GET /api/admin/admission    current load and rejections per class (admin)
+#
+# Settings (app.config):
+#   ADMISSION_ENABLED        False (or env ADMISSION_ENABLED=0) switches it off, e.g. to find the raw capacity
+#   ADMISSION_MAX_ACTIVE     requests running at once over all classes (default GUNICORN_THREADS, 4)
+#   ADMISSION_CLASSES        {'reports': {'limit': 2}, ...} merged over DEFAULT_CLASSES
+#   ADMISSION_ROUTES         {'endpoint_name': 'class' or None (never limited)} merged over DEFAULT_ROUTES
+#   ADMISSION_DEFAULT_CLASS  class of endpoints not in ADMISSION_ROUTES (default 'browse')
+import bisect
+import itertools
+import math
+import os
+import threading
+
+from flask import g, jsonify, request
+
+# Lower number = more important. limit None means only ADMISSION_MAX_ACTIVE applies,
+# a negative limit is relative to it (-1 = all but one slot).
+DEFAULT_CLASSES = {
+    'checkout': {'priority': 0, 'limit': None, 'queue': 64, 'wait': 5.0, 'retry_after': 1},
+    'browse': {'priority': 1, 'limit': -1, 'queue': 32, 'wait': 1.0, 'retry_after': 2},
+    'reports': {'priority': 2, 'limit': 1, 'queue': 4, 'wait': 0.5, 'retry_after': 10},
+}
+
+DEFAULT_ROUTES = {
+    'checkout': 'checkout',
+    'create_sale': 'checkout',
+    'add_to_cart': 'checkout',
+    'get_cart': 'checkout',
+    'get_all_sales': 'reports',
+    'get_sales_count': 'reports',
+    'get_reorder_suggestions': 'reports',
+    'get_low_stock': 'reports',
+    # Never limited
+    'health_check': None,
+    'serve_frontend': None,
+    'static': None,
+    'admission_status': None,
+    'maintenance_status': None,
+    'job_queue_status': None,
+}
+
+
+class _Waiter:
+    """A request waiting for a slot; granted is set by whoever hands it one"""
+
+    def __init__(self, name, order):
+        self.name = name
+        self.order = order
+        self.granted = threading.Event()
+
+    def __lt__(self, other):
+        return self.order < other.order
+
+
+class AdmissionController:
+    """The slots of one worker process"""
+
+    def __init__(self, max_active, classes):
+        self.max_active = max_active
+        self.classes = classes
+        self.lock = threading.Lock()
+        self.active = {name: 0 for name in classes}
+        self.total_active = 0
+        self.waiting = []  # _Waiters sorted by (priority, arrival)
+        self.queued = {name: 0 for name in classes}
+        self.counters = {name: {'admitted': 0, 'queued': 0, 'rejected_full': 0, 'rejected_timeout': 0}
+                         for name in classes}
+        self.arrivals = itertools.count()
+
+    def class_limit(self, name):
+        limit = self.classes[name].get('limit')
+        if limit is None:
+            return self.max_active
+        if limit < 0:
+            return max(1, self.max_active + limit)
+        return limit
+
+    def _has_room(self, name):
+        return self.total_active < self.max_active and self.active[name] < self.class_limit(name)
+
+    def _take(self, name):
+        self.active[name] += 1
+        self.total_active += 1
+        self.counters[name]['admitted'] += 1
+
+    def _dispatch(self):
+        """Hand free slots to waiters, most important first (call with the lock held)"""
+        for waiter in list(self.waiting):
+            if self.total_active >= self.max_active:
+                break
+            if self._has_room(waiter.name):
+                self.waiting.remove(waiter)
+                self.queued[waiter.name] -= 1
+                self._take(waiter.name)
+                waiter.granted.set()
+
+    def acquire(self, name):
+        """Wait for a slot for class `name`; returns True when admitted, False when rejected"""
+        settings = self.classes[name]
+        priority = settings['priority']
+        with self.lock:
+            # Nobody at the same or a higher priority is waiting: no cutting in line
+            ahead = any(self.classes[w.name]['priority'] <= priority for w in self.waiting)
+            if not ahead and self._has_room(name):
+                self._take(name)
+                return True
+            if self.queued[name] >= settings['queue']:
+                self.counters[name]['rejected_full'] += 1
+                return False
+            waiter = _Waiter(name, (priority, next(self.arrivals)))
+            bisect.insort(self.waiting, waiter)
+            self.queued[name] += 1
+            self.counters[name]['queued'] += 1
+
+        if waiter.granted.wait(settings['wait']):
+            return True
+        with self.lock:
+            # The slot may have been handed over just as the wait ran out
+            if waiter.granted.is_set():
+                return True
+            self.waiting.remove(waiter)
+            self.queued[name] -= 1
+            self.counters[name]['rejected_timeout'] += 1
+            return False
+
+    def release(self, name):
+        with self.lock:
+            self.active[name] -= 1
+            self.total_active -= 1
+            self._dispatch()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'max_active': self.max_active,
+                'active': self.total_active,
+                'classes': {
+                    name: {
+                        'priority': self.classes[name]['priority'],
+                        'limit': self.class_limit(name),
+                        'active': self.active[name],
+                        'waiting': self.queued[name],
+                        **self.counters[name],
+                    }
+                    for name in self.classes
+                },
+            }
+
+
+def init_app(app):
+    app.config.setdefault('ADMISSION_ENABLED', os.getenv('ADMISSION_ENABLED', '1') != '0')
+    app.config.setdefault('ADMISSION_MAX_ACTIVE', int(os.getenv('GUNICORN_THREADS', '4')))
+    app.config.setdefault('ADMISSION_DEFAULT_CLASS', 'browse')
+    classes = {name: dict(settings) for name, settings in DEFAULT_CLASSES.items()}
+    for name, settings in app.config.get('ADMISSION_CLASSES', {}).items():
+        classes[name] = {**classes.get(name, DEFAULT_CLASSES['browse']), **settings}
+    app.config['ADMISSION_CLASSES'] = classes
+    app.config['ADMISSION_ROUTES'] = {**DEFAULT_ROUTES, **app.config.get('ADMISSION_ROUTES', {})}
+
+    app.extensions['admission'] = AdmissionController(app.config['ADMISSION_MAX_ACTIVE'], classes)
+    app.before_request(lambda: _admit(app))
+    app.teardown_request(lambda error: _leave(app))
+
+
+def class_of(app, endpoint):
+    """The priority class of an endpoint, or None when it is never limited"""
+    return app.config['ADMISSION_ROUTES'].get(endpoint, app.config['ADMISSION_DEFAULT_CLASS'])
+
+
+def _admit(app):
+    if not app.config['ADMISSION_ENABLED'] or request.method == 'OPTIONS':
+        return None
+    name = class_of(app, request.endpoint)
+    if name is None:
+        return None
+    if not app.extensions['admission'].acquire(name):
+        response = jsonify({
+            'success': False,
+            'error': 'The server is busy. Please try again shortly.'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, math.ceil(app.config['ADMISSION_CLASSES'][name]['retry_after'])))
+        return response
+    g.admission_class = name
+    return None
+
+
+def _leave(app):
+    name = g.pop('admission_class', None)
+    if name is not None:
+        app.extensions['admission'].release(name)
+
+
+def stats(app):
+    return app.extensions['admission'].stats()
@@ -2,12 +2,38 @@
 # Clean version that should fix the NameError
 
 # Import all the tools we need
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
-from models import db, Book, User, Sale, SaleItem, bcrypt
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, Book, User, Sale, SaleItem, Notification, PasswordReset, bcrypt
 from database import init_database
 from auth import token_required, admin_required
-from datetime import datetime, date
+from static_assets import StaticAssets
+from compression import Compress
+from json_provider import FastJSONProvider
+import read_models
+import recommendations
+import leaderboards
+import suggest
+import facets
+import catalog_sync
+import forecasting
+import journal
+import jobs
+import profiling
+import admission
+import dashboard
+from inventory import record_stock_alerts
+import read_replica
+import archive
+import backup
+from read_replica import use_read_replica
+import maintenance
+from rate_limit import RateLimiter
+import idempotency
+from idempotency import idempotent
+from datetime import datetime, date, timedelta
 import os
 from dotenv import load_dotenv
 
@@ -17,12 +43,19 @@ load_dotenv()
 # Create our Flask application - THIS MUST COME BEFORE @app.route decorators
 app = Flask(__name__)
 
+# orjson-backed JSON (and MessagePack for clients that send Accept: application/msgpack)
+app.json = FastJSONProvider(app)
+
 # Configure CORS
 CORS(app)
 
 # Configure our database and security
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(basedir, "instance", "bookstore.db")}'
+# DATABASE_URL lets production (and the benchmark) point at a different database file or server
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
+    'DATABASE_URL',
+    f'sqlite:///{os.path.join(basedir, "instance", "bookstore.db")}'
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Set secret keys from environment variables
@@ -30,36 +63,64 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'fallback-secret-key-for-deve
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'fallback-jwt-key-for-development')
 
 # Initialize extensions
+# Reports get their own read-only connection pool (adds the 'reads' bind, so it goes before db.init_app)
+read_replica.init_app(app)
+# Old orders are moved to a separate archive database (adds the 'archive' bind, same reason)
+archive.init_app(app)
 db.init_app(app)
 bcrypt.init_app(app)
+compress = Compress(app)
+# Per-route concurrency limits: under load, reports and browsing wait or get 503 before checkout does
+admission.init_app(app)
+maintenance.init_app(app)
+limiter = RateLimiter(app)
+idempotency.init_app(app)
+recommendations.init_app(app)
+leaderboards.init_app(app)
+suggest.init_app(app)
+facets.init_app(app)
+catalog_sync.init_app(app)
+forecasting.init_app(app)
+journal.init_app(app)
+backup.init_app(app)
+jobs.init_app(app)
+dashboard.init_app(app)
+# Admins can profile one request with an X-Profile header
+profiling.init_app(app)
 
 # Create the instance directory if it doesn't exist
 os.makedirs(os.path.join(basedir, 'instance'), exist_ok=True)
 
 # Initialize database with sample data
-init_database(app)
+# The production launcher (gunicorn.conf.py) seeds once in the master process and
+# sets BOOKSTORE_INIT_DB=0 so that every worker doesn't repeat it on import.
+if os.getenv('BOOKSTORE_INIT_DB', '1') != '0':
+    init_database(app)
+    # Build the typeahead index now; with gunicorn's preload the workers share it
+    with app.app_context():
+        suggest.warm(app)
 
-# Serve frontend static files from the project Frontend/ directory.
-# This lets you open the app at http://localhost:5000/ and have Flask
-# serve the static HTML/CSS/JS files. It is placed after API routes so
-# `/api/*` endpoints continue to work as defined above.
-FRONTEND_DIR = os.path.abspath(os.path.join(basedir, '..', 'Frontend'))
+# Serve the frontend/ HTML and JS files so the whole app works from http://localhost:5000/
+# Everything is loaded into memory once here (from the `python static_assets.py` build
+# output when present), so a request never touches the disk. Hashed assets are cached
+# forever by browsers, HTML pages are revalidated with their ETag.
+# The catch-all route only matches paths that no /api/* route claimed.
+FRONTEND_DIR = os.path.abspath(os.path.join(basedir, '..', 'frontend'))
+frontend_assets = StaticAssets.load(FRONTEND_DIR)
 
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve_frontend(path):
-    # Do not interfere with API routes (they are defined earlier and take precedence).
-    # If the requested path exists in the Frontend folder, serve it; otherwise serve index.html.
-    if path and os.path.exists(os.path.join(FRONTEND_DIR, path)):
-        return send_from_directory(FRONTEND_DIR, path)
-    return send_from_directory(FRONTEND_DIR, 'index.html')
+    # Unknown paths get index.html, same as before
+    return frontend_assets.response(path or 'index.html', request)
 
 # ===============================
 # AUTHENTICATION ENDPOINTS
 # ===============================
 
 @app.route('/api/register', methods=['POST'])
+@limiter.limit('register', identity=lambda data: data.get('email'))
 def register():
     """POST /api/register - Create new user account"""
     try:
@@ -117,6 +178,7 @@ def register():
         }), 500
 
 @app.route('/api/login', methods=['POST'])
+@limiter.limit('login', identity=lambda data: data.get('username'))
 def login():
     """POST /api/login - User authentication with debug logging"""
     try:
@@ -196,16 +258,62 @@ def get_profile(current_user):
 # BOOK ENDPOINTS
 # ===============================
 
+def fieldset_from_request(model, relations=read_models.BOOK_RELATIONS):
+    """
+    ?fields= and ?expand= for a list endpoint, see read_models.parse_fieldset
+    ?fields=id,title,price                      only these fields
+    ?expand=items,items.book                    only these nested objects
+    Returns None (the full shape) when neither is given; raises ValueError for unknown names.
+    """
+    return read_models.parse_fieldset(model, relations, request.args.get('fields'), request.args.get('expand'))
+
 @app.route('/api/books', methods=['GET'])
 def get_all_books():
-    """GET /api/books - Get all books (public endpoint)"""
+    """GET /api/books - Get all books (public endpoint), ?fields= picks the fields"""
     try:
-        books = Book.query.all()
+        books = read_models.list_books(fieldset_from_request(Book))
         return jsonify({
             'success': True,
-            'data': [book.to_dict() for book in books],
+            'data': books,
             'count': len(books)
         }), 200
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/books/changes', methods=['GET'])
+def get_book_changes():
+    """
+    GET /api/books/changes?since=1234 - Books changed or deleted since the last sync (public endpoint)
+    Start with since=0 (every book), then pass the returned next_since each time; keep
+    asking while has_more is true. On reset: true, drop the local copy and start over
+    from since=0. ?fields= picks the book fields, ?limit= the page size.
+    """
+    try:
+        limit = int(request.args.get('limit', app.config['SYNC_PAGE_SIZE']))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit must be a number'}), 400
+    limit = min(max(limit, 1), app.config['SYNC_MAX_PAGE_SIZE'])
+    try:
+        fieldset = fieldset_from_request(Book)
+        data = catalog_sync.changes_since(app, request.args.get('since', '0'), limit,
+                                          fieldset['fields'] if fieldset else None)
+        return jsonify({
+            'success': True,
+            'data': data
+        }), 200
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -233,6 +341,146 @@ def get_book_by_id(book_id):
             'error': str(e)
         }), 500
 
+@app.route('/api/books/top', methods=['GET'])
+def get_top_books():
+    """GET /api/books/top?window=7d&genre=Fiction&limit=10 - Best sellers (public endpoint)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit must be a number'}), 400
+    try:
+        books = leaderboards.top(app, request.args.get('window', '7d'), request.args.get('genre'), limit)
+        return jsonify({
+            'success': True,
+            'data': books,
+            'count': len(books)
+        }), 200
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# What a typeahead entry shows
+SUGGEST_FIELDS = ('id', 'title', 'author', 'isbn', 'price', 'genre')
+
+@app.route('/api/books/suggest', methods=['GET'])
+def suggest_books():
+    """GET /api/books/suggest?prefix=gats&limit=8 - Typeahead on title, author or ISBN, best sellers first (public endpoint)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 8)), 1), 25)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit must be a number'}), 400
+    try:
+        book_ids = suggest.suggest(app, request.args.get('prefix', ''), limit)
+        books = read_models.books_by_id(book_ids, SUGGEST_FIELDS)
+        # A book deleted in another worker since this one's last rebuild is just skipped
+        data = [books[book_id] for book_id in book_ids if book_id in books]
+        return jsonify({
+            'success': True,
+            'data': data,
+            'count': len(data)
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def book_filters_from_request():
+    """
+    Turn the store's filter query string into SQL filters (for the facet counts)
+    ?genre=Fiction                    only this genre
+    ?author=Jane Austen               only this author
+    ?min_price=10&max_price=20        price range (inclusive)
+    ?in_stock=1                       only books in stock (0: only sold-out books)
+    ?q=gatsby                         title or author contains this text
+    Returns (filters, cache key). Raises ValueError with a readable message for bad values.
+    """
+    args = request.args
+    filters = []
+    key = []
+
+    if args.get('genre'):
+        filters.append(Book.genre == args['genre'])
+    if args.get('author'):
+        filters.append(Book.author == args['author'])
+    def parse_price(name):
+        try:
+            return float(args[name])
+        except ValueError:
+            raise ValueError(f'{name} must be a number')
+
+    if args.get('min_price'):
+        filters.append(Book.price >= parse_price('min_price'))
+    if args.get('max_price'):
+        filters.append(Book.price <= parse_price('max_price'))
+    if args.get('in_stock') in ('0', '1'):
+        in_stock = db.func.coalesce(Book.stock_quantity, 0) > 0
+        filters.append(in_stock if args['in_stock'] == '1' else ~in_stock)
+    elif args.get('in_stock'):
+        raise ValueError('in_stock must be 0 or 1')
+    if args.get('q', '').strip():
+        pattern = f"%{args['q'].strip()}%"
+        filters.append(Book.title.ilike(pattern) | Book.author.ilike(pattern))
+
+    for name in ('genre', 'author', 'min_price', 'max_price', 'in_stock', 'q'):
+        if args.get(name, '').strip():
+            key.append((name, args[name].strip()))
+    return filters, tuple(key)
+
+@app.route('/api/books/facets', methods=['GET'])
+def get_book_facets():
+    """GET /api/books/facets?genre=Fiction&q=war - Counts for the store's filters (public endpoint), see book_filters_from_request"""
+    try:
+        filters, key = book_filters_from_request()
+        data = facets.facets(app, filters, key)
+        return jsonify({
+            'success': True,
+            'data': data
+        }), 200
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/books/<int:book_id>/recommendations', methods=['GET'])
+def get_book_recommendations(book_id):
+    """GET /api/books/1/recommendations - Customers who bought this also bought... (public endpoint)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 5)), 1), app.config['RECOMMENDATION_TOP_K'])
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit must be a number'}), 400
+    try:
+        scored = recommendations.recommend(app, book_id, limit)
+        books = read_models.books_by_id([other_id for other_id, _ in scored])
+        data = []
+        for other_id, score in scored:
+            # A book deleted since the last rebuild is just skipped
+            if other_id in books:
+                data.append({**books[other_id], 'score': round(score, 4)})
+        return jsonify({
+            'success': True,
+            'data': data,
+            'count': len(data)
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/books', methods=['POST'])
 @token_required
 @admin_required
@@ -260,11 +508,16 @@ def create_book(current_user):
             genre=data.get('genre'),
             publication_date=datetime.strptime(data['publication_date'], '%Y-%m-%d').date() 
                             if data.get('publication_date') else None,
-            stock_quantity=data.get('stock_quantity', 0)
+            stock_quantity=data.get('stock_quantity', 0),
+            reorder_point=int(data.get('reorder_point', 5))
         )
         
         db.session.add(new_book)
+        journal.record_book_created(new_book, user_id=current_user.id)
+        facet_change = facets.stage_book_change(None, new_book)
         db.session.commit()
+        suggest.record_book(new_book)
+        facets.apply(facet_change)
         
         return jsonify({
             'success': True,
@@ -294,6 +547,7 @@ def update_book(current_user, book_id):
             }), 404
         
         data = request.get_json()
+        before = book.api_fields_dict()  # for the journal and the facet counts
         
         # Update book fields
         if 'title' in data:
@@ -312,10 +566,16 @@ def update_book(current_user, book_id):
             book.publication_date = datetime.strptime(data['publication_date'], '%Y-%m-%d').date()
         if 'stock_quantity' in data:
             book.stock_quantity = data['stock_quantity']
+        if 'reorder_point' in data:
+            book.reorder_point = int(data['reorder_point'])
         
         book.updated_at = datetime.utcnow()
+        journal.record_book_changes(book, before, user_id=current_user.id)
+        facet_change = facets.stage_book_change(before, book)
         
         db.session.commit()
+        suggest.record_book(book)
+        facets.apply(facet_change)
         
         return jsonify({
             'success': True,
@@ -344,8 +604,12 @@ def delete_book(current_user, book_id):
                 'error': 'Book not found'
             }), 404
         
+        journal.record_book_deleted(book, user_id=current_user.id)
+        facet_change = facets.stage_book_change(book, None)
         db.session.delete(book)
         db.session.commit()
+        suggest.record_delete(book_id)
+        facets.apply(facet_change)
         
         return jsonify({
             'success': True,
@@ -403,6 +667,8 @@ def add_to_cart(current_user, user_id):
 
     sale_item = SaleItem(sale_id=cart.id, book_id=book.id, quantity=quantity, price_at_time=book.price)
     db.session.add(sale_item)
+    # A cart's sale_date is its last activity: the stale-cart purge goes by it
+    cart.sale_date = datetime.utcnow()
     db.session.commit()
 
     return jsonify({'success': True, 'message': f'{book.title} added to cart'})
@@ -412,7 +678,37 @@ def add_to_cart(current_user, user_id):
 # CHECKOUT AND LOW-STOCK ALERTS
 # ===============================
 
+def record_order_in_caches(sold, facet_change):
+    """
+    Update this worker's in-memory caches once the order is committed (call before the commit)
+    The best-seller lists, the "also bought" index and the filter counts live in the
+    process that served the order, so they are updated here and not in a background
+    job, which could run in any process. The other workers catch up on their own.
+    Under @idempotent the endpoint's commit only flushes, so this waits for the real one.
+    """
+    db.session.info.setdefault('order_caches', []).append({
+        'book_ids': [book.id for book, _ in sold],
+        # Dicts now: after the commit the books are expired and can't be read without a query
+        'sold': [(book.to_dict(), quantity) for book, quantity in sold],
+        'facet_change': facet_change,
+    })
+
+
+@event.listens_for(Session, 'after_commit')
+def _update_order_caches(session):
+    for order in session.info.pop('order_caches', []):
+        recommendations.record_sale(order['book_ids'])
+        leaderboards.record_sale(order['sold'])
+        facets.apply(order['facet_change'])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_order_caches(session):
+    session.info.pop('order_caches', None)
+
+
 @app.route('/api/checkout/<int:user_id>', methods=['POST'])
+@idempotent
 @token_required
 def checkout(current_user, user_id):
     """Check out the cart and place the order"""
@@ -423,8 +719,8 @@ def checkout(current_user, user_id):
     if not cart or not cart.items:
         return jsonify({'success': False, 'error': 'Your cart is empty'}), 400
 
-    low_stock_alerts = []
     total_amount = 0
+    sold = []
 
     for item in cart.items:
         book = Book.query.get(item.book_id)
@@ -432,23 +728,18 @@ def checkout(current_user, user_id):
             return jsonify({'success': False, 'error': f'Not enough stock for {book.title}'}), 400
         book.stock_quantity -= item.quantity
         total_amount += item.price_at_time * item.quantity
+        sold.append((book, item.quantity))
 
-        if book.stock_quantity < 5:
-            low_stock_alerts.append(f"Low stock for {book.title}! (stock={book.stock_quantity})")
-            db.session.add(Notification(
-                type='LOW_STOCK',
-                message=f"Low stock for '{book.title}' (stock={book.stock_quantity}).",
-                book_id=book.id
-            ))
-        if book.stock_quantity == 0:
-            db.session.add(Notification(
-                type='OUT_OF_STOCK',
-                message=f"'{book.title}' is now OUT OF STOCK.",
-                book_id=book.id
-            ))
+    low_stock_alerts = record_stock_alerts(sold)
+    leaderboards.count_sale(sold)
+    facet_change = facets.stage_sale(sold)
+    journal.record_sale(cart, sold, user_id=current_user.id)
+    record_order_in_caches(sold, facet_change)
 
     cart.total_amount = total_amount
     cart.status = 'completed'
+    # Until now sale_date was the cart's last activity; from here on it is when the order was placed
+    cart.sale_date = datetime.utcnow()
     db.session.commit()
 
     return jsonify({
@@ -458,11 +749,48 @@ def checkout(current_user, user_id):
         'alerts': low_stock_alerts
     })
 
+@app.route('/api/inventory/low-stock', methods=['GET'])
+@use_read_replica
+@token_required
+@admin_required
+def get_low_stock(current_user):
+    """GET /api/inventory/low-stock - Books at or below their reorder point, most short first (admin only)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 200)), 1), 1000)
+        fieldset = fieldset_from_request(Book)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    books = read_models.list_low_stock(limit=limit, fieldset=fieldset)
+    return jsonify({
+        'success': True,
+        'data': books,
+        'count': len(books)
+    }), 200
+
+@app.route('/api/inventory/reorder-suggestions', methods=['GET'])
+@use_read_replica
+@token_required
+@admin_required
+def get_reorder_suggestions(current_user):
+    """GET /api/inventory/reorder-suggestions - What to reorder and how many, from the daily forecast (admin only)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 500)), 1), 5000)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit must be a number'}), 400
+    suggestions = read_models.list_reorder_suggestions(limit=limit)
+    return jsonify({
+        'success': True,
+        'data': suggestions,
+        'count': len(suggestions),
+        'computed_at': suggestions[0]['computed_at'] if suggestions else None
+    }), 200
+
 # ===============================
 # SALES ENDPOINTS
 # ===============================
 
 @app.route('/api/sales', methods=['POST'])
+@idempotent
 def create_sale():
     """POST /api/sales - Create a new sale (public endpoint for guest checkout)"""
     try:
@@ -560,6 +888,14 @@ def create_sale():
             item['book'].stock_quantity -= item['quantity']
             print(f"Updated stock for {item['book'].title}: {item['book'].stock_quantity}")
         
+        # Same low-stock notifications as checkout
+        sold = [(item['book'], item['quantity']) for item in validated_items]
+        low_stock_alerts = record_stock_alerts(sold)
+        leaderboards.count_sale(sold)
+        facet_change = facets.stage_sale(sold)
+        journal.record_sale(new_sale, sold, user_id=current_user.id if current_user else None)
+        record_order_in_caches(sold, facet_change)
+        
         db.session.commit()
         print("Sale committed to database successfully!")
         
@@ -572,7 +908,8 @@ def create_sale():
         return jsonify({
             'success': True,
             'data': sale_dict,
-            'message': 'Sale completed successfully'
+            'message': 'Sale completed successfully',
+            'alerts': low_stock_alerts
         }), 201
         
     except Exception as e:
@@ -582,26 +919,100 @@ def create_sale():
             'error': str(e)
         }), 500
 
+MAX_PAGE_SIZE = 500
+
+
+def sales_filters_from_request(allow_user_filter):
+    """
+    Turn the order-history query string into SQL filters
+    ?from=2025-01-01&to=2025-01-31   sale_date range (dates are inclusive)
+    ?status=completed                 only this status
+    ?min_total=20                     total_amount >= 20
+    ?user=3 | ?user=alice             one customer by id, username or email (admin only)
+    Raises ValueError with a readable message for bad values.
+    """
+    args = request.args
+    filters = []
+
+    def parse_when(value, name):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f'{name} must be a date like 2025-01-31')
+
+    if args.get('from'):
+        filters.append(Sale.sale_date >= parse_when(args['from'], 'from'))
+    if args.get('to'):
+        end = parse_when(args['to'], 'to')
+        if len(args['to']) == 10:
+            # A plain date means "up to the end of that day"
+            end += timedelta(days=1)
+            filters.append(Sale.sale_date < end)
+        else:
+            filters.append(Sale.sale_date <= end)
+    if args.get('status'):
+        filters.append(Sale.status == args['status'])
+    if args.get('min_total'):
+        try:
+            filters.append(Sale.total_amount >= float(args['min_total']))
+        except ValueError:
+            raise ValueError('min_total must be a number')
+    if args.get('user') and allow_user_filter:
+        value = args['user']
+        if value.isdigit():
+            filters.append(Sale.user_id == int(value))
+        else:
+            # Looked up first rather than as a subquery: the same filters also run
+            # against the sales archive, which may be a different database
+            user_ids = db.session.execute(
+                db.select(User.id).where((User.username == value) | (User.email == value))
+            ).scalars().all()
+            filters.append(Sale.user_id.in_(user_ids))
+    return filters
+
+
+def sales_list_response(filters):
+    """
+    Shared response for the order-history endpoints
+    Without ?limit the full list is returned like before. With ?limit=N the result is
+    paged newest first; pass the returned next_cursor as ?cursor= for the next page.
+    ?count=0 skips the total count and amount, which is the only part that isn't
+    constant time on a big history.
+    ?fields= and ?expand= (e.g. expand=items,items.book or fields=id,total_amount,user.username)
+    trim each order; nested users, items and books that aren't asked for aren't loaded.
+    """
+    fieldset = fieldset_from_request(Sale, read_models.SALE_RELATIONS)
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        sales_data = read_models.list_sales(*filters, fieldset=fieldset)
+        return jsonify({
+            'success': True,
+            'data': sales_data,
+            'count': len(sales_data)
+        }), 200
+
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        raise ValueError('limit must be a number')
+    with_total = request.args.get('count', '1').lower() not in ('0', 'false', 'no')
+    page = read_models.sales_page(*filters, limit=limit, cursor=request.args.get('cursor'),
+                                  with_total=with_total, fieldset=fieldset)
+    return jsonify({'success': True, **page}), 200
+
+
 @app.route('/api/sales', methods=['GET'])
+@use_read_replica
 @token_required
 @admin_required
 def get_all_sales(current_user):
-    """GET /api/sales - Get all sales (admin only)"""
+    """GET /api/sales - Get all sales (admin only), see sales_filters_from_request for filters"""
     try:
-        sales = Sale.query.order_by(Sale.sale_date.desc()).all()
-        
-        sales_data = []
-        for sale in sales:
-            sale_dict = sale.to_dict()
-            sale_dict['items'] = [item.to_dict() for item in sale.items]
-            sales_data.append(sale_dict)
-        
+        return sales_list_response(sales_filters_from_request(allow_user_filter=True))
+    except ValueError as e:
         return jsonify({
-            'success': True,
-            'data': sales_data,
-            'count': len(sales_data)
-        }), 200
-        
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -611,22 +1022,15 @@ def get_all_sales(current_user):
 @app.route('/api/sales/user', methods=['GET'])
 @token_required
 def get_user_sales(current_user):
-    """GET /api/sales/user - Get sales for current user"""
+    """GET /api/sales/user - Get sales for current user (same filters and paging as /api/sales)"""
     try:
-        sales = Sale.query.filter_by(user_id=current_user.id).order_by(Sale.sale_date.desc()).all()
-        
-        sales_data = []
-        for sale in sales:
-            sale_dict = sale.to_dict()
-            sale_dict['items'] = [item.to_dict() for item in sale.items]
-            sales_data.append(sale_dict)
-        
+        filters = sales_filters_from_request(allow_user_filter=False)
+        return sales_list_response([Sale.user_id == current_user.id, *filters])
+    except ValueError as e:
         return jsonify({
-            'success': True,
-            'data': sales_data,
-            'count': len(sales_data)
-        }), 200
-        
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -634,23 +1038,16 @@ def get_user_sales(current_user):
         }), 500
 
 @app.route('/api/sales/count', methods=['GET'])
+@use_read_replica
 def get_sales_count():
     """GET /api/sales/count - Get total number of sales (public endpoint for debugging)"""
     try:
         print("=== SALES COUNT ENDPOINT CALLED ===")
-        total_sales = Sale.query.count()
+        total_sales = read_models.count_sales()
         print(f"Total sales in database: {total_sales}")
         
-        recent_sales = Sale.query.order_by(Sale.sale_date.desc()).limit(5).all()
-        print(f"Recent sales found: {len(recent_sales)}")
-        
-        recent_sales_data = []
-        for sale in recent_sales:
-            print(f"Processing sale: {sale}")
-            sale_dict = sale.to_dict()
-            sale_dict['items'] = [item.to_dict() for item in sale.items]
-            recent_sales_data.append(sale_dict)
-            print(f"Sale dict: {sale_dict}")
+        recent_sales_data = read_models.list_sales(limit=5)
+        print(f"Recent sales found: {len(recent_sales_data)}")
         
         result = {
             'success': True,
@@ -701,29 +1098,24 @@ def internal_error(error):
     }), 500
 
 # ===============================
-# RUN THE APPLICATION
-# ===============================
-
-if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
-# ===============================
 # NOTIFICATIONS
 # ===============================
 from datetime import datetime
 
 @app.route('/api/notifications', methods=['GET'])
+@use_read_replica
 @token_required
 @admin_required
 def list_notifications(current_user):
-    q = Notification.query.order_by(Notification.created_at.desc())
+    filters = []
     unseen = (request.args.get('unseen') or "").lower()
     ntype = request.args.get('type')
     if unseen in ('1','true','yes'):
-        q = q.filter(Notification.seen_at.is_(None))
+        filters.append(Notification.seen_at.is_(None))
     if ntype:
-        q = q.filter(Notification.type == ntype)
-    rows = q.limit(200).all()
-    return jsonify({'success': True, 'data': [n.to_dict() for n in rows]})
+        filters.append(Notification.type == ntype)
+    rows = read_models.list_notifications(*filters, limit=200)
+    return jsonify({'success': True, 'data': rows})
 
 @app.route('/api/notifications/<int:nid>/ack', methods=['POST'])
 @token_required
@@ -744,12 +1136,16 @@ def ack_notification(current_user, nid):
 @token_required
 def get_sale_by_id(current_user, sale_id):
     sale = Sale.query.get(sale_id)
-    if not sale:
+    if sale:
+        data = sale.to_dict()
+        data['items'] = [i.to_dict() for i in sale.items]
+    else:
+        # Old orders are moved to the archive (see archive.py)
+        data = read_models.find_archived_sale(sale_id)
+    if not data:
         return jsonify({'success': False, 'error': 'Sale not found'}), 404
-    if current_user.role != 'admin' and sale.user_id != current_user.id:
+    if current_user.role != 'admin' and data['user_id'] != current_user.id:
         return jsonify({'success': False, 'error': 'Not allowed'}), 403
-    data = sale.to_dict()
-    data['items'] = [i.to_dict() for i in sale.items]
     return jsonify({'success': True, 'data': data})
 
 # ===============================
@@ -774,6 +1170,7 @@ def password_reset_request():
     return jsonify({'success': True, 'message': 'If the email exists, a reset token has been created.', 'token': token})
 
 @app.route('/api/password-reset/confirm', methods=['POST'])
+@limiter.limit('password_reset_confirm', identity=lambda data: data.get('token'))
 def password_reset_confirm():
     data = request.get_json(force=True) or {}
     token = (data.get('token') or "").strip()
@@ -790,3 +1187,102 @@ def password_reset_confirm():
     pr.used_at = datetime.utcnow()
     db.session.commit()
     return jsonify({'success': True, 'message': 'Password has been reset.'})
+
+# ===============================
+# ADMIN DASHBOARD
+# ===============================
+
+@app.route('/api/admin/dashboard', methods=['GET'])
+@use_read_replica
+@token_required
+@admin_required
+def admin_dashboard(current_user):
+    """GET /api/admin/dashboard - Today's orders and revenue, unseen notifications, stock and recent orders (admin only)"""
+    try:
+        response = jsonify({'success': True, 'data': dashboard.summary(app)})
+        # The numbers are at most this old anyway, so the browser may reuse them too
+        response.headers['Cache-Control'] = f"private, max-age={app.config['DASHBOARD_TTL_SECONDS']}"
+        return response, 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# ===============================
+# MAINTENANCE
+# ===============================
+
+@app.route('/api/admin/maintenance', methods=['GET'])
+@token_required
+@admin_required
+def maintenance_status(current_user):
+    """GET /api/admin/maintenance - Per-job metrics of the background maintenance jobs (admin only)"""
+    return jsonify({'success': True, 'data': maintenance.job_status(app)}), 200
+
+@app.route('/api/admin/admission', methods=['GET'])
+@token_required
+@admin_required
+def admission_status(current_user):
+    """GET /api/admin/admission - Running, waiting and rejected requests per priority class (this worker)"""
+    return jsonify({'success': True, 'data': admission.stats(app)}), 200
+
+@app.route('/api/admin/jobs', methods=['GET'])
+@token_required
+@admin_required
+def job_queue_status(current_user):
+    """GET /api/admin/jobs - Background job queue depth, lag and dead-lettered jobs (admin only)"""
+    return jsonify({
+        'success': True,
+        'data': jobs.queue_stats(app),
+        'dead': jobs.dead_jobs()
+    }), 200
+
+@app.route('/api/admin/jobs/<int:job_id>/retry', methods=['POST'])
+@token_required
+@admin_required
+def retry_job(current_user, job_id):
+    """POST /api/admin/jobs/5/retry - Put a dead-lettered job back in the queue (admin only)"""
+    if not jobs.retry(job_id):
+        return jsonify({'success': False, 'error': 'No dead job with that id'}), 404
+    return jsonify({'success': True, 'message': 'Job requeued'}), 200
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@token_required
+@admin_required
+def list_request_profiles(current_user):
+    """GET /api/admin/profiles - Stored request profiles, newest first (admin only), see profiling.py"""
+    profiles = profiling.list_profiles(app)
+    return jsonify({'success': True, 'data': profiles, 'count': len(profiles)}), 200
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+@token_required
+@admin_required
+def get_request_profile(current_user, profile_id):
+    """GET /api/admin/profiles/<id> - One profile with its SQL timings and hottest functions (admin only)"""
+    profile = profiling.get_profile(app, profile_id)
+    if profile is None:
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    return jsonify({'success': True, 'data': profile}), 200
+
+@app.route('/api/admin/profiles/<profile_id>/download', methods=['GET'])
+@token_required
+@admin_required
+def download_request_profile(current_user, profile_id):
+    """GET /api/admin/profiles/<id>/download - The .pstats or .collapsed (flame graph) file (admin only)"""
+    path = profiling.profile_file(app, profile_id)
+    if path is None:
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path),
+                     mimetype='application/octet-stream')
+
+# ===============================
+# RUN THE APPLICATION
+# ===============================
+
+# This is the single-process development server (debugger on).
+# For production use scripts/run_production.sh, which runs wsgi.py under gunicorn.
+if __name__ == '__main__':
+    # gunicorn starts these in post_worker_init; the development server needs them too
+    jobs.start_workers(app)
+    app.run(debug=True, host='0.0.0.0', port=5000)
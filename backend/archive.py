@@ -0,0 +1,117 @@
+# archive.py
+# Keeps the live sales tables small by moving old orders into an archive database.
+#
+# Completed orders older than ARCHIVE_AFTER_DAYS are copied, with their items, into
+# sales_archive / sale_items_archive and then deleted from sales / sale_items. The
+# archive tables live on their own SQLAlchemy bind ('archive'): with SQLite that is a
+# second file next to the main one (bookstore.db -> bookstore-archive.db), so the
+# main file - and its indexes, WAL and backups - only hold the recent, busy orders.
+# The weekly vacuum job gives the freed pages back to the disk.
+#
+# Archived orders keep their ids and look exactly the same through the API:
+#   - GET /api/sales/<id> looks in the archive when the order isn't live any more
+#   - the order lists and counts in read_models.py read both and merge them
+#   - the best-seller counters and recommendations are rebuilt from both
+#
+# Moving is done a chunk at a time: copy into the archive and commit, then delete from
+# the live tables and commit. If the process dies in between, the order is briefly in
+# both places and the next run copies it again (the copy replaces what is there), so
+# nothing is ever lost. Orders still referenced by a notification wait until the
+# notification is purged. The sales table is AUTOINCREMENT (database.py rebuilds older
+# SQLite files once), so an archived order's id is never handed out again.
+#
+# Usage (in app.py), BEFORE db.init_app(app) because it adds the bind:
+#   archive.init_app(app)
+# It runs daily as the archive_sales maintenance job, or by hand:
+#   python archive.py run
+#
+# Settings (app.config, the URL also from the environment):
+#   ARCHIVE_DATABASE_URL   where the archive tables live (default: next to the main SQLite
+#                          file, or the main database itself for Postgres/MySQL)
+#   ARCHIVE_AFTER_DAYS     completed orders older than this are archived (default 365)
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, exists, select
+from sqlalchemy.engine import make_url
+
+from models import db, ArchivedSale, ArchivedSaleItem, Notification, Sale, SaleItem
+
+ARCHIVE_BIND = 'archive'
+
+
+def default_archive_url(url):
+    """bookstore.db -> bookstore-archive.db in the same folder; other databases are reused as they are"""
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return url
+    stem, extension = os.path.splitext(url.database)
+    return url.set(database=f'{stem}-archive{extension or ".db"}')
+
+
+def init_app(app):
+    """Add the 'archive' bind; must run before db.init_app(app)"""
+    primary_url = app.config['SQLALCHEMY_DATABASE_URI']
+    app.config.setdefault('ARCHIVE_DATABASE_URL',
+                          os.getenv('ARCHIVE_DATABASE_URL') or default_archive_url(primary_url))
+    app.config.setdefault('ARCHIVE_AFTER_DAYS', 365)
+
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    binds.setdefault(ARCHIVE_BIND, {'url': app.config['ARCHIVE_DATABASE_URL'], 'pool_pre_ping': True})
+
+
+def _table_rows(table, rows):
+    """Row objects -> dicts keyed by column name, ready for an insert into `table`"""
+    names = [column.name for column in table.columns]
+    return [dict(zip(names, row)) for row in rows]
+
+
+def archive_sales(app):
+    """Move old completed orders into the archive; returns the number of orders moved"""
+    cutoff = datetime.utcnow() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'])
+    chunk_size = app.config.get('MAINTENANCE_CHUNK_SIZE', 1000)
+    sales_table = Sale.__table__
+    items_table = SaleItem.__table__
+
+    condition = (
+        (Sale.status == 'completed')
+        & (Sale.sale_date < cutoff)
+        & ~exists().where(Notification.sale_id == Sale.id)
+    )
+
+    moved = 0
+    while True:
+        sales = db.session.execute(select(sales_table).where(condition).order_by(Sale.id).limit(chunk_size)).all()
+        if not sales:
+            return moved
+        ids = [sale.id for sale in sales]
+        items = db.session.execute(select(items_table).where(SaleItem.sale_id.in_(ids))).all()
+
+        # 1. Copy (replacing anything a crashed earlier run left behind) and commit the archive
+        with db.engines[ARCHIVE_BIND].begin() as conn:
+            conn.execute(delete(ArchivedSaleItem).where(ArchivedSaleItem.sale_id.in_(ids)))
+            conn.execute(delete(ArchivedSale).where(ArchivedSale.id.in_(ids)))
+            archived_at = datetime.utcnow()
+            conn.execute(ArchivedSale.__table__.insert(),
+                         [{**row, 'archived_at': archived_at} for row in _table_rows(sales_table, sales)])
+            if items:
+                conn.execute(ArchivedSaleItem.__table__.insert(), _table_rows(items_table, items))
+
+        # 2. Only then remove them from the live tables
+        db.session.execute(delete(SaleItem).where(SaleItem.sale_id.in_(ids)))
+        db.session.execute(delete(Sale).where(Sale.id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sales archive')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('run', help='archive every order that is old enough now')
+    args = parser.parse_args()
+
+    from app import app as flask_app
+
+    with flask_app.app_context():
+        print(f"Archived {archive_sales(flask_app)} orders")
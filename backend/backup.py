@@ -0,0 +1,328 @@
+# backup.py
+# Online backups of the SQLite databases while the shop keeps taking orders.
+#
+# Copying bookstore.db with cp while it is being written can give a broken file, and
+# stopping the server for a backup means downtime. Instead this uses SQLite's backup
+# API, which copies the database page by page through a normal connection:
+#   - BACKUP_PAGES_PER_STEP pages are copied per step; between steps the source is
+#     unlocked for BACKUP_STEP_SLEEP seconds so orders can be written. (With WAL,
+#     see database.py, writers aren't blocked even during a step.)
+#   - if an order is written in the middle, SQLite restarts the copy so the result is
+#     always one consistent moment. After BACKUP_MAX_RESTARTS restarts the rest is
+#     copied in a single step, so a busy shop can't keep a backup from finishing.
+#   - the copy is checked with PRAGMA quick_check, gzipped, and stored with a
+#     manifest (.json) holding the SHA-256 of the database and of the .gz file and
+#     the duration, size and bytes per second.
+#   - when nothing changed since the previous backup of that database (same
+#     SHA-256), no new file is kept, so running it every few minutes costs little disk.
+#
+# The main database and the order archive (see archive.py) are backed up together.
+# Databases that aren't SQLite are skipped; use the server's own tools (pg_dump) there.
+#
+# It runs as the backup_databases maintenance job (hourly, change it with
+# MAINTENANCE_INTERVALS) or by hand, in backend/:
+#   python backup.py create                 back up every SQLite database now
+#   python backup.py list                   show the backups and their metrics
+#   python backup.py verify FILE.db.gz      check the checksums and the database inside
+#   python backup.py restore FILE.db.gz     verify, then copy it back over the live database
+#
+# A restore also goes through the backup API, so open connections see the restored
+# data straight away. Restart the workers afterwards so their in-memory caches
+# (best sellers, recommendations) are rebuilt.
+#
+# Settings (app.config):
+#   BACKUP_DIR               where backups go (default instance/backups)
+#   BACKUP_KEEP              backups kept per database, oldest deleted first (default 48)
+#   BACKUP_PAGES_PER_STEP    pages copied per step (default 1024, 4 MB with 4 KB pages)
+#   BACKUP_STEP_SLEEP        pause between steps in seconds (default 0.005)
+#   BACKUP_MAX_RESTARTS      restarts before copying the rest in one step (default 5)
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+from flask import current_app
+
+from models import db
+
+# Bind names that are only a second way into another database (read_replica.py)
+SKIP_BINDS = {'reads'}
+
+HASH_CHUNK = 1024 * 1024
+
+
+class BackupError(Exception):
+    """A backup file that is missing, damaged or doesn't match its manifest"""
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def init_app(app):
+    app.config.setdefault('BACKUP_DIR', os.path.join(app.instance_path, 'backups'))
+    app.config.setdefault('BACKUP_KEEP', 48)
+    app.config.setdefault('BACKUP_PAGES_PER_STEP', 1024)
+    app.config.setdefault('BACKUP_STEP_SLEEP', 0.005)
+    app.config.setdefault('BACKUP_MAX_RESTARTS', 5)
+
+
+def sqlite_databases():
+    """{name: file path} for every SQLite database the app uses ('main' for the default bind)"""
+    databases = {}
+    for bind_key, engine in db.engines.items():
+        if bind_key in SKIP_BINDS or engine.dialect.name != 'sqlite':
+            continue
+        path = engine.url.database
+        if not path or path == ':memory:':
+            continue
+        databases[bind_key or 'main'] = path
+    return databases
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _quick_check(path):
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        result = connection.execute('PRAGMA quick_check').fetchone()[0]
+    finally:
+        connection.close()
+    if result != 'ok':
+        raise BackupError(f'{path} failed quick_check: {result}')
+
+
+def copy_database(source_path, target_path, pages_per_step, step_sleep, max_restarts):
+    """
+    Copy a live SQLite database to target_path with the backup API
+    Returns (pages, restarts).
+    """
+    state = {'remaining': None, 'restarts': 0, 'pages': 0}
+
+    def progress(status, remaining, total):
+        # No progress means a write came in and SQLite started over
+        if state['remaining'] is not None and remaining >= state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > max_restarts:
+                raise _TooManyRestarts()
+        state['remaining'] = remaining
+        state['pages'] = total
+        time.sleep(step_sleep)
+
+    source = sqlite3.connect(source_path, timeout=30)
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            try:
+                source.backup(target, pages=pages_per_step, progress=progress)
+            except _TooManyRestarts:
+                # Writers keep moving the goalposts: take the rest in one go
+                source.backup(target, pages=-1)
+            # The copy inherits WAL mode from the live file, and every later open of it
+            # would leave -wal/-shm files behind; a backup is one plain file
+            target.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            target.close()
+    finally:
+        source.close()
+    return state['pages'], state['restarts']
+
+
+def _remove_database(path):
+    """Delete a scratch database file and the -wal/-shm files SQLite may have left next to it"""
+    for leftover in (path, path + '-wal', path + '-shm'):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+
+def _manifests(backup_dir, name=None):
+    """Manifests newest first, optionally only for one database"""
+    pattern = os.path.join(backup_dir, f'{name or "*"}-*.json')
+    manifests = []
+    for path in glob.glob(pattern):
+        with open(path) as f:
+            manifests.append(json.load(f))
+    manifests.sort(key=lambda manifest: manifest['started_at'], reverse=True)
+    return manifests
+
+
+def _prune(backup_dir, name, keep):
+    for manifest in _manifests(backup_dir, name)[keep:]:
+        for path in (manifest['file'], manifest['file'][:-len('.db.gz')] + '.json'):
+            full_path = os.path.join(backup_dir, path)
+            if os.path.exists(full_path):
+                os.remove(full_path)
+    # -wal/-shm files whose database is gone (older versions left them behind)
+    pattern = os.path.join(backup_dir, f'{name}-*')
+    for leftover in glob.glob(pattern + '-wal') + glob.glob(pattern + '-shm'):
+        if not os.path.exists(leftover[:-len('-wal')]):
+            os.remove(leftover)
+
+
+def backup_one(app, name, source_path):
+    """Back up one database; returns its manifest (with 'skipped': True when nothing changed)"""
+    config = app.config
+    backup_dir = config['BACKUP_DIR']
+    os.makedirs(backup_dir, exist_ok=True)
+    started_at = datetime.utcnow()
+    stem = f"{name}-{started_at.strftime('%Y%m%dT%H%M%S%f')}"
+    raw_path = os.path.join(backup_dir, stem + '.db.tmp')
+    start = time.perf_counter()
+
+    try:
+        pages, restarts = copy_database(source_path, raw_path, config['BACKUP_PAGES_PER_STEP'],
+                                        config['BACKUP_STEP_SLEEP'], config['BACKUP_MAX_RESTARTS'])
+        copied_in = time.perf_counter() - start
+        _quick_check(raw_path)
+        size = os.path.getsize(raw_path)
+        sha256 = _sha256(raw_path)
+
+        manifest = {
+            'database': name,
+            'source': source_path,
+            'started_at': started_at.isoformat(),
+            'pages': pages,
+            'restarts': restarts,
+            'bytes': size,
+            'sha256': sha256,
+            'copy_seconds': round(copied_in, 3),
+        }
+        previous = _manifests(backup_dir, name)
+        if previous and previous[0]['sha256'] == sha256:
+            manifest.update(skipped=True, file=previous[0]['file'],
+                            duration_seconds=round(time.perf_counter() - start, 3))
+            return manifest
+
+        gz_path = os.path.join(backup_dir, stem + '.db.gz')
+        with open(raw_path, 'rb') as raw, gzip.open(gz_path + '.tmp', 'wb', compresslevel=6) as packed:
+            shutil.copyfileobj(raw, packed, HASH_CHUNK)
+        os.replace(gz_path + '.tmp', gz_path)
+    finally:
+        _remove_database(raw_path)
+
+    duration = time.perf_counter() - start
+    manifest.update(
+        skipped=False,
+        file=os.path.basename(gz_path),
+        compressed_bytes=os.path.getsize(gz_path),
+        compressed_sha256=_sha256(gz_path),
+        duration_seconds=round(duration, 3),
+        bytes_per_second=round(size / duration) if duration > 0 else None,
+    )
+    # The manifest is written last: a backup without one is unfinished and is ignored
+    with open(os.path.join(backup_dir, stem + '.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    _prune(backup_dir, name, config['BACKUP_KEEP'])
+    return manifest
+
+
+def backup_all(app):
+    """Back up every SQLite database; returns the list of manifests"""
+    manifests = []
+    for name, path in sqlite_databases().items():
+        manifest = backup_one(app, name, path)
+        if manifest['skipped']:
+            print(f"Backup {name}: unchanged since {manifest['file']}")
+        else:
+            print(f"Backup {name}: {manifest['file']} {manifest['bytes']} bytes -> "
+                  f"{manifest['compressed_bytes']} in {manifest['duration_seconds']}s "
+                  f"({manifest['bytes_per_second']} bytes/s, {manifest['restarts']} restarts)")
+        manifests.append(manifest)
+    return manifests
+
+
+def _manifest_for(gz_path):
+    manifest_path = gz_path[:-len('.db.gz')] + '.json' if gz_path.endswith('.db.gz') else None
+    if not manifest_path or not os.path.exists(manifest_path):
+        raise BackupError(f'No manifest next to {gz_path}')
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def verify(gz_path, unpack_to=None):
+    """
+    Check a backup against its manifest and run quick_check on the database inside
+    Returns the manifest. With unpack_to, the checked database is left at that path.
+    """
+    manifest = _manifest_for(gz_path)
+    if _sha256(gz_path) != manifest['compressed_sha256']:
+        raise BackupError(f'{gz_path}: compressed file checksum does not match')
+
+    raw_path = unpack_to or gz_path[:-len('.gz')] + '.verify'
+    try:
+        with gzip.open(gz_path, 'rb') as packed, open(raw_path, 'wb') as raw:
+            shutil.copyfileobj(packed, raw, HASH_CHUNK)
+        if _sha256(raw_path) != manifest['sha256']:
+            raise BackupError(f'{gz_path}: database checksum does not match')
+        _quick_check(raw_path)
+    except Exception:
+        _remove_database(raw_path)
+        raise
+    if unpack_to is None:
+        _remove_database(raw_path)
+    return manifest
+
+
+def restore(gz_path, target_path=None):
+    """Verify a backup and copy it over the live database (target_path or the one it came from)"""
+    raw_path = gz_path[:-len('.gz')] + '.restore'
+    manifest = verify(gz_path, unpack_to=raw_path)
+    try:
+        target_path = target_path or sqlite_databases().get(manifest['database'])
+        if not target_path:
+            raise BackupError(f"Don't know where database '{manifest['database']}' lives; pass a target")
+        source = sqlite3.connect(raw_path)
+        target = sqlite3.connect(target_path, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    finally:
+        _remove_database(raw_path)
+    return target_path
+
+
+def backup_databases(app):
+    """Maintenance job; returns the number of pages copied"""
+    return sum(manifest['pages'] for manifest in backup_all(app))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Online SQLite backups')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('create', help='back up every SQLite database now')
+    sub.add_parser('list', help='show the backups and their metrics')
+    verify_parser = sub.add_parser('verify', help='check a backup file')
+    verify_parser.add_argument('file')
+    restore_parser = sub.add_parser('restore', help='verify a backup and copy it over the live database')
+    restore_parser.add_argument('file')
+    restore_parser.add_argument('--target', help='database file to restore into (default: where it came from)')
+    args = parser.parse_args()
+
+    from app import app as flask_app
+
+    with flask_app.app_context():
+        if args.command == 'create':
+            backup_all(flask_app)
+        elif args.command == 'list':
+            for manifest in _manifests(current_app.config['BACKUP_DIR']):
+                print(f"{manifest['file']}  {manifest['bytes']} bytes  {manifest['compressed_bytes']} gz  "
+                      f"{manifest['duration_seconds']}s  {manifest['bytes_per_second']} bytes/s")
+        elif args.command == 'verify':
+            manifest = verify(args.file)
+            print(f"OK: {manifest['database']} from {manifest['started_at']}, sha256 {manifest['sha256']}")
+        elif args.command == 'restore':
+            print(f"Restored {args.file} into {restore(args.file, args.target)}")
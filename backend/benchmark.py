@@ -0,0 +1,121 @@
+# benchmark.py
+# Small load generator for comparing server setups (dev server vs gunicorn, etc.)
+# It only uses the standard library so it runs anywhere the backend runs.
+#
+#   python benchmark.py --url http://localhost:5000 --concurrency 16 --requests 2000
+#   python benchmark.py --path /api/books --path /api/health
+#   python benchmark.py --path /api/sales --token <admin jwt> --accept-encoding gzip --pid <server pid>
+#
+# bytes/req is what actually went over the wire (compressed size when --accept-encoding is used).
+# --pid (Linux only, repeatable) also reports the server CPU time spent per request.
+#
+# Start the server you want to measure first; this script only sends requests.
+import argparse
+import os
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PATHS = ['/api/health', '/api/books', '/api/books/1']
+
+
+def fetch(url, headers):
+    """Send one GET request and return (status, seconds taken, body bytes received)"""
+    req = urllib.request.Request(url, headers=headers)
+    start = time.perf_counter()
+    size = 0
+    try:
+        # urllib never decompresses, so len(body) is the on-the-wire size
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            size = len(resp.read())
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return status, time.perf_counter() - start, size
+
+
+def cpu_seconds(pids):
+    """Total user+system CPU seconds used so far by the given processes (Linux /proc)"""
+    total = 0
+    ticks = os.sysconf('SC_CLK_TCK')
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        total += (int(fields[11]) + int(fields[12])) / ticks
+    return total
+
+
+def run(base_url, path, concurrency, total, headers, pids=()):
+    """Fire `total` requests at one path using `concurrency` threads"""
+    url = base_url.rstrip('/') + path
+    latencies = []
+    errors = 0
+    received = 0
+    lock = threading.Lock()
+
+    def worker(_):
+        nonlocal errors, received
+        status, elapsed, size = fetch(url, headers)
+        with lock:
+            latencies.append(elapsed)
+            received += size
+            if status != 200:
+                errors += 1
+
+    cpu_before = cpu_seconds(pids)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(total)))
+    wall = time.perf_counter() - start
+    cpu_used = cpu_seconds(pids) - cpu_before
+
+    latencies.sort()
+    return {
+        'path': path,
+        'requests': total,
+        'errors': errors,
+        'rps': total / wall,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'bytes': received / total,
+        'cpu_ms': cpu_used / total * 1000 if pids else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bookstore API')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--path', action='append', dest='paths',
+                        help='endpoint to hit (repeatable, default: a few public endpoints)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--token', help='JWT for admin-only endpoints')
+    parser.add_argument('--accept-encoding', help='e.g. gzip or zstd to measure response compression')
+    parser.add_argument('--pid', type=int, action='append', dest='pids', default=[],
+                        help='server process id(s) to measure CPU for (Linux only, repeatable)')
+    args = parser.parse_args()
+
+    headers = {}
+    if args.token:
+        headers['Authorization'] = f'Bearer {args.token}'
+    if args.accept_encoding:
+        headers['Accept-Encoding'] = args.accept_encoding
+
+    print(f"{'path':<28}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'bytes/req':>12}{'cpu ms/req':>12}{'errors':>8}")
+    for path in args.paths or DEFAULT_PATHS:
+        result = run(args.url, path, args.concurrency, args.requests, headers, args.pids)
+        cpu = f"{result['cpu_ms']:.2f}" if result['cpu_ms'] is not None else '-'
+        print(f"{result['path']:<28}{result['rps']:>10.1f}{result['p50_ms']:>10.2f}"
+              f"{result['p99_ms']:>10.2f}{result['bytes']:>12.0f}{cpu:>12}{result['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
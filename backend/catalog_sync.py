@@ -0,0 +1,223 @@
+# catalog_sync.py
+# Delta sync for the book catalog: GET /api/books/changes?since=N
+#
+# Clients that keep a copy of the catalog (inventory.html, the POS terminals) used
+# to download every book to see what changed. Instead they now ask for the changes
+# after the last number they saw:
+#   - every transaction that inserts, updates (including a sale's stock change) or
+#     deletes books takes the next number from the sync_sequence row and stamps it on
+#     books.change_seq (indexed), so "changed after N" is a range scan
+#   - a deleted book leaves a tombstone (book_tombstones) with its number
+#   - the response lists the changed books and the deleted ids in sequence order,
+#     and next_since to pass the next time (a number, or "number-book id" when a
+#     page ends part way through one change); since=0 is a full download
+# So a client that is up to date pays for one small query, and the rest costs in
+# proportion to the churn, not the catalog size.
+#
+# Taking the number is an UPDATE of the one sync_sequence row, which also holds that
+# row's lock until the commit. Transactions therefore commit in the order of their
+# numbers, and a client can never skip a change that commits later with a lower one.
+#
+# The stamping happens in a before_flush hook, so every code path that changes books
+# through the session is covered without calling anything. Only bulk UPDATE/DELETE
+# statements on books would bypass it.
+#
+# Tombstones older than SYNC_TOMBSTONE_DAYS are removed by the purge_tombstones
+# maintenance job. A client whose since is from before the newest removed tombstone
+# (or is newer than the sequence, e.g. after a restore from a backup) gets
+# "reset": true and has to start over from since=0.
+#
+# Settings (app.config):
+#   SYNC_PAGE_SIZE         changes per response (default 500, ?limit= up to SYNC_MAX_PAGE_SIZE)
+#   SYNC_MAX_PAGE_SIZE     (default 5000)
+#   SYNC_TOMBSTONE_DAYS    how long deletes are remembered (default 90)
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, event, insert, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from models import db, Book, BookTombstone, SyncSequence
+from read_models import columns_for, rows_to_dicts
+
+_sequence = SyncSequence.__table__
+_tombstones = BookTombstone.__table__
+
+
+def init_app(app):
+    app.config.setdefault('SYNC_PAGE_SIZE', 500)
+    app.config.setdefault('SYNC_MAX_PAGE_SIZE', 5000)
+    app.config.setdefault('SYNC_TOMBSTONE_DAYS', 90)
+
+
+# ===============================
+# SEQUENCE NUMBERS
+# ===============================
+
+def next_sequence(connection):
+    """Take the next change number (inside the caller's transaction)"""
+    result = connection.execute(update(_sequence).where(_sequence.c.id == 1).values(value=_sequence.c.value + 1))
+    if result.rowcount == 0:
+        connection.execute(insert(_sequence).values(id=1, value=1, purged_through=0))
+        return 1
+    # Our UPDATE holds the row until the commit, so this reads our own number
+    return connection.execute(select(_sequence.c.value).where(_sequence.c.id == 1)).scalar()
+
+
+def current_sequence():
+    """(last number handed out, newest purged tombstone)"""
+    row = db.session.execute(select(_sequence.c.value, _sequence.c.purged_through).where(_sequence.c.id == 1)).first()
+    return (row.value, row.purged_through) if row else (0, 0)
+
+
+def _transaction_sequence(session):
+    """One number per transaction, however many flushes it does"""
+    if 'sync_seq' not in session.info:
+        session.info['sync_seq'] = next_sequence(session.connection())
+    return session.info['sync_seq']
+
+
+@event.listens_for(Session, 'before_flush')
+def _stamp_books(session, flush_context, instances):
+    changed = [obj for obj in session.new if isinstance(obj, Book)]
+    changed += [obj for obj in session.dirty
+                if isinstance(obj, Book) and session.is_modified(obj, include_collections=False)]
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, Book)]
+    if not changed and not deleted:
+        return
+    seq = _transaction_sequence(session)
+    for book in changed:
+        book.change_seq = seq
+    session.info.setdefault('sync_new_books', []).extend(obj for obj in changed if obj.id is None)
+    session.info.setdefault('sync_deleted_ids', []).extend(deleted)
+
+
+@event.listens_for(Session, 'after_flush')
+def _write_tombstones(session, flush_context):
+    new_ids = [book.id for book in session.info.pop('sync_new_books', [])]
+    deleted_ids = session.info.pop('sync_deleted_ids', [])
+    if not new_ids and not deleted_ids:
+        return
+    connection = session.connection()
+    # SQLite can hand a deleted book's id to a new book; the new book wins
+    touched = new_ids + deleted_ids
+    connection.execute(delete(_tombstones).where(_tombstones.c.book_id.in_(touched)))
+    if deleted_ids:
+        seq, now = session.info['sync_seq'], datetime.utcnow()
+        connection.execute(insert(_tombstones),
+                           [{'book_id': book_id, 'change_seq': seq, 'deleted_at': now} for book_id in deleted_ids])
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _forget_sequence(session):
+    for key in ('sync_seq', 'sync_new_books', 'sync_deleted_ids'):
+        session.info.pop(key, None)
+
+
+def stamp_unsequenced_books():
+    """Give books written before this existed (or by bulk scripts) a number; returns how many"""
+    if db.session.execute(select(Book.id).where(Book.change_seq.is_(None)).limit(1)).first() is None:
+        return 0
+    seq = next_sequence(db.session.connection())
+    # updated_at is set to itself, or its onupdate would give every book today's date
+    stamped = db.session.execute(
+        update(Book).where(Book.change_seq.is_(None)).values(change_seq=seq, updated_at=Book.updated_at)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return stamped
+
+
+# ===============================
+# READING CHANGES
+# ===============================
+
+def parse_token(token):
+    """'1234' or '1234-56' (part way through change 1234, after book 56) -> (1234, 56 or None)"""
+    seq, _, after_id = (token or '0').partition('-')
+    try:
+        seq, after_id = int(seq), int(after_id) if after_id else None
+    except ValueError:
+        raise ValueError('since must be a token returned by this endpoint (or 0)')
+    if seq < 0:
+        raise ValueError('since must be a token returned by this endpoint (or 0)')
+    return seq, after_id
+
+
+def changes_since(app, token, limit=None, names=None):
+    """
+    Books changed and deleted after the `token` from an earlier call, oldest change first
+    names limits the book fields like ?fields= does (id is always sent).
+    Returns {'changed': [book dicts], 'deleted': [ids], 'next_since', 'has_more', 'reset'}.
+    Raises ValueError for a malformed token.
+    """
+    limit = limit or app.config['SYNC_PAGE_SIZE']
+    since, after_id = parse_token(token)
+    current, purged_through = current_sequence()
+    # Only a caught-up token is checked against purged deletes: a "number-id" token is
+    # the middle of a sync (maybe the first download) that passed this check already
+    if since > current or (after_id is None and since and since < purged_through):
+        db.session.rollback()
+        return {'changed': [], 'deleted': [], 'next_since': '0', 'has_more': True, 'reset': True}
+
+    if names:
+        names = ('id',) + tuple(name for name in names if name != 'id')
+    books_stmt = select(*columns_for(Book, names=names), Book.change_seq.label('_change_seq'))
+    tombstones_stmt = select(_tombstones.c.book_id, _tombstones.c.change_seq)
+    # Pages are cut by (change number, book id): one big change (like the first
+    # numbering of an old catalog) can span several pages without losing rows
+    if after_id is None:
+        books_stmt = books_stmt.where(Book.change_seq > since)
+        tombstones_stmt = tombstones_stmt.where(_tombstones.c.change_seq > since)
+    else:
+        books_stmt = books_stmt.where(tuple_(Book.change_seq, Book.id) > tuple_(since, after_id))
+        tombstones_stmt = tombstones_stmt.where(
+            tuple_(_tombstones.c.change_seq, _tombstones.c.book_id) > tuple_(since, after_id))
+
+    entries = []
+    for book in rows_to_dicts(db.session.execute(books_stmt.order_by(Book.change_seq, Book.id).limit(limit + 1))):
+        entries.append((book.pop('_change_seq'), book['id'], book))
+    # A full download (since=0) has no use for deletes
+    if since or after_id is not None:
+        tombstones_stmt = tombstones_stmt.order_by(_tombstones.c.change_seq, _tombstones.c.book_id).limit(limit + 1)
+        entries += [(row.change_seq, row.book_id, None) for row in db.session.execute(tombstones_stmt)]
+    db.session.rollback()
+
+    entries.sort(key=lambda entry: (entry[0], entry[1]))
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    if has_more:
+        next_since = f'{entries[-1][0]}-{entries[-1][1]}'
+    else:
+        # current was read in the same snapshot, and numbers commit in order, so
+        # everything up to it has been sent (or was a delete a full download skips)
+        next_since = str(current)
+    return {
+        'changed': [book for _, _, book in entries if book is not None],
+        'deleted': [book_id for _, book_id, book in entries if book is None],
+        'next_since': next_since,
+        'has_more': has_more,
+        'reset': False,
+    }
+
+
+def purge_tombstones(app):
+    """Maintenance job: forget deletes older than SYNC_TOMBSTONE_DAYS; returns the number removed"""
+    cutoff = datetime.utcnow() - timedelta(days=app.config['SYNC_TOMBSTONE_DAYS'])
+    chunk_size = app.config.get('MAINTENANCE_CHUNK_SIZE', 500)
+    removed = 0
+    while True:
+        rows = db.session.execute(
+            select(_tombstones.c.book_id, _tombstones.c.change_seq)
+            .where(_tombstones.c.deleted_at < cutoff).limit(chunk_size)
+        ).all()
+        if not rows:
+            return removed
+        newest = max(row.change_seq for row in rows)
+        db.session.execute(delete(_tombstones).where(_tombstones.c.book_id.in_([row.book_id for row in rows])))
+        # Clients that synced before these deletes can no longer catch up with them
+        db.session.execute(update(_sequence).where(_sequence.c.id == 1)
+                           .values(purged_through=case((_sequence.c.purged_through < newest, newest),
+                                                       else_=_sequence.c.purged_through)))
+        db.session.commit()
+        removed += len(rows)
@@ -0,0 +1,86 @@
+# dashboard.py
+# Headline numbers for the admin pages in one request: GET /api/admin/dashboard
+#
+#   today            completed orders and their revenue since midnight (UTC, like sale_date)
+#   notifications    unseen notifications per type, and in total
+#   books            books in the catalog, and how many are at or below their reorder point
+#   recent_orders    the newest DASHBOARD_RECENT_ORDERS orders (no items)
+#
+# The admin pages used to download the whole book, sales and notification lists just
+# to show these. Here each number is one aggregate query (the low-stock count is a
+# range on ix_books_stock_below_reorder), five small queries in all, run on the
+# read-only connections.
+#
+# The result is cached in each worker for DASHBOARD_TTL_SECONDS. Requests that arrive
+# while it is being rebuilt wait for that one rebuild instead of starting their own,
+# so however many admins leave the page open, each worker runs the queries at most
+# once per TTL.
+#
+# Usage (in app.py):
+#   dashboard.init_app(app)
+#   dashboard.summary(app)      the dict, from the cache when it is fresh enough
+#
+# Settings (app.config):
+#   DASHBOARD_TTL_SECONDS      how long a result is reused (default 10)
+#   DASHBOARD_RECENT_ORDERS    orders listed (default 10)
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from models import Book, Notification, Sale
+from read_models import SALE_RELATIONS, list_sales, parse_fieldset
+from read_replica import reader
+
+# What recent_orders shows of each order
+RECENT_ORDER_FIELDS = 'id,customer_email,total_amount,sale_date,status,user.username'
+
+_lock = threading.Lock()
+_state = {'built_at': None, 'data': None}
+
+
+def init_app(app):
+    app.config.setdefault('DASHBOARD_TTL_SECONDS', 10)
+    app.config.setdefault('DASHBOARD_RECENT_ORDERS', 10)
+
+
+def build(app):
+    """Run the queries; returns the dashboard dict"""
+    now = datetime.utcnow()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    connection = reader()
+
+    # Pending and cancelled orders aren't revenue
+    today = connection.execute(
+        select(func.count(Sale.id), func.coalesce(func.sum(Sale.total_amount), 0))
+        .where(Sale.status == 'completed', Sale.sale_date >= midnight)
+    ).one()
+    unseen = dict(connection.execute(
+        select(Notification.type, func.count(Notification.id))
+        .where(Notification.seen_at.is_(None))
+        .group_by(Notification.type)
+    ).all())
+    total_books = connection.execute(select(func.count(Book.id))).scalar()
+    low_stock = connection.execute(select(func.count(Book.id)).where(Book.stock_gap() <= 0)).scalar()
+    # Every placed order, whatever its status (carts aren't orders yet)
+    recent = list_sales(Sale.status != 'cart', limit=app.config['DASHBOARD_RECENT_ORDERS'],
+                        fieldset=parse_fieldset(Sale, SALE_RELATIONS, fields=RECENT_ORDER_FIELDS))
+
+    return {
+        'today': {'orders': today[0], 'revenue': round(today[1], 2), 'since': midnight},
+        'notifications': {'unseen': sum(unseen.values()), 'unseen_by_type': unseen},
+        'books': {'total': total_books, 'low_stock': low_stock},
+        'recent_orders': recent,
+        'generated_at': now,
+    }
+
+
+def summary(app):
+    """The dashboard dict, rebuilt at most once per DASHBOARD_TTL_SECONDS in this worker"""
+    with _lock:
+        built_at = _state['built_at']
+        if built_at is None or time.monotonic() - built_at >= app.config['DASHBOARD_TTL_SECONDS']:
+            _state['data'] = build(app)
+            _state['built_at'] = time.monotonic()
+        return _state['data']
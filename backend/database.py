@@ -2,8 +2,109 @@
 # Now it creates both books and users
 
 # Import our database models
-from models import db, Book, User, Sale, SaleItem
+from models import db, ArchivedSale, Book, User, Sale, SaleItem, BookSalesHourly
+from leaderboards import rebuild_counters
+from journal import ensure_baseline
+from catalog_sync import stamp_unsequenced_books
 from datetime import date
+import sqlite3
+from sqlalchemy import MetaData, event, func, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+
+@event.listens_for(Engine, "connect")
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """
+    Runs every time a new SQLite connection is opened
+    WAL mode lets readers keep going while a writer commits, and busy_timeout
+    makes a second worker process wait for the lock instead of failing with
+    "database is locked" when two orders are placed at the same moment
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+def dispose_engines(app):
+    """
+    Throw away any database connections inherited from a parent process
+    gunicorn calls this right after it forks a worker. Sharing a SQLite (or any
+    DB) connection between processes corrupts it, so each worker must open its own.
+    close=False leaves the parent's connections alone so the master stays usable.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def upgrade_schema():
+    """
+    Add columns and indexes that newer versions of the models define
+    db.create_all() only creates tables that are missing completely, so a database
+    made by an older version of the app (like the bookstore.db in the repo) would
+    never get them. New columns are added with their server_default (or NULL).
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                if column.server_default is not None:
+                    ddl += f' DEFAULT {column.server_default.arg}'
+                conn.execute(text(ddl))
+            for index in table.indexes:
+                # IF NOT EXISTS rather than checkfirst: SQLite's inspector can't see
+                # expression indexes, so checkfirst would try to create them every time
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def upgrade_sales_autoincrement():
+    """
+    Rebuild an old SQLite sales table with AUTOINCREMENT; returns True if it did
+    Without it SQLite gives a new order max(id) + 1, which can be the id of an order
+    that was archived (or a cart that was purged). SQLite can't add AUTOINCREMENT to a
+    table, so it is recreated the documented way: new table, copy, drop, rename.
+    The counter starts above every id in the sales and sales_archive tables.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    with db.engine.connect() as conn:
+        sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'sales'")).scalar()
+    if sql is None or 'AUTOINCREMENT' in sql.upper():
+        return False
+
+    archived_max = db.session.execute(select(func.max(ArchivedSale.id))).scalar() or 0
+    db.session.rollback()
+    # A separate MetaData, so create_all() never sees sales_new (users is there for the foreign key)
+    metadata = MetaData()
+    User.__table__.to_metadata(metadata)
+    new_table = Sale.__table__.to_metadata(metadata, name='sales_new')
+    columns = ', '.join(column['name'] for column in inspect(db.engine).get_columns('sales'))
+    # Foreign keys aren't switched on for these connections, so sale_items and
+    # notifications simply point at the new table once it has the old name
+    with db.engine.begin() as conn:
+        conn.execute(CreateTable(new_table))
+        conn.exec_driver_sql(f'INSERT INTO sales_new ({columns}) SELECT {columns} FROM sales')
+        conn.exec_driver_sql('DROP TABLE sales')
+        conn.exec_driver_sql('ALTER TABLE sales_new RENAME TO sales')
+        for index in Sale.__table__.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+        # The copy set the counter to the highest live id; archived ids count too
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'sales'"))
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) "
+                          "SELECT 'sales', MAX(COALESCE((SELECT MAX(id) FROM sales), 0), :archived)"),
+                     {'archived': archived_max})
+    return True
+
 
 def init_database(app):
     """
@@ -15,6 +116,14 @@ def init_database(app):
         # Create all the database tables
         # This creates both 'books' and 'users' tables
         db.create_all()
+        upgrade_schema()
+        if upgrade_sales_autoincrement():
+            print("Sales table rebuilt so order ids are never reused")
+
+        # Databases from before the best-seller counters existed: fill them from the sales history
+        if BookSalesHourly.query.first() is None and Sale.query.filter_by(status='completed').first() is not None:
+            print("Building best-seller counters from past sales...")
+            rebuild_counters()
         
         # Add sample users if they don't exist
         if User.query.first() is None:
@@ -87,4 +196,13 @@ def init_database(app):
                 db.session.add(book)
             
             db.session.commit()
-            print("Sample books created!")
\ No newline at end of file
+            print("Sample books created!")
+
+        # Databases from before the inventory journal existed: start it with the current stock
+        if ensure_baseline():
+            print("Inventory journal started with the current stock levels")
+
+        # Books from before the change sequence existed (or from bulk scripts): number them
+        # so /api/books/changes?since=0 includes them
+        if stamp_unsequenced_books():
+            print("Catalog change sequence started")
\ No newline at end of file
@@ -0,0 +1,234 @@
+# facets.py
+# Counts for the store's filter sidebar: GET /api/books/facets
+#
+#   genres         books per genre, most first
+#   authors        the FACET_TOP_AUTHORS authors with the most books
+#   price_buckets  books per price range (PRICE_BUCKETS)
+#   availability   in stock vs out of stock
+# optionally for only the books matching a filter (genre, author, price range,
+# in stock, search text).
+#
+# The counts are GROUP BY queries, cached in each worker against the catalog
+# version: a number in the catalog_version table that goes up in the same
+# transaction as every change that can move a count (a book added, edited or
+# deleted, or a sale that takes the last copy). A request only reads that one row;
+# while it matches the cache, no counting query runs.
+#
+# The worker that makes a change updates its unfiltered counts in place instead of
+# recounting:
+#   change = facets.stage_book_change(before, after)   before the commit (bumps the version)
+#   db.session.commit()
+#   facets.apply(change)                               after the commit
+# (stage_sale(sold) does the same for the books an order took out of stock.) Other
+# workers see the new version and recount on their next request. Filtered counts
+# are simply dropped when the version moves.
+#
+# Settings (app.config):
+#   FACET_TOP_AUTHORS       authors listed (default 20)
+#   FACET_CACHE_FILTERS     filtered results kept per worker (default 256)
+import threading
+from collections import Counter, OrderedDict
+
+from sqlalchemy import case, func, select, update
+
+from models import db, Book, CatalogVersion
+
+# Upper bounds of the price ranges; the last range has no upper bound
+PRICE_BUCKETS = (10, 20, 30, 50, 100)
+
+
+def price_bucket(price):
+    """Index of the price range a price falls in"""
+    for index, upper in enumerate(PRICE_BUCKETS):
+        if (price or 0) < upper:
+            return index
+    return len(PRICE_BUCKETS)
+
+
+def price_bucket_column():
+    """price_bucket() as SQL"""
+    return case(
+        *[(func.coalesce(Book.price, 0) < upper, index) for index, upper in enumerate(PRICE_BUCKETS)],
+        else_=len(PRICE_BUCKETS),
+    )
+
+
+def price_bucket_label(index):
+    lower = PRICE_BUCKETS[index - 1] if index else 0
+    return f'{lower}-{PRICE_BUCKETS[index]}' if index < len(PRICE_BUCKETS) else f'{lower}+'
+
+
+def values_of(book):
+    """The facet values of a Book or a book dict: (genre, author, price bucket, in stock)"""
+    get = book.get if isinstance(book, dict) else lambda name: getattr(book, name)
+    return (get('genre') or None, get('author') or None, price_bucket(get('price')),
+            (get('stock_quantity') or 0) > 0)
+
+
+class FacetCounts:
+    """Every facet's counts for one set of books"""
+
+    def __init__(self):
+        self.total = 0
+        self.genres = Counter()
+        self.authors = Counter()
+        self.prices = Counter()
+        self.availability = Counter()
+
+    @classmethod
+    def count(cls, filters=(), author_limit=None):
+        """Run the GROUP BY queries; author_limit keeps only the top authors (not updatable in place)"""
+        counts = cls()
+        in_stock = func.coalesce(Book.stock_quantity, 0) > 0
+
+        def grouped(column):
+            return select(column, func.count(Book.id)).where(*filters).group_by(column)
+
+        counts.genres.update(dict(db.session.execute(grouped(Book.genre).where(Book.genre.is_not(None))).all()))
+        authors = grouped(Book.author).where(Book.author.is_not(None))
+        if author_limit is not None:
+            authors = authors.order_by(func.count(Book.id).desc(), Book.author).limit(author_limit)
+        counts.authors.update(dict(db.session.execute(authors).all()))
+        counts.prices.update(dict(db.session.execute(grouped(price_bucket_column())).all()))
+        counts.availability.update(dict(db.session.execute(grouped(case((in_stock, True), else_=False))).all()))
+        counts.total = sum(counts.prices.values())
+        return counts
+
+    def add(self, values, sign=1):
+        """Count one book in (sign=1) or out (sign=-1)"""
+        genre, author, bucket, in_stock = values
+        self.total += sign
+        for counter, key in ((self.genres, genre), (self.authors, author),
+                             (self.prices, bucket), (self.availability, in_stock)):
+            if key is None:
+                continue
+            counter[key] += sign
+            if counter[key] <= 0:
+                del counter[key]
+
+    def to_dict(self, top_authors):
+        def ranked(counter, limit=None):
+            pairs = sorted(counter.items(), key=lambda pair: (-pair[1], pair[0]))[:limit]
+            return [{'value': value, 'count': count} for value, count in pairs]
+
+        return {
+            'total': self.total,
+            'genres': ranked(self.genres),
+            'authors': ranked(self.authors, top_authors),
+            'price_buckets': [
+                {'value': price_bucket_label(index),
+                 'min': PRICE_BUCKETS[index - 1] if index else 0,
+                 'max': PRICE_BUCKETS[index] if index < len(PRICE_BUCKETS) else None,
+                 'count': self.prices.get(index, 0)}
+                for index in range(len(PRICE_BUCKETS) + 1)
+            ],
+            'availability': {
+                'in_stock': self.availability.get(True, 0),
+                'out_of_stock': self.availability.get(False, 0),
+            },
+        }
+
+
+# ===============================
+# CATALOG VERSION
+# ===============================
+
+def current_version():
+    return db.session.execute(select(CatalogVersion.version).where(CatalogVersion.id == 1)).scalar() or 0
+
+
+def bump_version():
+    """Add one to the catalog version inside the current transaction; returns the new version"""
+    result = db.session.execute(update(CatalogVersion).where(CatalogVersion.id == 1)
+                                .values(version=CatalogVersion.version + 1))
+    if result.rowcount == 0:
+        db.session.add(CatalogVersion(id=1, version=1))
+        db.session.flush()
+        return 1
+    # The UPDATE holds the write lock until the commit, so nobody can move it in between
+    return current_version()
+
+
+def stage_book_change(before, after):
+    """
+    A book is being added (before=None), edited or deleted (after=None); call before the commit
+    before/after are Books, book dicts or values_of() tuples. Returns the change for apply().
+    """
+    before = values_of(before) if before is not None and not isinstance(before, tuple) else before
+    after = values_of(after) if after is not None and not isinstance(after, tuple) else after
+    if before == after:
+        return None
+    deltas = [(values, sign) for values, sign in ((before, -1), (after, 1)) if values is not None]
+    return {'version': bump_version(), 'deltas': deltas}
+
+
+def stage_sale(sold):
+    """An order took these (book, quantity) pairs out of stock; call before the commit"""
+    deltas = []
+    for book, quantity in sold:
+        stock = book.stock_quantity or 0
+        if (stock + quantity > 0) != (stock > 0):
+            after = values_of(book)
+            deltas.append(((*after[:3], stock + quantity > 0), -1))
+            deltas.append((after, 1))
+    if not deltas:
+        return None
+    return {'version': bump_version(), 'deltas': deltas}
+
+
+# ===============================
+# PER-PROCESS CACHE
+# ===============================
+
+_lock = threading.Lock()
+_state = {'version': None, 'all': None, 'filtered': OrderedDict()}
+
+
+def init_app(app):
+    app.config.setdefault('FACET_TOP_AUTHORS', 20)
+    app.config.setdefault('FACET_CACHE_FILTERS', 256)
+
+
+def apply(change):
+    """Update this worker's counts for a committed change (the result of a stage_* call)"""
+    if change is None:
+        return
+    with _lock:
+        # Only if the cache is exactly one version behind; anything else means another
+        # worker changed the catalog too, and the next request recounts
+        if _state['all'] is not None and _state['version'] == change['version'] - 1:
+            for values, sign in change['deltas']:
+                _state['all'].add(values, sign)
+            _state['version'] = change['version']
+            _state['filtered'].clear()
+
+
+def facets(app, filters=(), filter_key=()):
+    """
+    Facet counts as a dict, for every book or for the books matching `filters`
+    filter_key identifies the filters for the cache (e.g. the sorted query parameters).
+    """
+    top_authors = app.config['FACET_TOP_AUTHORS']
+    version = current_version()
+    with _lock:
+        if _state['version'] != version:
+            _state['version'] = version
+            _state['all'] = None
+            _state['filtered'].clear()
+
+        if not filters:
+            if _state['all'] is None:
+                _state['all'] = FacetCounts.count()
+            result = _state['all'].to_dict(top_authors)
+        else:
+            cached = _state['filtered'].get(filter_key)
+            if cached is None:
+                cached = FacetCounts.count(filters, author_limit=top_authors).to_dict(top_authors)
+                _state['filtered'][filter_key] = cached
+                if len(_state['filtered']) > app.config['FACET_CACHE_FILTERS']:
+                    _state['filtered'].popitem(last=False)
+            else:
+                _state['filtered'].move_to_end(filter_key)
+            result = cached
+    db.session.rollback()
+    return {**result, 'version': version}
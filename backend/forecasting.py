@@ -0,0 +1,197 @@
+# forecasting.py
+# Demand forecasts and reorder suggestions for the whole catalogue in one pass.
+#
+# For every book we forecast copies sold per day from its daily sales history
+# (taken from the book_sales_hourly counters, see leaderboards.py):
+#   ema              exponential smoothing, recent days count most (default)
+#   moving_average   plain average of the last FORECAST_WINDOW_DAYS days
+# and turn that into a reorder point and an order quantity:
+#   safety_stock   = z * demand_std * sqrt(lead_time)
+#   reorder_point  = daily_demand * lead_time + safety_stock
+#   if stock <= reorder_point:
+#       suggested_quantity = reorder_point + daily_demand * ORDER_COVER_DAYS - stock
+#
+# Nothing loops over books in Python: the history is loaded as flat NumPy arrays
+# (book, day, units) and every per-book sum is a np.bincount, so the cost grows
+# with the number of days that had sales, not with books x days.
+#
+# The results replace the reorder_suggestions table, served at
+# GET /api/inventory/reorder-suggestions. It runs daily as the forecast_demand
+# maintenance job, or by hand:
+#   python forecasting.py run
+#
+# Settings (app.config):
+#   FORECAST_METHOD          'ema' or 'moving_average'
+#   FORECAST_HISTORY_DAYS    days of history to load (default 730)
+#   FORECAST_WINDOW_DAYS     days averaged by moving_average and used for demand_std (default 28)
+#   FORECAST_ALPHA           ema smoothing factor, higher reacts faster (default 0.1)
+#   REORDER_LEAD_TIME_DAYS   days between ordering and the books arriving (default 7)
+#   REORDER_SERVICE_Z        safety factor, 1.65 ~ 95% chance of not running out (default 1.65)
+#   ORDER_COVER_DAYS         days of sales an order should cover (default 30)
+import argparse
+import itertools
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import delete, select
+
+from leaderboards import current_hour
+from models import db, Book, BookSalesHourly, ReorderSuggestion
+
+METHODS = ('ema', 'moving_average')
+
+FETCH_CHUNK = 100_000
+
+
+def init_app(app):
+    app.config.setdefault('FORECAST_METHOD', 'ema')
+    app.config.setdefault('FORECAST_HISTORY_DAYS', 730)
+    app.config.setdefault('FORECAST_WINDOW_DAYS', 28)
+    app.config.setdefault('FORECAST_ALPHA', 0.1)
+    app.config.setdefault('REORDER_LEAD_TIME_DAYS', 7)
+    app.config.setdefault('REORDER_SERVICE_Z', 1.65)
+    app.config.setdefault('ORDER_COVER_DAYS', 30)
+    if app.config['FORECAST_METHOD'] not in METHODS:
+        raise ValueError(f"FORECAST_METHOD must be one of {', '.join(METHODS)}")
+
+
+def _fetch_columns(stmt, width):
+    """Run a select of integer columns and return them as one int64 array per column"""
+    chunks = [np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64).reshape(-1, width)
+              for rows in db.session.execute(stmt).partitions(FETCH_CHUNK)]
+    data = np.concatenate(chunks) if chunks else np.empty((0, width), dtype=np.int64)
+    return [data[:, i] for i in range(width)]
+
+
+def load_history(today, history_days):
+    """
+    Daily sales as flat arrays: (book_ids, days_ago, units), one entry per book per day with sales
+    Only complete days count (today is still running): days_ago is 0 for yesterday.
+    The hourly counters are summed per day in SQL.
+    """
+    day = BookSalesHourly.hour // 24
+    stmt = (
+        select(BookSalesHourly.book_id, day, db.func.sum(BookSalesHourly.units))
+        .where(BookSalesHourly.hour >= (today - history_days) * 24, BookSalesHourly.hour < today * 24)
+        .group_by(BookSalesHourly.book_id, day)
+    )
+    book_ids, days, units = _fetch_columns(stmt, 3)
+    return book_ids, today - 1 - days, units
+
+
+def load_stock():
+    """(book_ids, stock) for every book"""
+    stmt = select(Book.id, db.func.coalesce(Book.stock_quantity, 0))
+    book_ids, stock = _fetch_columns(stmt, 2)
+    return book_ids, stock
+
+
+def forecast(book_ids, stock, sale_book_ids, days_ago, units, method='ema', window_days=28,
+             alpha=0.1, history_days=730, lead_time_days=7, service_z=1.65, cover_days=30):
+    """
+    The vectorized core; every argument is a NumPy array or a number
+    Returns a dict of per-book arrays in the same order as book_ids.
+    """
+    n = len(book_ids)
+    # Position of each sale row's book in book_ids (sales of deleted books are dropped)
+    order = np.argsort(book_ids)
+    sorted_ids = np.append(book_ids[order], -1)  # sentinel so a miss past the end compares safely
+    found = np.searchsorted(sorted_ids[:n], sale_book_ids)
+    known = sorted_ids[found] == sale_book_ids
+    pos = order[found[known]]
+    days_ago = days_ago[known]
+    units = units[known].astype(np.float64)
+
+    # Spread over the recent window, zero days included: var = E[x^2] - E[x]^2
+    recent = days_ago < window_days
+    window_sum = np.bincount(pos[recent], weights=units[recent], minlength=n)
+    window_sq = np.bincount(pos[recent], weights=units[recent] ** 2, minlength=n)
+    window_mean = window_sum / window_days
+    demand_std = np.sqrt(np.maximum(window_sq / window_days - window_mean ** 2, 0))
+
+    if method == 'moving_average':
+        daily_demand = window_mean
+    else:
+        # level = sum(alpha * (1 - alpha)^days_ago * units) over the history, with every
+        # day without sales counting as 0 and the level starting at 0
+        weights = alpha * (1 - alpha) ** days_ago
+        daily_demand = np.bincount(pos, weights=units * weights, minlength=n).astype(np.float64)
+        # Correct for the history being finite so a steady seller isn't under-forecast
+        daily_demand /= 1 - (1 - alpha) ** history_days
+
+    stock = stock.astype(np.float64)
+    safety_stock = service_z * demand_std * np.sqrt(lead_time_days)
+    reorder_point = np.ceil(daily_demand * lead_time_days + safety_stock)
+    order_up_to = reorder_point + daily_demand * cover_days
+    needs_order = (daily_demand > 0) & (stock <= reorder_point)
+    suggested = np.where(needs_order, np.ceil(np.maximum(order_up_to - stock, 0)), 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_stock = np.where(daily_demand > 0, stock / daily_demand, np.nan)
+
+    return {
+        'book_id': book_ids,
+        'daily_demand': daily_demand,
+        'demand_std': demand_std,
+        'stock_quantity': stock,
+        'days_of_stock': days_of_stock,
+        'reorder_point': reorder_point,
+        'suggested_quantity': suggested,
+    }
+
+
+def run_forecast(app):
+    """Forecast every book and replace reorder_suggestions; returns the number of suggestions"""
+    config = app.config
+    today = current_hour() // 24
+    start = time.perf_counter()
+
+    book_ids, stock = load_stock()
+    sale_book_ids, days_ago, units = load_history(today, config['FORECAST_HISTORY_DAYS'])
+    result = forecast(
+        book_ids, stock, sale_book_ids, days_ago, units,
+        method=config['FORECAST_METHOD'],
+        window_days=config['FORECAST_WINDOW_DAYS'],
+        alpha=config['FORECAST_ALPHA'],
+        history_days=config['FORECAST_HISTORY_DAYS'],
+        lead_time_days=config['REORDER_LEAD_TIME_DAYS'],
+        service_z=config['REORDER_SERVICE_Z'],
+        cover_days=config['ORDER_COVER_DAYS'],
+    )
+    computed_in = time.perf_counter() - start
+
+    now = datetime.utcnow()
+    picked = np.nonzero(result['suggested_quantity'] > 0)[0]
+    rows = [
+        {
+            'book_id': int(result['book_id'][i]),
+            'daily_demand': round(float(result['daily_demand'][i]), 4),
+            'demand_std': round(float(result['demand_std'][i]), 4),
+            'stock_quantity': int(result['stock_quantity'][i]),
+            'days_of_stock': round(float(result['days_of_stock'][i]), 1),
+            'reorder_point': int(result['reorder_point'][i]),
+            'suggested_quantity': int(result['suggested_quantity'][i]),
+            'computed_at': now,
+        }
+        for i in picked
+    ]
+    # Swap the whole table in one transaction so readers never see half a run
+    db.session.execute(delete(ReorderSuggestion))
+    for chunk_start in range(0, len(rows), FETCH_CHUNK):
+        db.session.execute(ReorderSuggestion.__table__.insert(), rows[chunk_start:chunk_start + FETCH_CHUNK])
+    db.session.commit()
+    print(f"Forecast {len(book_ids)} books from {len(units)} book-days in {computed_in:.2f}s, "
+          f"{len(rows)} reorder suggestions")
+    return len(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Demand forecast and reorder suggestions')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('run', help='forecast every book now')
+    args = parser.parse_args()
+
+    from app import app as flask_app
+
+    with flask_app.app_context():
+        run_forecast(flask_app)
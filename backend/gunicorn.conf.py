@@ -0,0 +1,64 @@
+# gunicorn.conf.py
+# Settings for running the backend with several worker processes.
+# Every value can be overridden with an environment variable so the same file
+# works on a laptop and on the server:
+#   WEB_CONCURRENCY   number of worker processes   (default: 2 x CPU + 1)
+#   GUNICORN_THREADS  threads per worker           (default: 4)
+#   GUNICORN_PRELOAD  import the app once in the master before forking (default: 1)
+#   GUNICORN_TIMEOUT  seconds before a stuck worker is restarted (default: 30)
+#   PORT              port to listen on            (default: 5000)
+#
+# Graceful reload (finish in-flight requests, then start fresh workers):
+#   kill -HUP $(cat instance/gunicorn.pid)    or    scripts/run_production.sh reload
+import multiprocessing
+import os
+import subprocess
+import sys
+
+backend_dir = os.path.dirname(os.path.abspath(__file__))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') != '0'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = 30
+keepalive = 5
+chdir = backend_dir
+pidfile = os.path.join(backend_dir, 'instance', 'gunicorn.pid')
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    """
+    Seed the database exactly once, before any worker exists
+    With preload the master already imported app.py (and seeded) while loading
+    the config. Without preload every worker would import app.py itself, so we
+    seed in a short-lived child process and tell the workers to skip it.
+    """
+    if not server.cfg.preload_app:
+        subprocess.check_call([sys.executable, '-c', 'import app'], cwd=backend_dir)
+    os.environ['BOOKSTORE_INIT_DB'] = '0'
+
+
+def post_fork(server, worker):
+    """Give each new worker its own database connections"""
+    if server.cfg.preload_app:
+        from app import app
+        from database import dispose_engines
+        dispose_engines(app)
+
+
+def post_worker_init(worker):
+    """
+    Start the maintenance scheduler in every worker (MAINTENANCE_SCHEDULER=0 turns it off)
+    The jobs take a database lock first, so each job still runs in only one worker.
+    Also start the background job queue's worker threads (JOB_WORKERS=0 turns them off).
+    """
+    from app import app
+    import jobs
+    import maintenance
+    maintenance.start_scheduler(app)
+    jobs.start_workers(app)
@@ -0,0 +1,223 @@
+# idempotency.py
+# Makes order-placing POSTs safe to retry.
+#
+# A client on flaky Wi-Fi may send POST /api/sales, lose the response, and send it
+# again. If the request carries an `Idempotency-Key: <any unique string>` header,
+# the first execution's response is stored, and every retry with the same key gets
+# that stored response back without touching books or sales again.
+#
+#   - a retry that arrives while the first request is still running waits for it
+#     (up to IDEMPOTENCY_WAIT_SECONDS, then 409 Conflict)
+#   - the same key with a different request body is rejected with 422
+#   - stored responses expire after IDEMPOTENCY_TTL_SECONDS (default one day)
+#   - a replay is re-encoded when the retry asks for the other format (JSON or MessagePack)
+#   - requests without the header behave exactly as before
+#
+# The store is the idempotency_keys table, so it works across gunicorn workers.
+#
+# The endpoint's work and its stored response are committed in ONE transaction: while
+# the endpoint runs, its db.session.commit() calls only flush, and the decorator
+# commits at the end together with the response. So either the order and its response
+# are both saved, or neither is. Only a 2xx response keeps the endpoint's changes: for
+# an error response they are rolled back, as they would be without the header. If the worker dies mid-request the key stays
+# in_progress with nothing done; after IDEMPOTENCY_LEASE_SECONDS a retry takes the key
+# over and runs the request itself.
+#
+# Usage (in app.py), directly under @app.route:
+#   @app.route('/api/sales', methods=['POST'])
+#   @idempotent
+#   def create_sale(): ...
+import hashlib
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+from contextlib import contextmanager
+
+from flask import current_app, jsonify, make_response, request
+from sqlalchemy import delete, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from json_provider import MSGPACK_MIMETYPE
+from models import db, IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def init_app(app):
+    app.config.setdefault('IDEMPOTENCY_TTL_SECONDS', 24 * 3600)
+    app.config.setdefault('IDEMPOTENCY_WAIT_SECONDS', 10)
+    # Longer than GUNICORN_TIMEOUT, so a live request is never taken over
+    app.config.setdefault('IDEMPOTENCY_LEASE_SECONDS', 60)
+
+
+def _sha256(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _error(message, status):
+    response = jsonify({'success': False, 'error': message})
+    response.status_code = status
+    return response
+
+
+def _replay(record):
+    stored = (record.response_content_type or '').split(';')[0].strip()
+    wanted = MSGPACK_MIMETYPE if current_app.json.wants_msgpack() else current_app.json.mimetype
+    if stored in (MSGPACK_MIMETYPE, current_app.json.mimetype) and stored != wanted:
+        # Stored as JSON but this retry wants MessagePack, or the other way round
+        response = jsonify(current_app.json.decode(record.response_body, stored))
+        response.status_code = record.response_status
+    else:
+        response = current_app.response_class(
+            record.response_body,
+            status=record.response_status,
+            content_type=record.response_content_type,
+        )
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _lease_expired(record, now):
+    return record.status == 'in_progress' and (record.locked_until is None or record.locked_until < now)
+
+
+def _claim(key, fingerprint):
+    """Insert the in_progress row (or take over a dead one); returns True if this request may run"""
+    now = datetime.utcnow()
+    locked_until = now + timedelta(seconds=current_app.config['IDEMPOTENCY_LEASE_SECONDS'])
+    # An expired row is as good as no row
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key,
+                                                    IdempotencyKey.expires_at < now))
+    db.session.add(IdempotencyKey(
+        key=key,
+        fingerprint=fingerprint,
+        status='in_progress',
+        expires_at=now + timedelta(seconds=current_app.config['IDEMPOTENCY_TTL_SECONDS']),
+        locked_until=locked_until,
+    ))
+    try:
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+
+    # The worker holding the key died before committing anything: the request never
+    # happened, so this retry runs it. The UPDATE lets only one retry win.
+    taken = db.session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.key == key,
+               IdempotencyKey.fingerprint == fingerprint,
+               IdempotencyKey.status == 'in_progress',
+               or_(IdempotencyKey.locked_until.is_(None), IdempotencyKey.locked_until < now))
+        .values(locked_until=locked_until)
+    ).rowcount
+    db.session.commit()
+    return taken == 1
+
+
+def _wait_for_completion(key):
+    """
+    Poll until the first request finishes
+    Returns the completed row, None if the row went away (the first attempt failed),
+    the in_progress row once its lease ran out, or the still in_progress row when the
+    wait timed out.
+    """
+    deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT_SECONDS']
+    delay = 0.02
+    while True:
+        # End the previous read transaction, otherwise SQLite keeps showing the old snapshot
+        db.session.rollback()
+        record = db.session.get(IdempotencyKey, key, populate_existing=True)
+        if (record is None or record.status == 'completed' or _lease_expired(record, datetime.utcnow())
+                or time.monotonic() >= deadline):
+            return record
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+
+
+def _release(key):
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key))
+    db.session.commit()
+
+
+@contextmanager
+def _single_transaction():
+    """While the endpoint runs, db.session.commit() only flushes; the decorator commits once at the end"""
+    session = db.session()
+    session.commit = session.flush
+    try:
+        yield
+    finally:
+        del session.commit
+
+
+def idempotent(f):
+    """Decorator: honour the Idempotency-Key header on this endpoint"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        raw_key = request.headers.get(HEADER)
+        if not raw_key:
+            return f(*args, **kwargs)
+        if len(raw_key) > MAX_KEY_LENGTH:
+            return _error(f'{HEADER} must be at most {MAX_KEY_LENGTH} characters', 400)
+
+        # Scope the key to the caller and endpoint so nobody can replay someone else's response
+        key = _sha256(request.headers.get('Authorization', ''), request.path, raw_key)
+        fingerprint = _sha256(request.method, request.get_data())
+
+        while not _claim(key, fingerprint):
+            record = _wait_for_completion(key)
+            if record is None:
+                # The first attempt failed and released the key: try to run it ourselves
+                continue
+            if record.fingerprint != fingerprint:
+                return _error(f'{HEADER} was already used for a different request', 422)
+            if _lease_expired(record, datetime.utcnow()):
+                # Its worker died before committing: take the key over and run it ourselves
+                continue
+            if record.status != 'completed':
+                # Still running after the wait (or its worker died mid-request)
+                return _error('A request with this Idempotency-Key is still being processed', 409)
+            return _replay(record)
+
+        try:
+            with _single_transaction():
+                response = make_response(f(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            _release(key)
+            raise
+
+        if not 200 <= response.status_code < 300:
+            # Only a success keeps the endpoint's changes. An early `return ..., 400` can
+            # come after some of them (checkout takes the first book's stock before
+            # finding the second one short); without the header those were never committed
+            db.session.rollback()
+
+        if response.status_code >= 500 or response.is_streamed:
+            # Server errors are worth retrying for real, so don't pin them to the key
+            # (a streamed success's changes are committed with the release)
+            _release(key)
+            return response
+
+        db.session.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.key == key)
+            .values(status='completed',
+                    response_status=response.status_code,
+                    response_body=response.get_data(),
+                    response_content_type=response.content_type,
+                    locked_until=None)
+        )
+        # The endpoint's changes and the stored response commit together
+        db.session.commit()
+        return response
+
+    return decorated
+
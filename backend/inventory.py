@@ -0,0 +1,62 @@
+# inventory.py
+# Stock level checks shared by every code path that sells books.
+#
+# Both checkout (cart orders) and POST /api/sales (guest/POS orders) call
+# record_stock_alerts() after taking the books out of stock, so the alert rules
+# live in one place:
+#   - LOW_STOCK     the sale took the book from above its reorder_point to at or below it
+#   - OUT_OF_STOCK  the sale took the last copy
+# Alerts are only stored when a sale crosses a threshold, so a book that stays low
+# doesn't add a new notification for every order.
+#
+# The notification rows are written by a 'stock_alerts' background job (jobs.py)
+# enqueued with the order, so the order's response doesn't wait for them.
+import jobs
+from models import db, Notification
+
+
+def is_low(book):
+    return (book.stock_quantity or 0) <= book.reorder_point
+
+
+def record_stock_alerts(sold):
+    """
+    Queue LOW_STOCK / OUT_OF_STOCK notifications for the books a sale just reduced
+    `sold` is a list of (book, quantity) pairs, after stock_quantity was lowered.
+    The job is added to the session (the caller commits it with the sale).
+    Returns a message for every book that is now low, for the API response.
+    """
+    alerts = []
+    crossed = []
+    for book, quantity in sold:
+        stock = book.stock_quantity or 0
+        if not is_low(book):
+            continue
+        alerts.append(f"Low stock for {book.title}! (stock={stock})")
+
+        stock_before = stock + quantity
+        if stock_before > book.reorder_point or (stock == 0 and stock_before > 0):
+            # Everything the job needs, as it was at the time of the sale
+            crossed.append({'book_id': book.id, 'title': book.title, 'stock': stock,
+                            'stock_before': stock_before, 'reorder_point': book.reorder_point})
+    if crossed:
+        jobs.enqueue('stock_alerts', {'books': crossed})
+    return alerts
+
+
+@jobs.handler('stock_alerts')
+def create_stock_alerts(app, payload):
+    """Background job: add the notifications queued by record_stock_alerts (the worker commits)"""
+    for book in payload['books']:
+        if book['stock_before'] > book['reorder_point']:
+            db.session.add(Notification(
+                type='LOW_STOCK',
+                message=f"Low stock for '{book['title']}' (stock={book['stock']}).",
+                book_id=book['book_id']
+            ))
+        if book['stock'] == 0 and book['stock_before'] > 0:
+            db.session.add(Notification(
+                type='OUT_OF_STOCK',
+                message=f"'{book['title']}' is now OUT OF STOCK.",
+                book_id=book['book_id']
+            ))
@@ -0,0 +1,331 @@
+# jobs.py
+# A durable background job queue, so work that doesn't have to happen before the
+# response (an order's stock notifications today, receipt emails later) is taken off
+# the request path. Only work that must happen once belongs here: a job runs in
+# whichever process claims it, so per-process caches are updated where the order was served.
+#
+# Jobs are rows in the background_jobs table:
+#   - jobs.enqueue('stock_alerts', {...}) only adds the row to the current session,
+#     so it is committed together with the order: a rolled-back order never runs its
+#     jobs, and a worker can't pick a job up before its order exists.
+#   - worker threads (JOB_WORKERS per gunicorn worker) claim the oldest ready job
+#     with a single UPDATE ... WHERE status = 'queued', so a job runs in one place
+#     even with many processes. A claim is a lease of JOB_LEASE_SECONDS; a job whose
+#     worker died is picked up again when the lease runs out.
+#   - the handler's database changes and the 'done' mark are committed together,
+#     and only while the lease is still ours, so a job's rows are written once.
+#   - a failing job is retried after JOB_RETRY_BASE_SECONDS, doubling each time up to
+#     JOB_RETRY_MAX_SECONDS (with some jitter). After max_attempts it is marked
+#     'dead' and kept, with its last error, until an admin retries it.
+#   - committing a session that enqueued something wakes this process's workers, so
+#     a job usually starts within milliseconds; other processes poll every
+#     JOB_POLL_SECONDS.
+# Finished jobs are deleted after JOB_KEEP_DONE_HOURS by the purge_jobs maintenance job.
+#
+# Usage:
+#   @jobs.handler('stock_alerts')            register a handler(app, payload) for a kind
+#   def create_stock_alerts(app, payload): ...
+#   jobs.enqueue('stock_alerts', {...})      inside the request's transaction
+#   jobs.start_workers(app)                  in every worker (gunicorn.conf.py)
+# and from the command line, in backend/:
+#   python jobs.py work                      run a worker in the foreground
+#   python jobs.py status                    queue depth, lag and dead jobs
+#   python jobs.py retry ID                  put a dead job back in the queue
+#
+# Settings (app.config, the worker count also from the environment):
+#   JOB_WORKERS              worker threads per process (default 1, 0 = none)
+#   JOB_POLL_SECONDS         how often idle workers look for jobs (default 1)
+#   JOB_LEASE_SECONDS        how long a claimed job may run (default 300)
+#   JOB_MAX_ATTEMPTS         tries before a job is dead-lettered (default 5)
+#   JOB_RETRY_BASE_SECONDS   wait before the first retry (default 5)
+#   JOB_RETRY_MAX_SECONDS    longest wait between retries (default 600)
+#   JOB_KEEP_DONE_HOURS      how long finished jobs are kept (default 24)
+import argparse
+import json
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, func, select, update
+from sqlalchemy.orm import Session
+
+from models import db, BackgroundJob
+
+# kind -> handler(app, payload), filled in by @handler
+HANDLERS = {}
+
+# Ready jobs looked at per claim; if another worker wins one, the next is tried
+CLAIM_CANDIDATES = 5
+
+_wakeup = threading.Event()
+
+
+def handler(kind):
+    """Register the function that runs jobs of this kind"""
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def init_app(app):
+    app.config.setdefault('JOB_WORKERS', int(os.getenv('JOB_WORKERS', '1')))
+    app.config.setdefault('JOB_POLL_SECONDS', 1.0)
+    app.config.setdefault('JOB_LEASE_SECONDS', 300)
+    app.config.setdefault('JOB_MAX_ATTEMPTS', 5)
+    app.config.setdefault('JOB_RETRY_BASE_SECONDS', 5)
+    app.config.setdefault('JOB_RETRY_MAX_SECONDS', 600)
+    app.config.setdefault('JOB_KEEP_DONE_HOURS', 24)
+
+
+# ===============================
+# ENQUEUE
+# ===============================
+
+def enqueue(kind, payload=None, delay_seconds=0, max_attempts=None):
+    """
+    Add a job to the current transaction; it becomes visible when the caller commits
+    The payload must be JSON-serialisable. Returns the (unsaved) BackgroundJob.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f'No handler registered for job kind {kind!r}')
+    now = datetime.utcnow()
+    job = BackgroundJob(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        status='queued',
+        attempts=0,
+        max_attempts=max_attempts or current_app.config['JOB_MAX_ATTEMPTS'],
+        created_at=now,
+        run_after=now + timedelta(seconds=delay_seconds),
+    )
+    db.session.add(job)
+    db.session.info['jobs_enqueued'] = True
+    return job
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_after_commit(session):
+    if session.info.pop('jobs_enqueued', False):
+        _wakeup.set()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('jobs_enqueued', None)
+
+
+# ===============================
+# RUNNING JOBS
+# ===============================
+
+def _worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def _ready(now):
+    """Queued jobs that are due, and running jobs whose worker's lease ran out"""
+    return (
+        ((BackgroundJob.status == 'queued') & (BackgroundJob.run_after <= now))
+        | ((BackgroundJob.status == 'running') & (BackgroundJob.locked_until < now))
+    )
+
+
+def claim(app, worker_id):
+    """Take the oldest ready job; returns it, or None when there is nothing to do"""
+    now = datetime.utcnow()
+    candidates = db.session.execute(
+        select(BackgroundJob.id).where(_ready(now))
+        .order_by(BackgroundJob.run_after, BackgroundJob.id).limit(CLAIM_CANDIDATES)
+    ).scalars().all()
+    # End the read so each UPDATE below starts from the latest data
+    db.session.rollback()
+    for job_id in candidates:
+        # The WHERE repeats the check, so only one worker's UPDATE matches
+        result = db.session.execute(
+            update(BackgroundJob)
+            .where(BackgroundJob.id == job_id, _ready(now))
+            .values(status='running', attempts=BackgroundJob.attempts + 1, started_at=now,
+                    locked_by=worker_id, locked_until=now + timedelta(seconds=app.config['JOB_LEASE_SECONDS']))
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return db.session.get(BackgroundJob, job_id)
+    return None
+
+
+def retry_delay(app, attempts):
+    """Seconds to wait after the attempts-th failure: doubling, capped, with jitter"""
+    delay = min(app.config['JOB_RETRY_BASE_SECONDS'] * 2 ** (attempts - 1), app.config['JOB_RETRY_MAX_SECONDS'])
+    return delay * random.uniform(0.75, 1.25)
+
+
+def _finish(job_id, worker_id, **values):
+    """Update a job we still hold; returns False if the lease was lost to another worker"""
+    result = db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.id == job_id, BackgroundJob.status == 'running', BackgroundJob.locked_by == worker_id)
+        .values(locked_by=None, locked_until=None, **values)
+    )
+    return result.rowcount == 1
+
+
+def run_one(app, worker_id=None):
+    """Claim and run one job; returns its outcome as a dict, or None when the queue is empty"""
+    worker_id = worker_id or _worker_id()
+    job = claim(app, worker_id)
+    if job is None:
+        return None
+    job_id, kind, attempts, max_attempts = job.id, job.kind, job.attempts, job.max_attempts
+
+    start = time.perf_counter()
+    try:
+        if attempts > max_attempts:
+            raise RuntimeError('lease ran out on every attempt (the worker died or the job is too slow)')
+        if kind not in HANDLERS:
+            raise LookupError(f'No handler registered for job kind {kind!r}')
+        HANDLERS[kind](app, json.loads(job.payload))
+        # The handler's changes and the 'done' mark go into the same commit
+        if _finish(job_id, worker_id, status='done', finished_at=datetime.utcnow(), last_error=None):
+            db.session.commit()
+            status = 'done'
+        else:
+            db.session.rollback()
+            status = 'lost'
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc(limit=3)
+        if attempts >= max_attempts:
+            status = 'dead'
+            values = dict(status='dead', finished_at=datetime.utcnow(), last_error=error)
+        else:
+            status = 'retry'
+            run_after = datetime.utcnow() + timedelta(seconds=retry_delay(app, attempts))
+            values = dict(status='queued', run_after=run_after, last_error=error)
+        _finish(job_id, worker_id, **values)
+        db.session.commit()
+
+    return {'id': job_id, 'kind': kind, 'attempt': attempts, 'status': status,
+            'duration_ms': (time.perf_counter() - start) * 1000}
+
+
+def work(app, stop=None, worker_id=None):
+    """Run jobs until `stop` (a threading.Event) is set; sleeps while the queue is empty"""
+    worker_id = worker_id or _worker_id()
+    while stop is None or not stop.is_set():
+        outcome = None
+        try:
+            with app.app_context():
+                outcome = run_one(app, worker_id)
+                db.session.remove()
+        except Exception:
+            traceback.print_exc()
+        if outcome is None:
+            _wakeup.wait(app.config['JOB_POLL_SECONDS'])
+            _wakeup.clear()
+
+
+def start_workers(app):
+    """Start JOB_WORKERS background threads in this process; returns them"""
+    threads = []
+    for number in range(app.config['JOB_WORKERS']):
+        thread = threading.Thread(target=work, args=(app,), name=f'job-worker-{number}', daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+# ===============================
+# MONITORING
+# ===============================
+
+def queue_stats(app):
+    """Queue depth per status and kind, and how far behind the workers are"""
+    now = datetime.utcnow()
+    by_status = dict(db.session.execute(
+        select(BackgroundJob.status, func.count(BackgroundJob.id)).group_by(BackgroundJob.status)
+    ).all())
+    by_kind = {}
+    for kind, status, count in db.session.execute(
+        select(BackgroundJob.kind, BackgroundJob.status, func.count(BackgroundJob.id))
+        .where(BackgroundJob.status != 'done').group_by(BackgroundJob.kind, BackgroundJob.status)
+    ):
+        by_kind.setdefault(kind, {})[status] = count
+    oldest_ready = db.session.execute(
+        select(func.min(BackgroundJob.run_after))
+        .where(BackgroundJob.status == 'queued', BackgroundJob.run_after <= now)
+    ).scalar()
+    ready = db.session.execute(
+        select(func.count(BackgroundJob.id))
+        .where(BackgroundJob.status == 'queued', BackgroundJob.run_after <= now)
+    ).scalar()
+    done_last_hour = db.session.execute(
+        select(func.count(BackgroundJob.id))
+        .where(BackgroundJob.status == 'done', BackgroundJob.finished_at >= now - timedelta(hours=1))
+    ).scalar()
+    db.session.rollback()
+    return {
+        'queued': by_status.get('queued', 0),
+        'ready': ready,
+        'running': by_status.get('running', 0),
+        'dead': by_status.get('dead', 0),
+        'done': by_status.get('done', 0),
+        'done_last_hour': done_last_hour,
+        # How long the oldest job that could run has been waiting
+        'lag_seconds': round((now - oldest_ready).total_seconds(), 3) if oldest_ready else 0.0,
+        'by_kind': by_kind,
+        'workers_per_process': app.config['JOB_WORKERS'],
+    }
+
+
+def dead_jobs(limit=50):
+    """The most recently dead-lettered jobs"""
+    rows = db.session.execute(
+        select(BackgroundJob).where(BackgroundJob.status == 'dead')
+        .order_by(BackgroundJob.finished_at.desc()).limit(limit)
+    ).scalars().all()
+    return [row.to_dict() for row in rows]
+
+
+def retry(job_id):
+    """Put a dead job back in the queue with a fresh set of attempts; returns False if it isn't dead"""
+    result = db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.id == job_id, BackgroundJob.status == 'dead')
+        .values(status='queued', attempts=0, run_after=datetime.utcnow(), finished_at=None)
+    )
+    db.session.info['jobs_enqueued'] = True
+    db.session.commit()
+    return result.rowcount == 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Background job queue')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('work', help='run a worker in the foreground')
+    sub.add_parser('status', help='show queue depth, lag and dead jobs')
+    retry_parser = sub.add_parser('retry', help='put a dead job back in the queue')
+    retry_parser.add_argument('job_id', type=int)
+    args = parser.parse_args()
+
+    from app import app as flask_app
+    # The handlers registered themselves on the imported jobs module, not on this __main__ copy
+    import jobs
+
+    if args.command == 'work':
+        print(f"Working on {', '.join(sorted(jobs.HANDLERS))} jobs (Ctrl+C to stop)")
+        jobs.work(flask_app)
+    else:
+        with flask_app.app_context():
+            if args.command == 'status':
+                print(json.dumps(jobs.queue_stats(flask_app), indent=2))
+                for job in jobs.dead_jobs():
+                    last_line = (job['last_error'] or '').strip().splitlines()[-1:]
+                    print(f"dead #{job['id']} {job['kind']} after {job['attempts']} attempts: {''.join(last_line)}")
+            elif args.command == 'retry':
+                print('Requeued' if jobs.retry(args.job_id) else f'Job {args.job_id} is not dead')
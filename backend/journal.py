@@ -0,0 +1,371 @@
+# journal.py
+# Append-only journal of every inventory change, plus a fast replay reader.
+#
+# books.stock_quantity only holds the current number. The journal keeps how it got
+# there, so stock can be audited and anything derived from sales (stock levels,
+# rollups, caches) can be rebuilt from scratch.
+#
+# Two layers:
+#   - the inventory_events table. record_*() add events in the same transaction
+#     as the change itself, so the journal and the books table can never disagree.
+#       sale_completed   one per order line (checkout and POST /api/sales)
+#       stock_adjusted   create/edit/delete of a book changed its stock
+#       book_updated     any other field of a book changed
+#   - segment files in JOURNAL_DIR (default instance/journal). The journal_flush
+#     maintenance job copies new events into them as fixed-size 32-byte binary
+#     records, starting a new segment every JOURNAL_SEGMENT_EVENTS events, and
+#     writes a snapshot of all stock levels every JOURNAL_SNAPSHOT_EVERY events.
+#
+# JournalReader memory-maps the segments and replays them with NumPy a whole
+# segment at a time (tens of millions of events per second), starting from the
+# newest snapshot when there is one.
+#
+#   python journal.py flush     copy new events into the segment files now
+#   python journal.py verify    replay the journal and compare with books.stock_quantity
+#   python journal.py stock     print the replayed stock levels
+import argparse
+import calendar
+import glob
+import os
+import struct
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, select
+
+from models import db, Book, InventoryEvent
+
+EVENT_TYPES = {'sale_completed': 1, 'stock_adjusted': 2, 'book_updated': 3}
+
+# One event in a segment file
+RECORD = np.dtype([
+    ('id', '<i8'),
+    ('ts_ms', '<i8'),      # created_at as milliseconds since 1970-01-01 UTC
+    ('book_id', '<i4'),
+    ('delta', '<i4'),      # quantity_delta
+    ('sale_id', '<i4'),    # 0 when there is none
+    ('type', 'u1'),        # EVENT_TYPES value
+    ('_pad', 'V3'),
+])
+
+# Segment header: magic, record size, unused
+MAGIC = b'BKJRNL01'
+HEADER = struct.Struct('<8sII')
+
+EXPORT_CHUNK = 100_000
+
+
+# ===============================
+# WRITING EVENTS (inside the caller's transaction)
+# ===============================
+
+def _add(event_type, book_id, quantity_delta=0, sale_id=None, user_id=None, data=None):
+    db.session.add(InventoryEvent(
+        type=event_type,
+        book_id=book_id,
+        quantity_delta=quantity_delta,
+        sale_id=sale_id,
+        user_id=user_id,
+        data=current_app.json.dumps(data) if data is not None else None,
+    ))
+
+
+def record_sale(sale, sold, user_id=None):
+    """One sale_completed event per order line; sold = [(book, quantity), ...]"""
+    for book, quantity in sold:
+        _add('sale_completed', book.id, -quantity, sale_id=sale.id, user_id=user_id)
+
+
+def record_book_created(book, user_id=None):
+    db.session.flush()  # the new book needs its id
+    _add('book_updated', book.id, user_id=user_id, data={'created': True})
+    if book.stock_quantity:
+        _add('stock_adjusted', book.id, book.stock_quantity, user_id=user_id, data={'reason': 'created'})
+
+
+def record_book_changes(book, before, user_id=None):
+    """
+    Compare the book with `before` (its api_fields_dict() taken before the edit)
+    and record what changed
+    """
+    after = book.api_fields_dict()
+    changes = {name: [before[name], after[name]] for name in after
+               if name not in ('created_at', 'updated_at') and before[name] != after[name]}
+    stock_change = changes.pop('stock_quantity', None)
+    if stock_change is not None:
+        old, new = (value or 0 for value in stock_change)
+        _add('stock_adjusted', book.id, new - old, user_id=user_id, data={'reason': 'edited'})
+    if changes:
+        _add('book_updated', book.id, user_id=user_id, data=changes)
+
+
+def record_book_deleted(book, user_id=None):
+    if book.stock_quantity:
+        _add('stock_adjusted', book.id, -book.stock_quantity, user_id=user_id, data={'reason': 'deleted'})
+    _add('book_updated', book.id, user_id=user_id, data={'deleted': True})
+
+
+def ensure_baseline():
+    """
+    Start the journal of an existing database with every book's current stock
+    (an 'opening balance'), so replaying it gives the right numbers
+    """
+    if db.session.execute(select(InventoryEvent.id).limit(1)).first() is not None:
+        return 0
+    rows = [
+        {'type': 'stock_adjusted', 'book_id': book_id, 'quantity_delta': stock or 0,
+         'data': '{"reason":"opening balance"}'}
+        for book_id, stock in db.session.execute(select(Book.id, Book.stock_quantity))
+    ]
+    if rows:
+        db.session.execute(InventoryEvent.__table__.insert(), rows)
+        db.session.commit()
+    return len(rows)
+
+
+# ===============================
+# SEGMENT FILES
+# ===============================
+
+def journal_dir(app):
+    return app.config['JOURNAL_DIR']
+
+
+def init_app(app):
+    app.config.setdefault('JOURNAL_DIR', os.path.join(app.instance_path, 'journal'))
+    app.config.setdefault('JOURNAL_SEGMENT_EVENTS', 1_000_000)
+    app.config.setdefault('JOURNAL_SNAPSHOT_EVERY', 1_000_000)
+
+
+def _segment_path(directory, first_id):
+    return os.path.join(directory, f'segment-{first_id:012d}.evt')
+
+
+def _snapshot_path(directory, event_id):
+    return os.path.join(directory, f'snapshot-{event_id:012d}.npz')
+
+
+def _timestamp_ms(moment):
+    return calendar.timegm(moment.utctimetuple()) * 1000 + moment.microsecond // 1000
+
+
+def _valid_length(path):
+    """Bytes of whole records in a segment (a crash mid-write can leave part of one)"""
+    size = os.path.getsize(path)
+    return HEADER.size + (size - HEADER.size) // RECORD.itemsize * RECORD.itemsize
+
+
+def flush(app):
+    """Copy events that aren't in a segment file yet; returns how many were copied"""
+    directory = journal_dir(app)
+    os.makedirs(directory, exist_ok=True)
+    reader = JournalReader(directory)
+    last_id = reader.last_id()
+    copied = 0
+
+    while True:
+        rows = db.session.execute(
+            select(InventoryEvent.id, InventoryEvent.created_at, InventoryEvent.book_id,
+                   InventoryEvent.quantity_delta, InventoryEvent.sale_id, InventoryEvent.type)
+            .where(InventoryEvent.id > last_id)
+            .order_by(InventoryEvent.id)
+            .limit(EXPORT_CHUNK)
+        ).all()
+        if not rows:
+            break
+        records = np.zeros(len(rows), dtype=RECORD)
+        records['id'] = [row.id for row in rows]
+        records['ts_ms'] = [_timestamp_ms(row.created_at) for row in rows]
+        records['book_id'] = [row.book_id for row in rows]
+        records['delta'] = [row.quantity_delta for row in rows]
+        records['sale_id'] = [row.sale_id or 0 for row in rows]
+        records['type'] = [EVENT_TYPES[row.type] for row in rows]
+        _append(app, reader, records)
+        last_id = int(records['id'][-1])
+        copied += len(records)
+
+    db.session.rollback()  # end the read transaction
+    if copied:
+        snapshot_id = reader.latest_snapshot_id()
+        if last_id - snapshot_id >= app.config['JOURNAL_SNAPSHOT_EVERY']:
+            write_snapshot(directory, reader, last_id)
+    return copied
+
+
+def _append(app, reader, records):
+    """Append records to the newest segment, starting new ones when it is full"""
+    per_segment = app.config['JOURNAL_SEGMENT_EVENTS']
+    while len(records):
+        segments = reader.segment_paths()
+        path = segments[-1] if segments else None
+        if path is not None:
+            valid = _valid_length(path)
+            room = per_segment - (valid - HEADER.size) // RECORD.itemsize
+        if path is None or room <= 0:
+            path = _segment_path(reader.directory, int(records['id'][0]))
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, RECORD.itemsize, 0))
+            valid, room = HEADER.size, per_segment
+
+        batch, records = records[:room], records[room:]
+        with open(path, 'r+b') as f:
+            f.truncate(valid)  # drop a half-written record from a crash
+            f.seek(valid)
+            f.write(batch.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def write_snapshot(directory, reader, event_id):
+    """Save every book's stock level as of event_id"""
+    book_ids, stock = reader.stock_levels(until_id=event_id)
+    path = _snapshot_path(directory, event_id)
+    tmp = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp, book_ids=book_ids, stock=stock)
+    os.replace(tmp, path)
+
+
+# ===============================
+# REPLAY
+# ===============================
+
+class JournalReader:
+    """Memory-mapped, vectorized replay of the segment files in one directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def segment_paths(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'segment-*.evt')))
+
+    def _snapshots(self):
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'snapshot-*.npz')):
+            try:
+                snapshots.append((int(os.path.basename(path)[9:21]), path))
+            except ValueError:
+                continue  # e.g. a leftover temp file
+        return sorted(snapshots)
+
+    def latest_snapshot_id(self):
+        snapshots = self._snapshots()
+        return snapshots[-1][0] if snapshots else 0
+
+    def open_segment(self, path):
+        """The records of one segment as a read-only memory map (no copy)"""
+        with open(path, 'rb') as f:
+            magic, record_size, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or record_size != RECORD.itemsize:
+            raise ValueError(f'{path} is not a journal segment')
+        count = (_valid_length(path) - HEADER.size) // RECORD.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=RECORD)
+        return np.memmap(path, dtype=RECORD, mode='r', offset=HEADER.size, shape=(count,))
+
+    def last_id(self):
+        segments = self.segment_paths()
+        for path in reversed(segments):
+            records = self.open_segment(path)
+            if len(records):
+                return int(records['id'][-1])
+        return 0
+
+    def events(self, after_id=0, until_id=None):
+        """Yield the records with after_id < id <= until_id, one array per segment"""
+        segments = self.segment_paths()
+        firsts = [int(os.path.basename(path)[8:20]) for path in segments]
+        for i, path in enumerate(segments):
+            # Skip whole segments that end before after_id or start after until_id
+            if i + 1 < len(firsts) and firsts[i + 1] <= after_id + 1:
+                continue
+            if until_id is not None and firsts[i] > until_id:
+                break
+            records = self.open_segment(path)
+            start = np.searchsorted(records['id'], after_id, side='right')
+            end = len(records) if until_id is None else np.searchsorted(records['id'], until_id, side='right')
+            if end > start:
+                yield records[start:end]
+
+    def stock_levels(self, until_id=None):
+        """Replayed stock per book as (book_ids, stock) arrays, books with any event only"""
+        stock = np.zeros(0, dtype=np.int64)
+        seen = np.zeros(0, dtype=bool)
+        after_id = 0
+        for snapshot_id, path in reversed(self._snapshots()):
+            if until_id is None or snapshot_id <= until_id:
+                with np.load(path) as snapshot:
+                    size = int(snapshot['book_ids'].max()) + 1 if len(snapshot['book_ids']) else 0
+                    stock = np.zeros(size, dtype=np.int64)
+                    seen = np.zeros(size, dtype=bool)
+                    stock[snapshot['book_ids']] = snapshot['stock']
+                    seen[snapshot['book_ids']] = True
+                after_id = snapshot_id
+                break
+
+        for records in self.events(after_id, until_id):
+            book_ids = records['book_id']
+            size = max(len(stock), int(book_ids.max()) + 1)
+            if size > len(stock):
+                stock = np.concatenate([stock, np.zeros(size - len(stock), dtype=np.int64)])
+                seen = np.concatenate([seen, np.zeros(size - len(seen), dtype=bool)])
+            stock += np.bincount(book_ids, weights=records['delta'], minlength=size).astype(np.int64)
+            seen[book_ids] = True
+
+        book_ids = np.nonzero(seen)[0]
+        return book_ids, stock[book_ids]
+
+    def units_sold(self, bucket_seconds=86400, after_id=0, until_id=None):
+        """
+        Copies sold per book per time bucket (default: per day) from sale_completed events
+        Returns (book_ids, bucket_starts_ms, units) arrays.
+        """
+        bucket_ms = bucket_seconds * 1000
+        keys, units = [], []
+        for records in self.events(after_id, until_id):
+            sales = records[records['type'] == EVENT_TYPES['sale_completed']]
+            # book id in the high bits, bucket number in the low 32
+            keys.append((sales['book_id'].astype(np.int64) << 32) | (sales['ts_ms'] // bucket_ms))
+            units.append(-sales['delta'].astype(np.int64))
+        if not keys:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64)
+        unique_keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        totals = np.bincount(inverse.ravel(), weights=np.concatenate(units)).astype(np.int64)
+        return unique_keys >> 32, (unique_keys & 0xFFFFFFFF) * bucket_ms, totals
+
+
+def verify(app):
+    """Compare replayed stock with books.stock_quantity; returns [(book_id, journal, table)] that differ"""
+    flush(app)
+    book_ids, stock = JournalReader(journal_dir(app)).stock_levels()
+    replayed = dict(zip(book_ids.tolist(), stock.tolist()))
+    actual = {book_id: quantity or 0 for book_id, quantity in db.session.execute(select(Book.id, Book.stock_quantity))}
+    mismatches = []
+    for book_id in sorted(set(replayed) | set(actual)):
+        if replayed.get(book_id, 0) != actual.get(book_id, 0):
+            mismatches.append((book_id, replayed.get(book_id, 0), actual.get(book_id)))
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inventory event journal')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('flush', help='copy new events into the segment files')
+    sub.add_parser('verify', help='compare the replayed journal with books.stock_quantity')
+    sub.add_parser('stock', help='print the replayed stock levels')
+    args = parser.parse_args()
+
+    from app import app as flask_app
+
+    with flask_app.app_context():
+        if args.command == 'flush':
+            print(f"{flush(flask_app)} events copied")
+        elif args.command == 'verify':
+            mismatches = verify(flask_app)
+            for book_id, journal_stock, table_stock in mismatches:
+                print(f"book {book_id}: journal says {journal_stock}, books table says {table_stock}")
+            total = db.session.execute(select(func.count(InventoryEvent.id))).scalar()
+            print(f"{total} events, {len(mismatches)} books differ")
+        else:
+            flush(flask_app)
+            for book_id, quantity in zip(*JournalReader(journal_dir(flask_app)).stock_levels()):
+                print(f"{book_id}\t{quantity}")
@@ -0,0 +1,84 @@
+# json_provider.py
+# Faster JSON for every jsonify() call, plus MessagePack for clients that ask for it.
+#
+# Usage (in app.py):
+#   app.json = FastJSONProvider(app)
+#
+# - JSON is written with orjson when it is installed (several times faster than the
+#   standard json module), otherwise with json + a fallback for the types below.
+# - datetime and date are written as ISO 8601 strings ("2025-09-27T14:03:11.123456"),
+#   Decimal as a number. Models can return the raw values from to_dict() instead of
+#   calling isoformat() themselves.
+# - A client that sends "Accept: application/msgpack" (our POS terminals) gets the same
+#   data as MessagePack, a compact binary format, instead of text JSON.
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # fall back to the standard library
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is only offered when the package is installed
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+
+def _default(obj):
+    """Convert the types JSON/MessagePack don't know about"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, with Accept: application/msgpack support"""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        kwargs.setdefault('default', _default)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def decode(self, body, mimetype):
+        """The data in a JSON or MessagePack body written by response()"""
+        if mimetype == MSGPACK_MIMETYPE:
+            return msgpack.unpackb(body, raw=False)
+        return self.loads(body)
+
+    def wants_msgpack(self):
+        """True when the client prefers MessagePack over JSON"""
+        if msgpack is None or not has_request_context():
+            return False
+        accept = request.accept_mimetypes
+        return accept.quality(MSGPACK_MIMETYPE) > accept.quality(self.mimetype)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+
+        if self.wants_msgpack():
+            body = msgpack.packb(obj, default=_default, use_bin_type=True)
+            response = self._app.response_class(body, mimetype=MSGPACK_MIMETYPE)
+        elif orjson is not None:
+            body = orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+            response = self._app.response_class(body, mimetype=self.mimetype)
+        else:
+            response = self._app.response_class(f'{self.dumps(obj)}\n', mimetype=self.mimetype)
+
+        # The same URL can now return two formats, so caches must key on Accept
+        response.vary.add('Accept')
+        return response
@@ -0,0 +1,322 @@
+# leaderboards.py
+# Best-seller lists (last 24 hours, 7 days, 30 days, all time; overall and per genre)
+# kept up to date as orders come in, so /api/books/top never has to add up sale_items.
+#
+# Two layers:
+#   - the book_sales_hourly table: copies sold per book per hour. count_sale() adds
+#     an order to it inside the order's own transaction. rebuild_counters() recreates
+#     it from the sales history (python leaderboards.py rebuild).
+#   - in every worker, a SortedList per (window, genre) ranked by copies sold, plus
+#     the hourly buckets of the last 30 days. record_sale() adds a committed order in
+#     O(log n) per book; when the clock moves into a new hour the buckets that fell
+#     out of a window are subtracted from it. A lookup is a slice of a sorted list.
+#
+# Orders placed in other gunicorn workers reach this worker's lists when it reloads
+# them from book_sales_hourly, at most every LEADERBOARD_SYNC_SECONDS (default 30).
+# The reload runs in a background thread and the new lists are swapped in when they
+# are ready, so lookups and record_sale() never wait for it.
+#
+# Usage (in app.py):
+#   leaderboards.init_app(app)
+#   leaderboards.count_sale(sold)      before db.session.commit(), sold = [(book, quantity), ...]
+#   leaderboards.record_sale(sold)     after the commit
+#   leaderboards.top(app, '7d', genre='Fiction', limit=10)
+import argparse
+import calendar
+import threading
+import time
+from collections import Counter, defaultdict
+
+from sortedcontainers import SortedList
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, ArchivedSale, ArchivedSaleItem, Book, BookSalesHourly, Sale, SaleItem
+from read_models import columns_for
+
+# Window name -> length in hours (None = all time)
+WINDOWS = {'24h': 24, '7d': 7 * 24, '30d': 30 * 24, 'all': None}
+
+# Hourly buckets older than the longest window are only needed for 'all'
+KEEP_HOURS = max(hours for hours in WINDOWS.values() if hours)
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE
+UPSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def current_hour(now=None):
+    return int((time.time() if now is None else now) // 3600)
+
+
+def hour_of(moment):
+    """Bucket for a naive UTC datetime (how sale_date is stored)"""
+    return calendar.timegm(moment.utctimetuple()) // 3600
+
+
+def _genre_key(genre):
+    return (genre or '').strip().lower()
+
+
+class Leaderboard:
+    """Copies sold per book, kept sorted best seller first"""
+
+    def __init__(self):
+        self.units = {}
+        self.ranking = SortedList()  # (-units, book_id)
+
+    def add(self, book_id, delta):
+        old = self.units.get(book_id, 0)
+        if old:
+            self.ranking.remove((-old, book_id))
+        new = old + delta
+        if new > 0:
+            self.units[book_id] = new
+            self.ranking.add((-new, book_id))
+        else:
+            self.units.pop(book_id, None)
+
+    def top(self, limit):
+        return [(book_id, -negative_units) for negative_units, book_id in self.ranking[:limit]]
+
+
+class Leaderboards:
+    """Every window x genre leaderboard, built from hourly buckets"""
+
+    def __init__(self, hour):
+        self.hour = hour
+        self.hours = defaultdict(Counter)   # hour -> {book_id: units}, last KEEP_HOURS only
+        self.books = {}                     # book_id -> book dict (for the response)
+        self.boards = defaultdict(Leaderboard)  # (window, genre key or '') -> Leaderboard
+
+    def _add_to_boards(self, book_id, units, hour):
+        genre = _genre_key(self.books[book_id].get('genre'))
+        for window, length in WINDOWS.items():
+            if length is None or hour > self.hour - length:
+                self.boards[(window, '')].add(book_id, units)
+                if genre:
+                    self.boards[(window, genre)].add(book_id, units)
+
+    def add(self, book, units, hour):
+        """Count `units` copies of `book` (a book dict) sold in `hour`"""
+        self.books[book['id']] = book
+        if hour > self.hour - KEEP_HOURS:
+            self.hours[hour][book['id']] += units
+        self._add_to_boards(book['id'], units, hour)
+
+    def add_all_time(self, book, units):
+        """Count sales that are too old for any window but 'all'"""
+        self.books[book['id']] = book
+        self.boards[('all', '')].add(book['id'], units)
+        genre = _genre_key(book.get('genre'))
+        if genre:
+            self.boards[('all', genre)].add(book['id'], units)
+
+    def advance(self, hour):
+        """Move the clock forward, subtracting the buckets that left each window"""
+        if hour <= self.hour:
+            return
+        for window, length in WINDOWS.items():
+            if length is None:
+                continue
+            # Buckets in (old_hour - length, new_hour - length] just fell out of this window
+            expired = [h for h in self.hours if self.hour - length < h <= hour - length]
+            for expired_hour in expired:
+                for book_id, units in self.hours[expired_hour].items():
+                    genre = _genre_key(self.books[book_id].get('genre'))
+                    self.boards[(window, '')].add(book_id, -units)
+                    if genre:
+                        self.boards[(window, genre)].add(book_id, -units)
+        self.hour = hour
+        for old in [h for h in self.hours if h <= hour - KEEP_HOURS]:
+            del self.hours[old]
+
+    def top(self, window, genre, limit):
+        board = self.boards.get((window, _genre_key(genre)))
+        if board is None:
+            return []
+        return [{**self.books[book_id], 'units_sold': units} for book_id, units in board.top(limit)]
+
+
+# ===============================
+# DATABASE COUNTERS
+# ===============================
+
+def count_sale(sold):
+    """Add an order to book_sales_hourly; call before the order's commit"""
+    hour = current_hour()
+    totals = Counter()
+    for book, quantity in sold:
+        totals[book.id] += quantity
+
+    table = BookSalesHourly.__table__
+    upsert = UPSERTS.get(db.session.get_bind().dialect.name)
+    for book_id, units in totals.items():
+        if upsert is not None:
+            db.session.execute(
+                upsert(table)
+                .values(hour=hour, book_id=book_id, units=units)
+                .on_conflict_do_update(index_elements=['hour', 'book_id'], set_={'units': table.c.units + units})
+            )
+            continue
+        result = db.session.execute(
+            update(table).where(table.c.hour == hour, table.c.book_id == book_id).values(units=table.c.units + units)
+        )
+        if result.rowcount == 0:
+            db.session.execute(table.insert().values(hour=hour, book_id=book_id, units=units))
+
+
+def rebuild_counters(chunk_size=50_000):
+    """Recreate book_sales_hourly from every completed sale; returns the number of rows"""
+    totals = Counter()
+    live = (
+        select(Sale.sale_date, SaleItem.book_id, SaleItem.quantity)
+        .join(Sale, SaleItem.sale_id == Sale.id)
+        .where(Sale.status == 'completed', Sale.sale_date.is_not(None))
+    )
+    # Old orders moved out by archive.py (only completed ones are archived)
+    archived = (
+        select(ArchivedSale.sale_date, ArchivedSaleItem.book_id, ArchivedSaleItem.quantity)
+        .join(ArchivedSale, ArchivedSaleItem.sale_id == ArchivedSale.id)
+        .where(ArchivedSale.sale_date.is_not(None))
+    )
+    for stmt in (live, archived):
+        for rows in db.session.execute(stmt).partitions(chunk_size):
+            for sale_date, book_id, quantity in rows:
+                totals[(hour_of(sale_date), book_id)] += quantity
+
+    db.session.execute(delete(BookSalesHourly))
+    rows = [{'hour': hour, 'book_id': book_id, 'units': units} for (hour, book_id), units in totals.items()]
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(BookSalesHourly.__table__.insert(), rows[start:start + chunk_size])
+    db.session.commit()
+    return len(rows)
+
+
+def load_leaderboards(hour):
+    """Build the in-memory leaderboards from book_sales_hourly"""
+    boards = Leaderboards(hour)
+    book_columns = columns_for(Book)
+    first_window_hour = hour - KEEP_HOURS + 1
+
+    recent = db.session.execute(
+        select(BookSalesHourly.hour, BookSalesHourly.units, *book_columns)
+        .join(Book, BookSalesHourly.book_id == Book.id)
+        .where(BookSalesHourly.hour >= first_window_hour, BookSalesHourly.hour <= hour)
+    )
+    for row in recent:
+        boards.add(dict(zip(Book.API_FIELDS, row[2:])), row.units, row.hour)
+
+    older = db.session.execute(
+        select(func.sum(BookSalesHourly.units), *book_columns)
+        .join(Book, BookSalesHourly.book_id == Book.id)
+        .where(BookSalesHourly.hour < first_window_hour)
+        .group_by(Book.id)
+    )
+    for row in older:
+        boards.add_all_time(dict(zip(Book.API_FIELDS, row[1:])), row[0])
+    return boards
+
+
+# ===============================
+# PER-PROCESS STATE
+# ===============================
+
+_lock = threading.Lock()
+# boards: the lists in use; synced_at: when the read they were loaded from started;
+# checked_at: when the last reload was started; recent: orders recorded while a reload runs
+_state = {'boards': None, 'synced_at': 0.0, 'checked_at': 0.0, 'refreshing': False, 'recent': []}
+
+
+def init_app(app):
+    app.config.setdefault('LEADERBOARD_SYNC_SECONDS', 30)
+
+
+def _add(boards, sold, committed_at):
+    hour = current_hour(committed_at)
+    boards.advance(hour)
+    for book, quantity in sold:
+        boards.add(book, quantity, hour)
+
+
+def record_sale(sold):
+    """Add a committed order to this worker's leaderboards; sold is [(book or book dict, quantity), ...]"""
+    committed_at = time.time()
+    sold = [(book if isinstance(book, dict) else book.to_dict(), quantity) for book, quantity in sold]
+    with _lock:
+        boards = _state['boards']
+        # A reload that started after the commit already contains this order
+        if boards is None or committed_at < _state['synced_at']:
+            return
+        _add(boards, sold, committed_at)
+        if _state['refreshing']:
+            # The reload running now may have read the table before this order
+            _state['recent'].append((committed_at, sold))
+
+
+def _install(boards, started_at):
+    """Use freshly loaded lists (call with the lock held)"""
+    for committed_at, sold in _state['recent']:
+        if committed_at >= started_at:
+            _add(boards, sold, committed_at)
+    _state['recent'] = []
+    _state['boards'] = boards
+    _state['synced_at'] = started_at
+
+
+def _refresh(app):
+    """Reload from book_sales_hourly in a background thread, then swap the result in"""
+    try:
+        with app.app_context():
+            started_at = time.time()
+            boards = load_leaderboards(current_hour(started_at))
+            db.session.remove()
+            with _lock:
+                _install(boards, started_at)
+    finally:
+        _state['refreshing'] = False
+
+
+def warm(app):
+    """Load the lists now (the first lookup in a worker has nothing to show until then)"""
+    started_at = time.time()
+    boards = load_leaderboards(current_hour(started_at))
+    # Don't keep the read transaction open
+    db.session.rollback()
+    with _lock:
+        if _state['boards'] is None:
+            _install(boards, started_at)
+            _state['checked_at'] = started_at
+        return _state['boards']
+
+
+def top(app, window='7d', genre=None, limit=10):
+    """Best sellers for a window ('24h', '7d', '30d' or 'all'), optionally for one genre"""
+    if window not in WINDOWS:
+        raise ValueError(f"window must be one of {', '.join(WINDOWS)}")
+    now = time.time()
+    with _lock:
+        boards = _state['boards']
+        # Lookups keep using the current lists while a reload runs in the background
+        stale = now - _state['checked_at'] >= app.config['LEADERBOARD_SYNC_SECONDS']
+        if boards is not None and stale and not _state['refreshing']:
+            _state['checked_at'] = now
+            _state['refreshing'] = True
+            _state['recent'] = []
+            threading.Thread(target=_refresh, args=(app,), name='leaderboard-refresh', daemon=True).start()
+    if boards is None:
+        boards = warm(app)
+    with _lock:
+        boards.advance(current_hour(now))
+        return boards.top(window, genre, limit)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Best-seller counters')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild', help='recreate book_sales_hourly from the sales history')
+    args = parser.parse_args()
+
+    from app import app as flask_app
+
+    with flask_app.app_context():
+        print(f"book_sales_hourly rebuilt: {rebuild_counters()} rows")
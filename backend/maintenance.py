@@ -0,0 +1,362 @@
+# maintenance.py
+# Background housekeeping so the database doesn't grow forever and stays fast.
+#
+# Jobs (intervals in seconds, override with app.config['MAINTENANCE_INTERVALS']):
+#   purge_password_resets   delete reset tokens that are used or expired     (hourly)
+#   purge_stale_carts       delete carts nobody touched for CART_MAX_AGE_DAYS (hourly)
+#   purge_notifications     delete acknowledged notifications older than
+#                           NOTIFICATION_MAX_AGE_DAYS                         (daily)
+#   purge_idempotency_keys  delete expired Idempotency-Key responses        (hourly)
+#   purge_jobs              delete background jobs finished more than
+#                           JOB_KEEP_DONE_HOURS ago, see jobs.py              (hourly)
+#   purge_tombstones        forget deleted books older than SYNC_TOMBSTONE_DAYS
+#                           for /api/books/changes, see catalog_sync.py       (daily)
+#   rebuild_recommendations rebuild the "customers also bought" snapshot   (hourly)
+#   forecast_demand         recompute the reorder suggestions                 (daily)
+#   journal_flush           copy new inventory events into the journal files  (every minute)
+#   archive_sales           move completed orders older than ARCHIVE_AFTER_DAYS
+#                           into the archive database                         (daily)
+#   backup_databases        online, verified, gzipped backup of the SQLite
+#                           files into BACKUP_DIR, see backup.py              (hourly)
+#   wal_checkpoint          copy the SQLite WAL back into the main file       (every 5 min)
+#   analyze                 refresh SQLite's query planner statistics         (daily)
+#   vacuum                  give free pages back to the disk                  (weekly)
+#
+# Deletes run in chunks of MAINTENANCE_CHUNK_SIZE rows, each in its own short
+# transaction, so checkout never waits long behind a purge.
+#
+# Running it:
+#   - under gunicorn every worker starts the scheduler thread (MAINTENANCE_SCHEDULER=0 turns it off);
+#     the maintenance_jobs table works as a lock so each job runs in only one worker at a time
+#   - from the command line (or cron):
+#       python maintenance.py run                     run every job that is due
+#       python maintenance.py run --force vacuum      run one job now
+#       python maintenance.py status                  show the per-job metrics
+import argparse
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, text, update
+
+import archive
+import backup
+import catalog_sync
+import forecasting
+import journal
+import recommendations
+from models import db, BackgroundJob, IdempotencyKey, MaintenanceJob, Notification, PasswordReset, Sale, SaleItem
+
+DEFAULT_INTERVALS = {
+    'purge_password_resets': 3600,
+    'purge_stale_carts': 3600,
+    'purge_notifications': 86400,
+    'purge_idempotency_keys': 3600,
+    'purge_jobs': 3600,
+    'purge_tombstones': 86400,
+    'rebuild_recommendations': 3600,
+    'forecast_demand': 86400,
+    'journal_flush': 60,
+    'archive_sales': 86400,
+    'backup_databases': 3600,
+    'wal_checkpoint': 300,
+    'analyze': 86400,
+    'vacuum': 7 * 86400,
+}
+
+# How often the scheduler thread wakes up to look for due jobs
+TICK_SECONDS = 30
+
+# A job holding the lock longer than this is assumed to have crashed
+LOCK_LEASE = timedelta(minutes=15)
+
+
+# ===============================
+# JOBS
+# Each job returns the number of rows it touched (0 for the SQLite ones)
+# ===============================
+
+def _delete_in_chunks(model, condition, chunk_size):
+    """Delete matching rows a chunk at a time, committing after each chunk"""
+    primary_key = model.__mapper__.primary_key[0]
+    deleted = 0
+    while True:
+        ids = db.session.execute(select(primary_key).where(condition).limit(chunk_size)).scalars().all()
+        if not ids:
+            return deleted
+        db.session.execute(delete(model).where(primary_key.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+
+
+def purge_password_resets(app):
+    now = datetime.utcnow()
+    condition = PasswordReset.used_at.is_not(None) | (PasswordReset.expires_at < now)
+    return _delete_in_chunks(PasswordReset, condition, app.config['MAINTENANCE_CHUNK_SIZE'])
+
+
+def purge_stale_carts(app):
+    chunk_size = app.config['MAINTENANCE_CHUNK_SIZE']
+    cutoff = datetime.utcnow() - timedelta(days=app.config['CART_MAX_AGE_DAYS'])
+    deleted = 0
+    while True:
+        # add_to_cart moves a cart's sale_date forward, so this is the last time an item was added
+        ids = db.session.execute(
+            select(Sale.id).where(Sale.status == 'cart', Sale.sale_date < cutoff).limit(chunk_size)
+        ).scalars().all()
+        if not ids:
+            return deleted
+        # Items first, they point at the cart
+        db.session.execute(delete(SaleItem).where(SaleItem.sale_id.in_(ids)))
+        db.session.execute(delete(Notification).where(Notification.sale_id.in_(ids)))
+        db.session.execute(delete(Sale).where(Sale.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+
+
+def purge_notifications(app):
+    cutoff = datetime.utcnow() - timedelta(days=app.config['NOTIFICATION_MAX_AGE_DAYS'])
+    condition = Notification.seen_at.is_not(None) & (Notification.seen_at < cutoff)
+    return _delete_in_chunks(Notification, condition, app.config['MAINTENANCE_CHUNK_SIZE'])
+
+
+def purge_idempotency_keys(app):
+    condition = IdempotencyKey.expires_at < datetime.utcnow()
+    return _delete_in_chunks(IdempotencyKey, condition, app.config['MAINTENANCE_CHUNK_SIZE'])
+
+
+def purge_jobs(app):
+    # Dead jobs are kept until an admin retries them
+    cutoff = datetime.utcnow() - timedelta(hours=app.config['JOB_KEEP_DONE_HOURS'])
+    condition = (BackgroundJob.status == 'done') & (BackgroundJob.finished_at < cutoff)
+    return _delete_in_chunks(BackgroundJob, condition, app.config['MAINTENANCE_CHUNK_SIZE'])
+
+
+def purge_tombstones(app):
+    # Returns the number of tombstones removed
+    return catalog_sync.purge_tombstones(app)
+
+
+def rebuild_recommendations(app):
+    # Returns the number of books in the new snapshot
+    return recommendations.rebuild(app)
+
+
+def forecast_demand(app):
+    # Returns the number of reorder suggestions written
+    return forecasting.run_forecast(app)
+
+
+def journal_flush(app):
+    # Returns the number of events copied
+    return journal.flush(app)
+
+
+def archive_sales(app):
+    # Returns the number of orders moved
+    return archive.archive_sales(app)
+
+
+def backup_databases(app):
+    # Returns the number of database pages copied
+    return backup.backup_databases(app)
+
+
+def _sqlite_statement(sql):
+    """Run a statement outside a transaction (VACUUM refuses to run inside one)"""
+    if db.engine.dialect.name != 'sqlite':
+        return 0
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text(sql))
+    return 0
+
+
+def wal_checkpoint(app):
+    # PASSIVE never blocks readers or writers, it copies what it can
+    return _sqlite_statement('PRAGMA wal_checkpoint(PASSIVE)')
+
+
+def analyze(app):
+    return _sqlite_statement('ANALYZE')
+
+
+def vacuum(app):
+    return _sqlite_statement('VACUUM')
+
+
+JOBS = {
+    'purge_password_resets': purge_password_resets,
+    'purge_stale_carts': purge_stale_carts,
+    'purge_notifications': purge_notifications,
+    'purge_idempotency_keys': purge_idempotency_keys,
+    'purge_jobs': purge_jobs,
+    'purge_tombstones': purge_tombstones,
+    'rebuild_recommendations': rebuild_recommendations,
+    'forecast_demand': forecast_demand,
+    'journal_flush': journal_flush,
+    'archive_sales': archive_sales,
+    'backup_databases': backup_databases,
+    'wal_checkpoint': wal_checkpoint,
+    'analyze': analyze,
+    'vacuum': vacuum,
+}
+
+
+# ===============================
+# LOCKING AND METRICS
+# ===============================
+
+def _worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def ensure_job_rows():
+    """Create the maintenance_jobs row for every job that doesn't have one yet"""
+    existing = set(db.session.execute(select(MaintenanceJob.name)).scalars())
+    for name in JOBS:
+        if name not in existing:
+            db.session.add(MaintenanceJob(name=name, run_count=0, failure_count=0))
+    try:
+        db.session.commit()
+    except Exception:
+        # Another worker inserted the same rows at the same moment
+        db.session.rollback()
+
+
+def try_claim(name, interval, force=False):
+    """
+    Atomically take the lock for a job if it is due and nobody else holds it
+    A single UPDATE ... WHERE decides the winner, so this is safe across processes.
+    """
+    now = datetime.utcnow()
+    conditions = [
+        MaintenanceJob.name == name,
+        (MaintenanceJob.locked_until.is_(None)) | (MaintenanceJob.locked_until < now),
+    ]
+    if not force:
+        due_before = now - timedelta(seconds=interval)
+        conditions.append((MaintenanceJob.last_started_at.is_(None)) | (MaintenanceJob.last_started_at <= due_before))
+    result = db.session.execute(
+        update(MaintenanceJob)
+        .where(*conditions)
+        .values(locked_until=now + LOCK_LEASE, locked_by=_worker_id(), last_started_at=now)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def run_job(app, name, force=False):
+    """Run one job if it is due (or forced); returns its metrics dict, or None if skipped"""
+    interval = app.config['MAINTENANCE_INTERVALS'][name]
+    if not try_claim(name, interval, force):
+        return None
+
+    start = time.perf_counter()
+    rows, error = None, None
+    try:
+        rows = JOBS[name](app)
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc(limit=3)
+
+    duration_ms = (time.perf_counter() - start) * 1000
+    values = dict(
+        locked_until=None,
+        locked_by=None,
+        last_finished_at=datetime.utcnow(),
+        last_duration_ms=duration_ms,
+        last_rows=rows,
+        last_error=error,
+        run_count=MaintenanceJob.run_count + 1,
+    )
+    if error:
+        values['failure_count'] = MaintenanceJob.failure_count + 1
+    db.session.execute(update(MaintenanceJob).where(MaintenanceJob.name == name).values(**values))
+    db.session.commit()
+    return {'name': name, 'rows': rows, 'duration_ms': duration_ms, 'error': error}
+
+
+def run_due_jobs(app, only=None, force=False):
+    """Run every due job (or just the ones named in `only`) and return their metrics"""
+    with app.app_context():
+        ensure_job_rows()
+        results = []
+        for name in only or JOBS:
+            result = run_job(app, name, force)
+            if result is not None:
+                results.append(result)
+        db.session.remove()
+        return results
+
+
+def job_status(app):
+    """Per-job metrics for the admin endpoint and the status command"""
+    with app.app_context():
+        ensure_job_rows()
+        rows = MaintenanceJob.query.order_by(MaintenanceJob.name).all()
+        data = []
+        for row in rows:
+            item = row.to_dict()
+            item['interval_seconds'] = app.config['MAINTENANCE_INTERVALS'].get(row.name)
+            data.append(item)
+        return data
+
+
+# ===============================
+# SCHEDULER THREAD
+# ===============================
+
+def init_app(app):
+    """Register the maintenance settings with their defaults"""
+    app.config.setdefault('MAINTENANCE_INTERVALS', {})
+    app.config['MAINTENANCE_INTERVALS'] = {**DEFAULT_INTERVALS, **app.config['MAINTENANCE_INTERVALS']}
+    app.config.setdefault('MAINTENANCE_CHUNK_SIZE', 500)
+    app.config.setdefault('CART_MAX_AGE_DAYS', 30)
+    app.config.setdefault('NOTIFICATION_MAX_AGE_DAYS', 30)
+
+
+def start_scheduler(app):
+    """Start the background thread (does nothing when MAINTENANCE_SCHEDULER=0)"""
+    if os.getenv('MAINTENANCE_SCHEDULER', '1') == '0':
+        return None
+
+    def loop():
+        while True:
+            try:
+                run_due_jobs(app)
+            except Exception:
+                traceback.print_exc()
+            time.sleep(TICK_SECONDS)
+
+    thread = threading.Thread(target=loop, name='maintenance-scheduler', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run database maintenance jobs')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run', help='run due jobs')
+    run_parser.add_argument('jobs', nargs='*', help=f"only these jobs ({', '.join(JOBS)})")
+    run_parser.add_argument('--force', action='store_true', help='run even if not due yet')
+    sub.add_parser('status', help='show per-job metrics')
+    args = parser.parse_args()
+    unknown = [name for name in getattr(args, 'jobs', []) if name not in JOBS]
+    if unknown:
+        parser.error(f"unknown job(s): {', '.join(unknown)}")
+
+    from app import app as flask_app
+
+    if args.command == 'run':
+        for result in run_due_jobs(flask_app, only=args.jobs or None, force=args.force):
+            status = 'FAILED' if result['error'] else 'ok'
+            print(f"{result['name']:<24}{status:<8}rows={result['rows']}  {result['duration_ms']:.1f} ms")
+            if result['error']:
+                print(result['error'])
+    else:
+        for job in job_status(flask_app):
+            print(f"{job['name']:<24}runs={job['run_count']:<6}failures={job['failure_count']:<4}"
+                  f"last={job['last_finished_at']}  {job['last_duration_ms'] or 0:.1f} ms  rows={job['last_rows']}")
@@ -13,7 +13,20 @@ from flask import current_app
 db = SQLAlchemy()
 bcrypt = Bcrypt()
 
-class User(db.Model):
+
+class ApiFieldsMixin:
+    """
+    Each model lists the columns it sends to the frontend in API_FIELDS
+    to_dict() and the fast read path in read_models.py both use this one list,
+    so the two ways of building a response can never disagree.
+    """
+    API_FIELDS = ()
+
+    def api_fields_dict(self):
+        return {name: getattr(self, name) for name in self.API_FIELDS}
+
+
+class User(ApiFieldsMixin, db.Model):
     """
     User model for authentication and authorization
     This stores information about people who can log into our system
@@ -35,6 +48,9 @@ class User(db.Model):
     
     # When this user account was created
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Columns sent to the frontend (password_hash is deliberately left out)
+    API_FIELDS = ('id', 'username', 'email', 'role', 'created_at')
     
     def set_password(self, password):
         """
@@ -129,19 +145,16 @@ class User(db.Model):
             return None
     
     def to_dict(self):
-        """Convert user object to dictionary (but don't include password!)"""
-        return {
-            'id': self.id,
-            'username': self.username,
-            'email': self.email,
-            'role': self.role,
-            'created_at': self.created_at.isoformat()
-        }
+        """
+        Convert user object to dictionary (but don't include password!)
+        Dates stay as datetime objects, the JSON provider turns them into ISO strings
+        """
+        return self.api_fields_dict()
     
     def __repr__(self):
         return f'<User {self.username}>'
 
-class Book(db.Model):
+class Book(ApiFieldsMixin, db.Model):
     """
     Book model for the bookstore database
     This is the same as before - no changes needed
@@ -157,29 +170,36 @@ class Book(db.Model):
     genre = db.Column(db.String(100))
     publication_date = db.Column(db.Date)
     stock_quantity = db.Column(db.Integer, default=0)
+    # Stock at or below this counts as low and triggers a LOW_STOCK alert
+    reorder_point = db.Column(db.Integer, nullable=False, default=5, server_default='5')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Position in the catalog's change sequence, set on every insert and update (see catalog_sync.py)
+    change_seq = db.Column(db.Integer, nullable=True, index=True)
+
+    # "Which books need reordering" is WHERE stock_quantity - reorder_point <= 0.
+    # Indexing that expression turns it into a range lookup instead of a scan of every book,
+    # and the rows come back most-short first.
+    __table_args__ = (
+        db.Index('ix_books_stock_below_reorder', stock_quantity - reorder_point),
+    )
+
+    API_FIELDS = ('id', 'title', 'author', 'isbn', 'price', 'description', 'genre',
+                  'publication_date', 'stock_quantity', 'reorder_point', 'created_at', 'updated_at')
+
+    @classmethod
+    def stock_gap(cls):
+        """SQL expression matching the index above: <= 0 means the book needs reordering"""
+        return cls.stock_quantity - cls.reorder_point
     
     def to_dict(self):
         """Convert book object to dictionary for JSON response"""
-        return {
-            'id': self.id,
-            'title': self.title,
-            'author': self.author,
-            'isbn': self.isbn,
-            'price': self.price,
-            'description': self.description,
-            'genre': self.genre,
-            'publication_date': self.publication_date.isoformat() if self.publication_date else None,
-            'stock_quantity': self.stock_quantity,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
-        }
+        return self.api_fields_dict()
     
     def __repr__(self):
         return f'<Book {self.title} by {self.author}>'
 
-class Sale(db.Model):
+class Sale(ApiFieldsMixin, db.Model):
     """
     Sale model for recording completed transactions
     Stores information about each sale including customer details and items purchased
@@ -195,23 +215,30 @@ class Sale(db.Model):
     
     # Relationship to user
     user = db.relationship('User', backref=db.backref('sales', lazy=True))
+
+    # Order lists are sorted newest first and paged by (sale_date, id), for everyone
+    # or for one customer, so both orders can be read straight from an index
+    # AUTOINCREMENT: SQLite must never hand out an id again once its order was deleted
+    # or archived (see archive.py), or GET /api/sales/<id> would find two orders
+    __table_args__ = (
+        db.Index('ix_sales_sale_date_id', 'sale_date', 'id'),
+        db.Index('ix_sales_user_id_sale_date_id', 'user_id', 'sale_date', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+
+    # to_dict() also adds the nested 'user'
+    API_FIELDS = ('id', 'customer_email', 'user_id', 'total_amount', 'sale_date', 'status')
     
     def to_dict(self):
         """Convert sale object to dictionary for JSON response"""
-        return {
-            'id': self.id,
-            'customer_email': self.customer_email,
-            'user_id': self.user_id,
-            'total_amount': self.total_amount,
-            'sale_date': self.sale_date.isoformat(),
-            'status': self.status,
-            'user': self.user.to_dict() if self.user else None
-        }
+        data = self.api_fields_dict()
+        data['user'] = self.user.to_dict() if self.user else None
+        return data
     
     def __repr__(self):
         return f'<Sale {self.id} - ${self.total_amount}>'
 
-class SaleItem(db.Model):
+class SaleItem(ApiFieldsMixin, db.Model):
     """
     SaleItem model for storing individual items in each sale
     This creates a many-to-many relationship between Sales and Books
@@ -219,7 +246,7 @@ class SaleItem(db.Model):
     __tablename__ = 'sale_items'
     
     id = db.Column(db.Integer, primary_key=True)
-    sale_id = db.Column(db.Integer, db.ForeignKey('sales.id'), nullable=False)
+    sale_id = db.Column(db.Integer, db.ForeignKey('sales.id'), nullable=False, index=True)
     book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False, default=1)
     price_at_time = db.Column(db.Float, nullable=False)  # Store price at time of sale
@@ -227,22 +254,20 @@ class SaleItem(db.Model):
     # Relationships
     sale = db.relationship('Sale', backref=db.backref('items', lazy=True, cascade='all, delete-orphan'))
     book = db.relationship('Book', backref=db.backref('sale_items', lazy=True))
+
+    # to_dict() also adds the nested 'book'
+    API_FIELDS = ('id', 'sale_id', 'book_id', 'quantity', 'price_at_time')
     
     def to_dict(self):
         """Convert sale item object to dictionary for JSON response"""
-        return {
-            'id': self.id,
-            'sale_id': self.sale_id,
-            'book_id': self.book_id,
-            'quantity': self.quantity,
-            'price_at_time': self.price_at_time,
-            'book': self.book.to_dict() if self.book else None
-        }
+        data = self.api_fields_dict()
+        data['book'] = self.book.to_dict() if self.book else None
+        return data
     
     def __repr__(self):
         return f'<SaleItem {self.id} - Book {self.book_id} x{self.quantity}>'
 # --- Notifications -----------------------------------------------------------
-class Notification(db.Model):
+class Notification(ApiFieldsMixin, db.Model):
     __tablename__ = 'notifications'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -258,16 +283,10 @@ class Notification(db.Model):
     book = db.relationship('Book', backref=db.backref('notifications', lazy=True))
     sale = db.relationship('Sale', backref=db.backref('notifications', lazy=True))
 
+    API_FIELDS = ('id', 'type', 'message', 'book_id', 'sale_id', 'created_at', 'seen_at')
+
     def to_dict(self):
-        return {
-            'id': self.id,
-            'type': self.type,
-            'message': self.message,
-            'book_id': self.book_id,
-            'sale_id': self.sale_id,
-            'created_at': self.created_at.isoformat(),
-            'seen_at': self.seen_at.isoformat() if self.seen_at else None
-        }
+        return self.api_fields_dict()
 
 # --- Password Reset Tokens ---------------------------------------------------
 class PasswordReset(db.Model):
@@ -281,3 +300,231 @@ class PasswordReset(db.Model):
 
     def is_valid(self):
         return self.used_at is None and datetime.utcnow() < self.expires_at
+
+# --- Background maintenance jobs ---------------------------------------------
+class MaintenanceJob(ApiFieldsMixin, db.Model):
+    """
+    One row per maintenance job (see maintenance.py)
+    The row doubles as a lock shared by every worker process: a worker only runs a
+    job after it managed to set locked_until, so two workers never run the same job.
+    It also keeps the metrics from the last run.
+    """
+    __tablename__ = 'maintenance_jobs'
+
+    name = db.Column(db.String(64), primary_key=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    locked_by = db.Column(db.String(64), nullable=True)
+
+    last_started_at = db.Column(db.DateTime, nullable=True)
+    last_finished_at = db.Column(db.DateTime, nullable=True)
+    last_duration_ms = db.Column(db.Float, nullable=True)
+    last_rows = db.Column(db.Integer, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    run_count = db.Column(db.Integer, nullable=False, default=0)
+    failure_count = db.Column(db.Integer, nullable=False, default=0)
+
+    API_FIELDS = ('name', 'locked_until', 'locked_by', 'last_started_at', 'last_finished_at',
+                  'last_duration_ms', 'last_rows', 'last_error', 'run_count', 'failure_count')
+
+    def to_dict(self):
+        return self.api_fields_dict()
+
+# --- Idempotency keys ----------------------------------------------------------
+class IdempotencyKey(db.Model):
+    """
+    Remembers the response to a POST that carried an Idempotency-Key header
+    (see idempotency.py) so a retried request gets the same answer instead of
+    placing the order a second time. Rows expire after a day.
+    """
+    __tablename__ = 'idempotency_keys'
+
+    # sha256 of the caller's credentials + path + Idempotency-Key, so keys can't clash between users
+    key = db.Column(db.String(64), primary_key=True)
+    # sha256 of the request body, to catch the same key reused for a different request
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='in_progress')  # in_progress, completed
+    response_status = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.LargeBinary, nullable=True)
+    response_content_type = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    # While in_progress: after this time the request's worker is presumed dead and a retry may take over
+    locked_until = db.Column(db.DateTime, nullable=True)
+
+# --- Best-seller counters ------------------------------------------------------
+class BookSalesHourly(db.Model):
+    """
+    Copies sold per book per hour (see leaderboards.py)
+    Updated in the same transaction as the order, so it always matches the sales.
+    The top-seller lists are sums over these rows instead of over every sale_item,
+    and the whole table can be rebuilt from the sales history at any time.
+    """
+    __tablename__ = 'book_sales_hourly'
+
+    # Hours since 1970-01-01 UTC, so the bucket math is plain integer arithmetic
+    hour = db.Column(db.Integer, primary_key=True)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+
+# --- Catalog version -----------------------------------------------------------
+class CatalogVersion(db.Model):
+    """
+    One row whose number goes up whenever the book facets change (see facets.py):
+    a book is added, edited or deleted, or a sale empties or restocks a book.
+    Bumped in the same transaction as the change, so a cache tagged with the
+    version it was computed at knows when it is out of date.
+    """
+    __tablename__ = 'catalog_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# --- Catalog change sequence ---------------------------------------------------
+class SyncSequence(db.Model):
+    """
+    One row holding the last number handed out to a book change (see catalog_sync.py)
+    Every transaction that creates, edits, sells or deletes books takes the next number,
+    so /api/books/changes?since=N can return just what changed after N.
+    purged_through is the newest tombstone deleted by maintenance: a client that last
+    synced before it may have missed a delete and has to start over.
+    """
+    __tablename__ = 'sync_sequence'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    purged_through = db.Column(db.Integer, nullable=False, default=0)
+
+class BookTombstone(db.Model):
+    """A deleted book, kept so sync clients can remove it too (see catalog_sync.py)"""
+    __tablename__ = 'book_tombstones'
+
+    book_id = db.Column(db.Integer, primary_key=True)
+    change_seq = db.Column(db.Integer, nullable=False, index=True)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+# --- Background jobs -----------------------------------------------------------
+class BackgroundJob(ApiFieldsMixin, db.Model):
+    """
+    One unit of work for the background job queue (see jobs.py)
+    Enqueued in the same transaction as the change that needs it, so a worker only
+    ever sees a job once that change is committed. The row also records the retries
+    and the last error; jobs that failed too often stay here as 'dead'.
+    """
+    __tablename__ = 'background_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, done, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # A running job whose lease ran out belongs to a worker that died, and is picked up again
+    locked_by = db.Column(db.String(64), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_background_jobs_status_run_after', 'status', 'run_after'),
+    )
+
+    API_FIELDS = ('id', 'kind', 'payload', 'status', 'attempts', 'max_attempts', 'created_at', 'run_after',
+                  'started_at', 'finished_at', 'locked_by', 'locked_until', 'last_error')
+
+    def to_dict(self):
+        return self.api_fields_dict()
+
+# --- Reorder suggestions -------------------------------------------------------
+class ReorderSuggestion(ApiFieldsMixin, db.Model):
+    """
+    Output of the demand forecast (see forecasting.py): one row per book that
+    should be reordered now. The whole table is replaced on every run.
+    """
+    __tablename__ = 'reorder_suggestions'
+
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), primary_key=True)
+    daily_demand = db.Column(db.Float, nullable=False)         # forecast copies per day
+    demand_std = db.Column(db.Float, nullable=False)           # day-to-day spread of sales
+    stock_quantity = db.Column(db.Integer, nullable=False)     # stock when the forecast ran
+    days_of_stock = db.Column(db.Float, nullable=True)         # how long that stock lasts
+    reorder_point = db.Column(db.Integer, nullable=False)      # lead time demand + safety stock
+    suggested_quantity = db.Column(db.Integer, nullable=False)
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # /api/inventory/reorder-suggestions also adds the nested 'book'
+    API_FIELDS = ('book_id', 'daily_demand', 'demand_std', 'stock_quantity', 'days_of_stock',
+                  'reorder_point', 'suggested_quantity', 'computed_at')
+
+    def to_dict(self):
+        return self.api_fields_dict()
+
+# --- Inventory event journal ---------------------------------------------------
+class InventoryEvent(ApiFieldsMixin, db.Model):
+    """
+    Append-only history of everything that changed a book (see journal.py)
+    Written in the same transaction as the change itself, never updated or deleted.
+      sale_completed   one row per order line, quantity_delta = -copies sold
+      stock_adjusted   an admin changed stock_quantity, quantity_delta = new - old
+      book_updated     any other field changed, the changes are in `data` as JSON
+    """
+    __tablename__ = 'inventory_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    type = db.Column(db.String(32), nullable=False)
+    book_id = db.Column(db.Integer, nullable=False, index=True)  # no foreign key: deleted books keep their history
+    sale_id = db.Column(db.Integer, nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)  # who made the change, if logged in
+    quantity_delta = db.Column(db.Integer, nullable=False, default=0)
+    data = db.Column(db.Text, nullable=True)
+
+    # "Latest event of this type" is one index lookup (suggest.py watches book_updated)
+    __table_args__ = (
+        db.Index('ix_inventory_events_type_id', 'type', 'id'),
+    )
+
+    API_FIELDS = ('id', 'created_at', 'type', 'book_id', 'sale_id', 'user_id', 'quantity_delta', 'data')
+
+    def to_dict(self):
+        return self.api_fields_dict()
+
+# --- Sales archive ---------------------------------------------------------------
+# Completed orders older than ARCHIVE_AFTER_DAYS are moved out of sales/sale_items
+# into these tables (see archive.py). They live in their own database file (the
+# 'archive' bind), so bookstore.db only holds the recent, busy part of the history.
+# Same ids and columns as the live tables, so an order looks the same wherever it is.
+class ArchivedSale(ApiFieldsMixin, db.Model):
+    __bind_key__ = 'archive'
+    __tablename__ = 'sales_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    customer_email = db.Column(db.String(120), nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)  # users live in the main database
+    total_amount = db.Column(db.Float, nullable=False)
+    sale_date = db.Column(db.DateTime)
+    status = db.Column(db.String(20))
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_sales_archive_sale_date_id', 'sale_date', 'id'),
+        db.Index('ix_sales_archive_user_id_sale_date_id', 'user_id', 'sale_date', 'id'),
+    )
+
+    API_FIELDS = Sale.API_FIELDS
+
+
+class ArchivedSaleItem(ApiFieldsMixin, db.Model):
+    __bind_key__ = 'archive'
+    __tablename__ = 'sale_items_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sale_id = db.Column(db.Integer, nullable=False, index=True)
+    book_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price_at_time = db.Column(db.Float, nullable=False)
+
+    API_FIELDS = SaleItem.API_FIELDS
@@ -0,0 +1,362 @@
+# profiling.py
+# Profile a single request in production, without redeploying.
+#
+# An admin adds a header to the slow request:
+#   X-Profile: cprofile     cProfile of the request  -> download as a .pstats file
+#   X-Profile: stacks       sampled call stacks      -> download in the "collapsed"
+#                           format that flamegraph.pl and speedscope read
+# or PROFILE_SAMPLE_RATE profiles that share of all requests (with PROFILE_SAMPLE_MODE).
+# Either way every SQL statement the request ran is recorded with its time. The
+# response carries an X-Profile-Id header with the id to look it up under:
+#   GET /api/admin/profiles                          newest first
+#   GET /api/admin/profiles/<id>                     SQL timings and hottest functions
+#   GET /api/admin/profiles/<id>/download            the .pstats or .collapsed file
+#   python -m pstats instance/profiles/<id>.pstats   or open it in snakeviz
+#
+# The header is ignored unless it comes with an admin's token. Requests without it
+# only pay for one header lookup (and a random() call when sampling is on); the SQL
+# hook checks a thread-local and returns.
+#
+# Profiles are files in PROFILE_DIR (a .json summary plus the .pstats / .collapsed
+# data), so every gunicorn worker can serve any of them. Only the newest PROFILE_KEEP
+# are kept; writing a new one deletes the oldest.
+#
+# Usage (in app.py):
+#   profiling.init_app(app)
+#
+# Settings (app.config):
+#   PROFILE_DIR              where profiles go (default instance/profiles)
+#   PROFILE_KEEP             profiles kept, oldest deleted first (default 50)
+#   PROFILE_SAMPLE_RATE      share of all requests to profile, 0-1 (default 0, header only)
+#   PROFILE_SAMPLE_MODE      'cprofile' or 'stacks' for sampled requests (default 'stacks')
+#   PROFILE_STACK_INTERVAL   seconds between stack samples (default 0.001)
+#   PROFILE_MAX_QUERIES      SQL statements recorded per request (default 1000)
+import cProfile
+import glob
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import User
+
+HEADER = 'X-Profile'
+MODES = ('cprofile', 'stacks')
+FILE_EXTENSIONS = {'cprofile': '.pstats', 'stacks': '.collapsed'}
+
+# Functions listed in a profile's summary
+TOP_FUNCTIONS = 30
+
+# Statements are cut to this many characters in the summary
+MAX_STATEMENT_LENGTH = 500
+
+PROFILE_ID = re.compile(r'^[0-9T]+-[0-9]+$')
+
+# The profile of the request running on this thread, if it is being profiled
+_local = threading.local()
+
+
+def init_app(app):
+    app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+    app.config.setdefault('PROFILE_KEEP', 50)
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILE_SAMPLE_MODE', 'stacks')
+    app.config.setdefault('PROFILE_STACK_INTERVAL', 0.001)
+    app.config.setdefault('PROFILE_MAX_QUERIES', 1000)
+
+    app.before_request(lambda: _start(app))
+    app.after_request(lambda response: _finish(app, response))
+    app.teardown_request(lambda error: _abandon(app, error))
+
+
+# ===============================
+# SQL TIMINGS
+# ===============================
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_query(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'profile', None) is not None:
+        conn.info.setdefault('profile_query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_query(conn, cursor, statement, parameters, context, executemany):
+    profile = getattr(_local, 'profile', None)
+    started = conn.info.get('profile_query_started')
+    if profile is None or not started:
+        return
+    duration_ms = (time.perf_counter() - started.pop()) * 1000
+    profile.sql_ms += duration_ms
+    profile.sql_count += 1
+    if len(profile.sql) < profile.max_queries:
+        profile.sql.append({'statement': statement[:MAX_STATEMENT_LENGTH], 'ms': round(duration_ms, 3)})
+
+
+# ===============================
+# PROFILERS
+# ===============================
+
+class StackSampler:
+    """
+    Samples one thread's call stack every `interval` seconds from a helper thread
+    The counts are keyed by 'outer;...;inner' stacks, the collapsed flame-graph format.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    @staticmethod
+    def frame_label(frame):
+        code = frame.f_code
+        # ';' separates frames in the collapsed format
+        return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self.frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.counts.most_common())
+
+    def top(self, limit=TOP_FUNCTIONS):
+        """Functions seen most often at the top of the stack (self time) and anywhere on it (total)"""
+        own, total = Counter(), Counter()
+        for stack, count in self.counts.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [{'function': frame, 'samples': count, 'total_samples': total[frame]}
+                for frame, count in own.most_common(limit)]
+
+
+def pstats_top(stats, limit=TOP_FUNCTIONS):
+    """The functions with the most cumulative time from a pstats.Stats"""
+    rows = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': f'{name} ({os.path.basename(filename)}:{line})',
+            'calls': calls,
+            'own_ms': round(own * 1000, 3),
+            'cumulative_ms': round(cumulative * 1000, 3),
+        })
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:limit]
+
+
+class RequestProfile:
+    """Everything collected for one profiled request"""
+
+    def __init__(self, app, mode, trigger, user):
+        self.id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}"
+        self.mode = mode
+        self.trigger = trigger
+        self.user = user
+        self.sql = []
+        self.sql_ms = 0.0
+        self.sql_count = 0
+        self.max_queries = app.config['PROFILE_MAX_QUERIES']
+        self.started_at = datetime.utcnow()
+        if mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+        else:
+            self.profiler = StackSampler(threading.get_ident(), app.config['PROFILE_STACK_INTERVAL'])
+
+    def start(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        if self.mode == 'cprofile':
+            self.profiler.enable()
+        else:
+            self.profiler.start()
+
+    def stop(self):
+        if self.mode == 'cprofile':
+            self.profiler.disable()
+        else:
+            self.profiler.stop()
+        self.wall_ms = (time.perf_counter() - self.wall_start) * 1000
+        self.cpu_ms = (time.thread_time() - self.cpu_start) * 1000
+
+    def save(self, profile_dir, status):
+        """Write the data file and the .json summary; returns the summary"""
+        os.makedirs(profile_dir, exist_ok=True)
+        data_file = self.id + FILE_EXTENSIONS[self.mode]
+        data_path = os.path.join(profile_dir, data_file)
+        if self.mode == 'cprofile':
+            stats = pstats.Stats(self.profiler)
+            stats.dump_stats(data_path)
+            top = pstats_top(stats)
+        else:
+            with open(data_path, 'w') as f:
+                f.write(self.profiler.collapsed())
+            top = self.profiler.top()
+
+        summary = {
+            'id': self.id,
+            'started_at': self.started_at.isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'query_string': request.query_string.decode('utf-8', 'replace'),
+            'status': status,
+            'mode': self.mode,
+            'trigger': self.trigger,
+            'user': self.user,
+            'wall_ms': round(self.wall_ms, 3),
+            'cpu_ms': round(self.cpu_ms, 3),
+            'sql_count': self.sql_count,
+            'sql_ms': round(self.sql_ms, 3),
+            'file': data_file,
+            'top_functions': top,
+            'sql': self.sql,
+        }
+        # The summary is written last: data without a summary is ignored (and pruned)
+        with open(os.path.join(profile_dir, self.id + '.json'), 'w') as f:
+            json.dump(summary, f)
+        return summary
+
+
+# ===============================
+# REQUEST HOOKS
+# ===============================
+
+def _admin_username():
+    """The username behind the request's token if it is an admin's, else None"""
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    user = User.verify_token(auth_header.split(' ', 1)[1])
+    return user.username if user is not None and user.role == 'admin' else None
+
+
+def _start(app):
+    header = request.headers.get(HEADER)
+    # Looking at profiles shouldn't push profiles out of the buffer
+    if header and request.path.startswith('/api/admin/profiles'):
+        return
+    if header:
+        user = _admin_username()
+        if user is None:
+            return
+        mode = header.strip().lower() if header.strip().lower() in MODES else 'cprofile'
+        trigger = 'header'
+    else:
+        rate = app.config['PROFILE_SAMPLE_RATE']
+        if not rate or random.random() >= rate:
+            return
+        mode, trigger, user = app.config['PROFILE_SAMPLE_MODE'], 'sample', None
+
+    profile = RequestProfile(app, mode, trigger, user)
+    try:
+        profile.start()
+    except ValueError:
+        # Python 3.12+ allows one cProfile at a time per process; this request just isn't profiled
+        return
+    _local.profile = profile
+
+
+def _finish(app, response):
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return response
+    _local.profile = None
+    profile.stop()
+    try:
+        profile.save(app.config['PROFILE_DIR'], response.status_code)
+        _prune(app.config['PROFILE_DIR'], app.config['PROFILE_KEEP'])
+    except Exception:
+        # A full disk must not turn a good response into an error
+        traceback.print_exc()
+        return response
+    response.headers['X-Profile-Id'] = profile.id
+    return response
+
+
+def _abandon(app, error):
+    """A request that failed before after_request still gets its profile saved"""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return
+    _local.profile = None
+    profile.stop()
+    try:
+        profile.save(app.config['PROFILE_DIR'], 500)
+        _prune(app.config['PROFILE_DIR'], app.config['PROFILE_KEEP'])
+    except Exception:
+        traceback.print_exc()
+
+
+# ===============================
+# STORED PROFILES
+# ===============================
+
+def _prune(profile_dir, keep):
+    """Keep the newest `keep` profiles (ids sort by time)"""
+    ids = sorted({os.path.basename(path).split('.')[0] for path in glob.glob(os.path.join(profile_dir, '*'))},
+                 reverse=True)
+    for old_id in ids[keep:]:
+        for path in glob.glob(os.path.join(profile_dir, old_id + '.*')):
+            os.remove(path)
+
+
+def list_profiles(app):
+    """Summaries of the stored profiles, newest first, without the SQL and function lists"""
+    summaries = []
+    for path in sorted(glob.glob(os.path.join(app.config['PROFILE_DIR'], '*.json')), reverse=True):
+        try:
+            with open(path) as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue  # pruned by another worker while we were looking
+        summary.pop('sql')
+        summary.pop('top_functions')
+        summaries.append(summary)
+    return summaries
+
+
+def get_profile(app, profile_id):
+    """One profile's full summary, or None"""
+    if not PROFILE_ID.match(profile_id or ''):
+        return None
+    path = os.path.join(app.config['PROFILE_DIR'], profile_id + '.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def profile_file(app, profile_id):
+    """Path of a profile's .pstats / .collapsed file, or None"""
+    summary = get_profile(app, profile_id)
+    if summary is None:
+        return None
+    path = os.path.join(app.config['PROFILE_DIR'], summary['file'])
+    return path if os.path.exists(path) else None
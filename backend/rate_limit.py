@@ -0,0 +1,149 @@
+# rate_limit.py
+# Token-bucket rate limiting for the endpoints that hash a password with bcrypt.
+# bcrypt is slow on purpose, so a burst of login attempts can eat every CPU core.
+# These limits stop that before any hashing happens.
+#
+# Each limit is a bucket that holds up to `requests` tokens and refills completely
+# over `per_seconds`. Every request takes one token; with no token left the client
+# gets 429 Too Many Requests and a Retry-After header.
+#
+# Usage (in app.py):
+#   limiter = RateLimiter(app)
+#
+#   @app.route('/api/login', methods=['POST'])
+#   @limiter.limit('login', identity=lambda data: data.get('username'))
+#   def login(): ...
+#
+# Settings (app.config):
+#   RATE_LIMITS             {'login': {'ip': (20, 60), 'identity': (5, 60)}, ...}
+#   RATE_LIMIT_STORE        an object with a take() method, default MemoryStore()
+#   RATE_LIMIT_TRUST_PROXY  use X-Forwarded-For for the client IP (only behind a proxy you control)
+#   RATE_LIMIT_ENABLED      set False to switch limiting off (e.g. for load tests)
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import wraps
+
+from flask import jsonify, request
+
+DEFAULT_LIMITS = {
+    # (requests, per_seconds)
+    'login': {'ip': (20, 60), 'identity': (5, 60)},
+    'register': {'ip': (5, 60), 'identity': (3, 60)},
+    'password_reset_confirm': {'ip': (10, 60), 'identity': (5, 60)},
+}
+
+
+class RateLimitStore(ABC):
+    """
+    Interface for bucket storage
+    The default MemoryStore is per process. To share limits between gunicorn workers
+    or servers, write a store with the same take() method on top of Redis or
+    memcached and put it in app.config['RATE_LIMIT_STORE'].
+    """
+
+    @abstractmethod
+    def take(self, key, capacity, refill_per_second):
+        """Take one token from the bucket `key`; return (allowed, retry_after_seconds)"""
+
+
+class MemoryStore(RateLimitStore):
+    """Buckets in a dict guarded by a lock; idle buckets are dropped when it gets big"""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self.buckets = {}  # key -> [tokens, last_refill_time, capacity, refill_per_second]
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, refill_per_second):
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self._evict_full(now)
+                bucket = self.buckets[key] = [capacity, now, capacity, refill_per_second]
+            else:
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * refill_per_second)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True, 0
+            return False, (1 - bucket[0]) / refill_per_second
+
+    def _evict_full(self, now):
+        """Forget buckets that have refilled completely, they hold no information"""
+        full = [key for key, (tokens, last, capacity, rate) in self.buckets.items()
+                if tokens + (now - last) * rate >= capacity]
+        for key in full:
+            del self.buckets[key]
+        if len(self.buckets) >= self.max_keys:
+            # Still full of active attackers; start over rather than grow without limit
+            self.buckets.clear()
+
+
+class RateLimiter:
+    """Flask extension providing the @limiter.limit(...) decorator"""
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATE_LIMITS', {})
+        app.config['RATE_LIMITS'] = {**DEFAULT_LIMITS, **app.config['RATE_LIMITS']}
+        app.config.setdefault('RATE_LIMIT_STORE', MemoryStore())
+        app.config.setdefault('RATE_LIMIT_TRUST_PROXY', False)
+        app.config.setdefault('RATE_LIMIT_ENABLED', True)
+        self.app = app
+
+    def client_ip(self):
+        if self.app.config['RATE_LIMIT_TRUST_PROXY'] and request.access_route:
+            return request.access_route[0]
+        return request.remote_addr or 'unknown'
+
+    def check(self, name, identity_value):
+        """Return the Retry-After seconds if the request is over a limit, otherwise None"""
+        config = self.app.config
+        store = config['RATE_LIMIT_STORE']
+        limits = config['RATE_LIMITS'][name]
+
+        keys = [('ip', f'{name}:ip:{self.client_ip()}')]
+        if identity_value:
+            keys.append(('identity', f'{name}:id:{str(identity_value).strip().lower()}'))
+
+        for kind, key in keys:
+            requests_allowed, per_seconds = limits[kind]
+            allowed, retry_after = store.take(key, requests_allowed, requests_allowed / per_seconds)
+            if not allowed:
+                return retry_after
+        return None
+
+    def limit(self, name, identity=None):
+        """
+        Decorator for a rate-limited endpoint
+        `identity` gets the JSON body and returns the username/email to limit on as well.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if self.app.config['RATE_LIMIT_ENABLED']:
+                    identity_value = None
+                    if identity is not None:
+                        data = request.get_json(silent=True)
+                        identity_value = identity(data if isinstance(data, dict) else {})
+                    retry_after = self.check(name, identity_value)
+                    if retry_after is not None:
+                        response = jsonify({
+                            'success': False,
+                            'error': 'Too many attempts. Please wait and try again.'
+                        })
+                        response.status_code = 429
+                        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                        return response
+                return f(*args, **kwargs)
+            return decorated
+        return decorator
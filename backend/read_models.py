@@ -0,0 +1,420 @@
+# read_models.py
+# Fast read path for the list endpoints.
+#
+# The normal way (Book.query.all() then book.to_dict()) builds a full ORM object for
+# every row, tracks it in the session, and for sales lazily loads the user and each
+# item's book one query at a time. For read-only lists none of that is needed.
+# These functions select just the API_FIELDS columns with SQLAlchemy Core and turn
+# each row straight into the same dict to_dict() would have produced, with nested
+# users and books fetched in one joined query instead of one query per row.
+#
+# Everything runs on read_replica.reader(): the separate read-only connection pool
+# for endpoints marked @use_read_replica, the normal db.session otherwise.
+#
+# Old orders live in the archive tables (see archive.py), possibly in another
+# database. The sales functions read both and merge them, so callers keep passing
+# filters on Sale columns and never need to know where an order is.
+#
+# Sparse fieldsets: the list functions take an optional `fieldset` (from
+# parse_fieldset(), i.e. ?fields= and ?expand=) saying which columns and which nested
+# objects the caller wants. Columns that aren't wanted aren't selected, and nested
+# users, items and books that aren't wanted aren't joined or queried at all.
+import base64
+from datetime import datetime
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.sql.visitors import replacement_traverse
+
+from models import (db, Book, User, Sale, SaleItem, Notification, ReorderSuggestion,
+                    ArchivedSale, ArchivedSaleItem)
+from read_replica import reader
+
+# SQLite allows a limited number of ? parameters per statement
+IN_CHUNK_SIZE = 500
+
+
+# What each list can nest: name -> (model, what that model can nest)
+BOOK_RELATIONS = {}
+SALE_RELATIONS = {
+    'user': (User, {}),
+    'items': (SaleItem, {'book': (Book, BOOK_RELATIONS)}),
+}
+
+
+def columns_for(model, prefix='', names=None):
+    """The model's API_FIELDS (or just `names`) as selectable columns, optionally labelled with a prefix"""
+    columns = [getattr(model, name) for name in (names or model.API_FIELDS)]
+    if prefix:
+        columns = [column.label(prefix + column.key) for column in columns]
+    return columns
+
+
+def rows_to_dicts(result):
+    """Turn a Core result into a list of plain dicts"""
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+def split_nested(result, parent_model, nested_model, nested_key, nested_names=None):
+    """
+    Build parent dicts with a nested child dict (or None) from rows that hold the
+    parent's API_FIELDS followed by the child's API_FIELDS (or nested_names, which
+    must start with 'id') from an outer join
+    """
+    parent_keys = parent_model.API_FIELDS
+    nested_keys = nested_names or nested_model.API_FIELDS
+    split = len(parent_keys)
+    data = []
+    for row in result:
+        item = dict(zip(parent_keys, row[:split]))
+        # The child's id is None when the outer join found nothing
+        item[nested_key] = dict(zip(nested_keys, row[split:])) if row[split] is not None else None
+        data.append(item)
+    return data
+
+
+# ===============================
+# SPARSE FIELDSETS
+# ===============================
+
+def full_fieldset(model, relations):
+    """Every field and every nested object: the shape to_dict() produces"""
+    return {
+        'fields': model.API_FIELDS,
+        'expand': {name: full_fieldset(*relation) for name, relation in relations.items()},
+    }
+
+
+def parse_fieldset(model, relations, fields=None, expand=None):
+    """
+    Turn ?fields= and ?expand= into a fieldset:
+        {'fields': (...), 'expand': {'items': {'fields': (...), 'expand': {'book': {...}}}}}
+    fields=id,total_amount,items.quantity,items.book.title   dotted names reach into
+                                                             nested objects (and expand them)
+    expand=user,items,items.book                             nested objects to include
+    A level with no fields listed gets all of them. With neither parameter the answer
+    is None, meaning the full to_dict() shape. Raises ValueError for unknown names.
+    """
+    if fields is None and expand is None:
+        return None
+    root = {'model': model, 'relations': relations, 'fields': [], 'expand': {}}
+
+    def node_for(path, parameter):
+        node = root
+        for name in path:
+            if name not in node['relations']:
+                raise ValueError(f"{parameter}: '{name}' can't be expanded here")
+            if name not in node['expand']:
+                nested_model, nested_relations = node['relations'][name]
+                node['expand'][name] = {'model': nested_model, 'relations': nested_relations,
+                                        'fields': [], 'expand': {}}
+            node = node['expand'][name]
+        return node
+
+    for path in filter(None, (part.strip() for part in (expand or '').split(','))):
+        node_for(path.split('.'), 'expand')
+    for path in filter(None, (part.strip() for part in (fields or '').split(','))):
+        *parents, name = path.split('.')
+        node = node_for(parents, 'fields')
+        if name not in node['model'].API_FIELDS:
+            raise ValueError(f"fields: unknown field '{path}'")
+        if name not in node['fields']:
+            node['fields'].append(name)
+
+    def finish(node):
+        return {
+            'fields': tuple(node['fields']) or node['model'].API_FIELDS,
+            'expand': {name: finish(nested) for name, nested in node['expand'].items()},
+        }
+    return finish(root)
+
+
+def apply_fieldset(data, fieldset):
+    """Cut a dict (or list of dicts) built from a wider fieldset down to `fieldset`"""
+    if fieldset is None or data is None:
+        return data
+    if isinstance(data, list):
+        return [apply_fieldset(item, fieldset) for item in data]
+    shaped = {name: data[name] for name in fieldset['fields']}
+    for name, nested in fieldset['expand'].items():
+        shaped[name] = apply_fieldset(data[name], nested)
+    return shaped
+
+
+def _with_id(names):
+    """Field names with 'id' first; nested lookups need it even when it isn't sent"""
+    return ('id',) + tuple(name for name in names if name != 'id')
+
+
+def list_books(fieldset=None):
+    """Every book, same shape as Book.to_dict() (or only the fieldset's fields)"""
+    names = fieldset['fields'] if fieldset else None
+    return rows_to_dicts(reader().execute(select(*columns_for(Book, names=names)).order_by(Book.id)))
+
+
+def books_by_id(ids, names=None):
+    """{id: book dict} for the given ids (missing books are simply left out)"""
+    books = {}
+    ids = list(ids)
+    names = _with_id(names) if names else None
+    for start in range(0, len(ids), IN_CHUNK_SIZE):
+        stmt = select(*columns_for(Book, names=names)).where(Book.id.in_(ids[start:start + IN_CHUNK_SIZE]))
+        for book in rows_to_dicts(reader().execute(stmt)):
+            books[book['id']] = book
+    return books
+
+
+def users_by_id(ids, names=None):
+    """{id: user dict} for the given ids (missing users are simply left out)"""
+    users = {}
+    ids = list(ids)
+    names = _with_id(names) if names else None
+    for start in range(0, len(ids), IN_CHUNK_SIZE):
+        stmt = select(*columns_for(User, names=names)).where(User.id.in_(ids[start:start + IN_CHUNK_SIZE]))
+        for user in rows_to_dicts(reader().execute(stmt)):
+            users[user['id']] = user
+    return users
+
+
+def list_low_stock(limit=200, fieldset=None):
+    """
+    Books at or below their reorder point, the furthest below first
+    Filters and sorts on Book.stock_gap(), the expression ix_books_stock_below_reorder
+    indexes, so only the low books are read.
+    """
+    stmt = (
+        select(*columns_for(Book, names=fieldset['fields'] if fieldset else None))
+        .where(Book.stock_gap() <= 0)
+        .order_by(Book.stock_gap(), Book.id)
+        .limit(limit)
+    )
+    return rows_to_dicts(reader().execute(stmt))
+
+
+def list_reorder_suggestions(limit=500):
+    """Latest forecast's reorder suggestions with the nested 'book', the soonest to run out first"""
+    stmt = (
+        select(*columns_for(ReorderSuggestion), *columns_for(Book, 'book__'))
+        .outerjoin(Book, ReorderSuggestion.book_id == Book.id)
+        .order_by(ReorderSuggestion.days_of_stock, ReorderSuggestion.book_id)
+        .limit(limit)
+    )
+    return split_nested(reader().execute(stmt), ReorderSuggestion, Book, 'book')
+
+
+def attach_items(sales, fieldset=None):
+    """
+    Add an 'items' list (each with its nested 'book') to every sale dict, in place
+    `fieldset` is the items' own fieldset; without 'book' in it no book is joined.
+    """
+    fieldset = fieldset or full_fieldset(SaleItem, SALE_RELATIONS['items'][1])
+    book = fieldset['expand'].get('book')
+    by_id = {}
+    for sale in sales:
+        sale['items'] = []
+        by_id[sale['id']] = sale
+
+    ids = list(by_id)
+    for start in range(0, len(ids), IN_CHUNK_SIZE):
+        chunk = SaleItem.sale_id.in_(ids[start:start + IN_CHUNK_SIZE])
+        if book:
+            names = _with_id(book['fields'])
+            stmt = (
+                select(*columns_for(SaleItem), *columns_for(Book, 'book__', names))
+                .outerjoin(Book, SaleItem.book_id == Book.id)
+                .where(chunk)
+                .order_by(SaleItem.id)
+            )
+            items = split_nested(reader().execute(stmt), SaleItem, Book, 'book', names)
+        else:
+            stmt = select(*columns_for(SaleItem)).where(chunk).order_by(SaleItem.id)
+            items = rows_to_dicts(reader().execute(stmt))
+        for item in items:
+            by_id[item['sale_id']]['items'].append(item)
+    return sales
+
+
+def _list_live_sales(filters, limit, after, fieldset):
+    user = fieldset['expand'].get('user')
+    if user:
+        names = _with_id(user['fields'])
+        stmt = (
+            select(*columns_for(Sale), *columns_for(User, 'user__', names))
+            .outerjoin(User, Sale.user_id == User.id)
+        )
+    else:
+        stmt = select(*columns_for(Sale))
+    stmt = stmt.where(*filters).order_by(Sale.sale_date.desc(), Sale.id.desc())
+    if after is not None:
+        stmt = stmt.where(tuple_(Sale.sale_date, Sale.id) < tuple_(*after))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    result = reader().execute(stmt)
+    sales = split_nested(result, Sale, User, 'user', names) if user else rows_to_dicts(result)
+    if 'items' in fieldset['expand']:
+        attach_items(sales, fieldset['expand']['items'])
+    return sales
+
+
+def archive_filters(filters):
+    """The same filters with every sales column swapped for its sales_archive column"""
+    archived = ArchivedSale.__table__.c
+
+    def swap(element):
+        if getattr(element, 'table', None) is Sale.__table__:
+            return archived[element.name]
+        return None
+
+    return [replacement_traverse(condition, {}, swap) for condition in filters]
+
+
+def list_archived_sales(*filters, limit=None, after=None, fieldset=None):
+    """
+    Archived sales newest first, same shape as list_sales()
+    Filters are on ArchivedSale columns (see archive_filters()). The archive may be a
+    different database, so users and books are looked up separately instead of joined.
+    The result may hold more fields than the fieldset asks for; list_sales() trims it.
+    """
+    fieldset = fieldset or full_fieldset(Sale, SALE_RELATIONS)
+    user = fieldset['expand'].get('user')
+    items = fieldset['expand'].get('items')
+    book = items['expand'].get('book') if items else None
+    stmt = select(*columns_for(ArchivedSale)).where(*filters).order_by(
+        ArchivedSale.sale_date.desc(), ArchivedSale.id.desc())
+    if after is not None:
+        stmt = stmt.where(tuple_(ArchivedSale.sale_date, ArchivedSale.id) < tuple_(*after))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    # db.session sends ArchivedSale queries to the 'archive' bind
+    sales = rows_to_dicts(db.session.execute(stmt))
+    if not sales:
+        return sales
+
+    if user:
+        users = users_by_id({sale['user_id'] for sale in sales if sale['user_id'] is not None}, user['fields'])
+        for sale in sales:
+            sale['user'] = users.get(sale['user_id'])
+    if not items:
+        return sales
+
+    by_id = {}
+    for sale in sales:
+        sale['items'] = []
+        by_id[sale['id']] = sale
+    items = []
+    ids = list(by_id)
+    for start in range(0, len(ids), IN_CHUNK_SIZE):
+        stmt = (
+            select(*columns_for(ArchivedSaleItem))
+            .where(ArchivedSaleItem.sale_id.in_(ids[start:start + IN_CHUNK_SIZE]))
+            .order_by(ArchivedSaleItem.id)
+        )
+        items.extend(rows_to_dicts(db.session.execute(stmt)))
+    books = books_by_id({item['book_id'] for item in items}, book['fields']) if book else {}
+    for item in items:
+        if book:
+            item['book'] = books.get(item['book_id'])
+        by_id[item['sale_id']]['items'].append(item)
+    return sales
+
+
+def find_archived_sale(sale_id):
+    """One archived sale by id (same shape as list_sales() entries), or None"""
+    sales = list_archived_sales(ArchivedSale.id == sale_id, limit=1)
+    return sales[0] if sales else None
+
+
+def _merged_sales(filters, limit, after, fieldset):
+    """Live and archived sales merged newest first, before trimming to the fieldset"""
+    shape = fieldset or full_fieldset(Sale, SALE_RELATIONS)
+    sales = _list_live_sales(filters, limit, after, shape)
+    archive_where = archive_filters(filters)
+    if limit is not None and len(sales) == limit and sales[-1]['sale_date'] is not None:
+        # A full page of live sales: only archived sales newer than the last one can
+        # make it in, which for the recent pages is an empty index range
+        oldest = sales[-1]
+        archive_where.append(tuple_(ArchivedSale.sale_date, ArchivedSale.id) > tuple_(oldest['sale_date'], oldest['id']))
+    archived = list_archived_sales(*archive_where, limit=limit, after=after, fieldset=shape)
+    if not archived:
+        return sales
+    sales.extend(archived)
+    # sale_date can be NULL on very old rows; those sort last, like they do in SQL
+    sales.sort(key=lambda sale: (sale['sale_date'] is not None, sale['sale_date'] or datetime.min, sale['id']),
+               reverse=True)
+    return sales[:limit] if limit is not None else sales
+
+
+def list_sales(*filters, limit=None, after=None, fieldset=None):
+    """
+    Sales newest first, same shape as Sale.to_dict() plus 'items' (or the fieldset's shape)
+    Pass SQLAlchemy filter expressions, e.g. list_sales(Sale.user_id == 3)
+    `after` is a (sale_date, id) pair: only sales older than it are returned (keyset paging)
+    Live and archived sales are merged; each side is read in index order and at most
+    `limit` rows are taken from either.
+    """
+    return apply_fieldset(_merged_sales(filters, limit, after, fieldset), fieldset)
+
+
+def encode_cursor(sale):
+    """Opaque paging token pointing just after this sale"""
+    raw = f"{sale['sale_date'].isoformat()}|{sale['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Turn a paging token back into (sale_date, id); raises ValueError if it's garbage"""
+    try:
+        sale_date, sale_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(sale_date), int(sale_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def sales_page(*filters, limit, cursor=None, with_total=True, fieldset=None):
+    """
+    One page of sales plus the token for the next page
+    Each page is an index range scan on (sale_date, id), so page 1000 costs the same
+    as page 1. The total count/amount needs a scan of every matching row, so callers
+    can switch it off with with_total=False.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    # Fetch one extra row to know whether there is a next page
+    sales = _merged_sales(filters, limit + 1, after, fieldset)
+    has_more = len(sales) > limit
+    sales = sales[:limit]
+
+    page = {
+        # The cursor needs sale_date and id even when the fieldset leaves them out
+        'data': apply_fieldset(sales, fieldset),
+        'count': len(sales),
+        'next_cursor': encode_cursor(sales[-1]) if has_more else None,
+    }
+    if with_total:
+        total, total_amount = reader().execute(
+            select(func.count(Sale.id), func.coalesce(func.sum(Sale.total_amount), 0)).where(*filters)
+        ).one()
+        archived_total, archived_amount = db.session.execute(
+            select(func.count(ArchivedSale.id), func.coalesce(func.sum(ArchivedSale.total_amount), 0))
+            .where(*archive_filters(filters))
+        ).one()
+        page['total'] = total + archived_total
+        page['total_amount'] = round(total_amount + archived_amount, 2)
+    return page
+
+
+def count_sales(*filters):
+    """Number of sales matching the filters, archived ones included"""
+    live = reader().execute(select(func.count(Sale.id)).where(*filters)).scalar()
+    archived = db.session.execute(select(func.count(ArchivedSale.id)).where(*archive_filters(filters))).scalar()
+    return live + archived
+
+
+def list_notifications(*filters, limit=200):
+    """Notifications newest first, same shape as Notification.to_dict()"""
+    stmt = (
+        select(*columns_for(Notification))
+        .where(*filters)
+        .order_by(Notification.created_at.desc())
+        .limit(limit)
+    )
+    return rows_to_dicts(reader().execute(stmt))
@@ -0,0 +1,135 @@
+# read_replica.py
+# Runs the admin reports on their own database connections so that a long report
+# never holds up checkout or order placement.
+#
+# The reads side is a second SQLAlchemy engine (the 'reads' bind) with its own
+# connection pool:
+#   - SQLite: the same file opened read-only. With WAL (see database.py) readers
+#     never block the writer, and a big report can't use up the connections that
+#     checkout needs. There is no lag, both sides see the same file.
+#   - Postgres/MySQL: set READ_DATABASE_URL to a replica. Reports may then be a
+#     little behind; if the replica is more than READ_REPLICA_MAX_LAG_SECONDS behind
+#     (or down) the request quietly uses the primary instead.
+#
+# Usage (in app.py), BEFORE db.init_app(app) because it adds the bind:
+#   read_replica.init_app(app)
+#
+#   @app.route('/api/sales', methods=['GET'])
+#   @use_read_replica
+#   def get_all_sales(): ...
+#
+# read_models.py runs its selects on reader(), which is the reads connection inside
+# a @use_read_replica request and the normal db.session everywhere else.
+#
+# Settings (app.config, the first two also from the environment):
+#   READ_DATABASE_URL              replica URL (default: the main database, read-only)
+#   READ_REPLICA_ENABLED           set False to send everything to the primary
+#   READ_REPLICA_MAX_LAG_SECONDS   how stale a replica may be (default 30)
+#   READ_POOL_SIZE                 connections kept open for reports (default 5)
+import os
+import time
+from functools import wraps
+
+from flask import current_app, g
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db
+
+READ_BIND = 'reads'
+
+# How often (seconds) the replica lag is measured; in between the last answer is reused
+LAG_CHECK_INTERVAL = 5
+
+_lag_cache = {'checked_at': 0.0, 'healthy': True}
+
+
+def read_only_sqlite_url(url):
+    """Turn sqlite:///path.db into a URL that opens the same file read-only"""
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return url
+    return url.set(database=f'file:{url.database}', query={**url.query, 'mode': 'ro', 'uri': 'true'})
+
+
+def init_app(app):
+    """Add the 'reads' bind; must run before db.init_app(app)"""
+    primary_url = app.config['SQLALCHEMY_DATABASE_URI']
+    app.config.setdefault('READ_DATABASE_URL', os.getenv('READ_DATABASE_URL') or read_only_sqlite_url(primary_url))
+    app.config.setdefault('READ_REPLICA_ENABLED', os.getenv('READ_REPLICA_ENABLED', '1') != '0')
+    app.config.setdefault('READ_REPLICA_MAX_LAG_SECONDS', 30)
+    app.config.setdefault('READ_POOL_SIZE', 5)
+
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    binds.setdefault(READ_BIND, {
+        'url': app.config['READ_DATABASE_URL'],
+        'pool_size': app.config['READ_POOL_SIZE'],
+        'pool_pre_ping': True,
+    })
+
+    @app.teardown_appcontext
+    def close_read_connection(exception=None):
+        connection = g.pop('read_connection', None)
+        if connection is not None:
+            connection.close()
+
+
+def replica_lag_seconds(connection):
+    """Seconds the replica is behind the primary, 0 when it can't be behind, None if unknown"""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        return 0
+    if dialect == 'postgresql':
+        lag = connection.execute(text(
+            'SELECT CASE WHEN pg_is_in_recovery() '
+            'THEN EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) ELSE 0 END'
+        )).scalar()
+        # A replica that hasn't replayed anything yet reports NULL
+        return float(lag) if lag is not None else None
+    return None
+
+
+def _replica_healthy(connection):
+    """True when the replica is fresh enough, measured at most every LAG_CHECK_INTERVAL seconds"""
+    now = time.monotonic()
+    if now - _lag_cache['checked_at'] >= LAG_CHECK_INTERVAL:
+        lag = replica_lag_seconds(connection)
+        _lag_cache['healthy'] = lag is None or lag <= current_app.config['READ_REPLICA_MAX_LAG_SECONDS']
+        _lag_cache['checked_at'] = now
+    return _lag_cache['healthy']
+
+
+def _open_read_connection():
+    """A connection on the reads engine, or None if it's unusable right now"""
+    try:
+        connection = db.engines[READ_BIND].connect()
+    except SQLAlchemyError as e:
+        print(f"Read replica unavailable, using the primary: {e}")
+        return None
+    try:
+        if _replica_healthy(connection):
+            return connection
+        print("Read replica is lagging, using the primary")
+    except SQLAlchemyError as e:
+        print(f"Could not check read replica lag, using the primary: {e}")
+    connection.close()
+    return None
+
+
+def reader():
+    """Where read-only selects should run for the current request"""
+    if not g.get('use_read_replica') or not current_app.config['READ_REPLICA_ENABLED']:
+        return db.session
+    if 'read_connection' not in g:
+        g.read_connection = _open_read_connection()
+    return g.read_connection if g.read_connection is not None else db.session
+
+
+def use_read_replica(f):
+    """Decorator: run this endpoint's read_models queries on the reads engine"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        g.use_read_replica = True
+        return f(*args, **kwargs)
+    return decorated
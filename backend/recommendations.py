@@ -0,0 +1,299 @@
+# recommendations.py
+# "Customers also bought" recommendations, precomputed from completed sales.
+#
+# Working this out live (sale_items joined to itself for every product page) gets
+# slower with every order. Instead we keep a book-by-book co-occurrence matrix:
+# counts[a, b] = number of orders that contained both book a and book b.
+# It is built with NumPy/SciPy in one go:
+#   baskets  = sparse 0/1 matrix, one row per order, one column per book
+#   counts   = baskets.T @ baskets   (the diagonal is how many orders had each book)
+# and every pair gets a score:
+#   cosine   counts[a, b] / sqrt(orders[a] * orders[b])          (default)
+#   lift     counts[a, b] * total_orders / (orders[a] * orders[b])
+# Only the best RECOMMENDATION_TOP_K books per book are kept for lookups, so a
+# request is a dict lookup plus one query for the book details.
+#
+# Keeping it fresh:
+#   - checkout and POST /api/sales call record_sale() after they commit; the order
+#     is added to this worker's matrix on the next lookup (only the touched books
+#     get rescored)
+#   - the rebuild_recommendations maintenance job rebuilds everything from the
+#     database and saves a snapshot (instance/recommendations.npz); every worker
+#     picks up a newer snapshot within RECOMMENDATION_REFRESH_SECONDS, which is how
+#     orders placed in other gunicorn workers arrive
+#   - a worker that starts with no snapshot builds one on the first lookup
+#
+# Settings (app.config):
+#   RECOMMENDATION_METRIC            'cosine' or 'lift'
+#   RECOMMENDATION_TOP_K             recommendations kept per book (default 20)
+#   RECOMMENDATION_MIN_SUPPORT       ignore pairs bought together fewer times (default 1)
+#   RECOMMENDATION_SNAPSHOT          snapshot file path
+#   RECOMMENDATION_REFRESH_SECONDS   how often to look for a newer snapshot (default 60)
+import itertools
+import os
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import select
+
+from models import db, ArchivedSaleItem, Sale, SaleItem
+
+METRICS = ('cosine', 'lift')
+
+# Rows fetched per round trip while building
+FETCH_CHUNK = 50_000
+
+
+class CoPurchaseIndex:
+    """The co-occurrence matrix plus the top-K lookup table built from it"""
+
+    def __init__(self, book_ids, counts, item_counts, n_baskets, metric, top_k, min_support, built_at):
+        self.book_ids = np.asarray(book_ids, dtype=np.int64)      # matrix position -> book id
+        self.position = {int(book_id): i for i, book_id in enumerate(self.book_ids)}
+        self.counts = counts.tocsr().astype(np.float32)          # co-purchase counts, zero diagonal
+        self.item_counts = np.asarray(item_counts, dtype=np.float32)  # orders containing each book
+        self.n_baskets = int(n_baskets)
+        self.metric = metric
+        self.top_k = top_k
+        self.min_support = min_support
+        self.built_at = built_at
+        n = len(self.book_ids)
+        self.neighbors = np.full((n, top_k), -1, dtype=np.int32)  # positions, -1 = empty slot
+        self.scores = np.zeros((n, top_k), dtype=np.float32)
+
+    @classmethod
+    def from_pairs(cls, sale_ids, book_ids, metric='cosine', top_k=20, min_support=1, built_at=None):
+        """Build from parallel arrays of (sale_id, book_id), one entry per order line"""
+        pairs = np.unique(np.column_stack([sale_ids, book_ids]).astype(np.int64).reshape(-1, 2), axis=0)
+        unique_books, book_pos = np.unique(pairs[:, 1], return_inverse=True)
+        _, basket_pos = np.unique(pairs[:, 0], return_inverse=True)
+        baskets = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.float32), (basket_pos.ravel(), book_pos.ravel())),
+            shape=(basket_pos.max() + 1 if len(pairs) else 0, len(unique_books)),
+        )
+        counts = (baskets.T @ baskets).tocsr()
+        item_counts = counts.diagonal()
+        counts.setdiag(0)
+        counts.eliminate_zeros()
+
+        index = cls(unique_books, counts, item_counts, baskets.shape[0], metric, top_k, min_support,
+                    built_at if built_at is not None else time.time())
+        index.rescore()
+        return index
+
+    # ---- scoring -------------------------------------------------------------
+
+    def _score(self, rows):
+        """Sparse score matrix for the given row positions (all rows if None)"""
+        counts = self.counts if rows is None else self.counts[rows]
+        row_orders = self.item_counts if rows is None else self.item_counts[rows]
+        counts = counts.tocoo()
+        data = counts.data
+        keep = data >= self.min_support
+        r, c, data = counts.row[keep], counts.col[keep], data[keep]
+        if self.metric == 'lift':
+            data = data * self.n_baskets / (row_orders[r] * self.item_counts[c])
+        else:
+            data = data / np.sqrt(row_orders[r] * self.item_counts[c])
+        return r, c, data
+
+    def rescore(self, rows=None):
+        """Recompute the top-K table, for every book or just the given positions"""
+        target = np.arange(len(self.book_ids)) if rows is None else np.asarray(rows, dtype=np.int64)
+        if len(target) == 0:
+            return
+        r, c, data = self._score(None if rows is None else target)
+        self.neighbors[target] = -1
+        self.scores[target] = 0
+        if len(data) == 0:
+            return
+        # Sort by row, then best score first, and keep the first top_k of every row
+        order = np.lexsort((-data, r))
+        r, c, data = r[order], c[order], data[order]
+        row_start = np.searchsorted(r, r, side='left')
+        rank = np.arange(len(r)) - row_start
+        keep = rank < self.top_k
+        self.neighbors[target[r[keep]], rank[keep]] = c[keep]
+        self.scores[target[r[keep]], rank[keep]] = data[keep]
+
+    # ---- incremental updates ---------------------------------------------------
+
+    def _grow(self, new_book_ids):
+        """Make room for books that weren't sold before"""
+        start = len(self.book_ids)
+        self.book_ids = np.concatenate([self.book_ids, np.asarray(new_book_ids, dtype=np.int64)])
+        for offset, book_id in enumerate(new_book_ids):
+            self.position[int(book_id)] = start + offset
+        n = len(self.book_ids)
+        self.counts.resize((n, n))
+        self.item_counts = np.concatenate([self.item_counts, np.zeros(len(new_book_ids), dtype=np.float32)])
+        self.neighbors = np.vstack([self.neighbors, np.full((len(new_book_ids), self.top_k), -1, dtype=np.int32)])
+        self.scores = np.vstack([self.scores, np.zeros((len(new_book_ids), self.top_k), dtype=np.float32)])
+
+    def add_baskets(self, baskets):
+        """Add orders (each a list of book ids) to the counts and rescore the books in them"""
+        baskets = [sorted(set(int(b) for b in basket)) for basket in baskets if basket]
+        if not baskets:
+            return
+        new_books = sorted({b for basket in baskets for b in basket} - self.position.keys())
+        if new_books:
+            self._grow(new_books)
+
+        rows = np.repeat(np.arange(len(baskets)), [len(basket) for basket in baskets])
+        cols = np.array([self.position[b] for basket in baskets for b in basket], dtype=np.int64)
+        n = len(self.book_ids)
+        delta_baskets = sparse.csr_matrix((np.ones(len(cols), dtype=np.float32), (rows, cols)),
+                                          shape=(len(baskets), n))
+        delta = (delta_baskets.T @ delta_baskets).tocsr()
+        self.item_counts += delta.diagonal()
+        delta.setdiag(0)
+        delta.eliminate_zeros()
+        self.counts = (self.counts + delta).tocsr()
+        self.n_baskets += len(baskets)
+        self.rescore(np.unique(cols))
+
+    # ---- lookups ----------------------------------------------------------------
+
+    def recommend(self, book_id, limit):
+        """[(book_id, score), ...] best first; empty for books nobody bought with anything"""
+        pos = self.position.get(int(book_id))
+        if pos is None:
+            return []
+        found = self.neighbors[pos] >= 0
+        neighbors = self.neighbors[pos][found][:limit]
+        scores = self.scores[pos][found][:limit]
+        return [(int(self.book_ids[n]), float(s)) for n, s in zip(neighbors, scores)]
+
+    # ---- snapshot file ------------------------------------------------------------
+
+    def save(self, path):
+        """Write the index to `path` atomically (other workers may be reading it)"""
+        tmp = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(
+            tmp,
+            book_ids=self.book_ids,
+            counts_data=self.counts.data, counts_indices=self.counts.indices, counts_indptr=self.counts.indptr,
+            item_counts=self.item_counts,
+            neighbors=self.neighbors, scores=self.scores,
+            meta=np.array([self.n_baskets, self.top_k, self.min_support, self.built_at], dtype=np.float64),
+            metric=np.array(self.metric),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            n = len(f['book_ids'])
+            counts = sparse.csr_matrix((f['counts_data'], f['counts_indices'], f['counts_indptr']), shape=(n, n))
+            n_baskets, top_k, min_support, built_at = f['meta']
+            index = cls(f['book_ids'], counts, f['item_counts'], n_baskets, str(f['metric']),
+                        int(top_k), min_support, float(built_at))
+            index.neighbors = f['neighbors']
+            index.scores = f['scores']
+        return index
+
+
+# ===============================
+# PER-PROCESS STATE
+# ===============================
+
+_lock = threading.Lock()
+_state = {
+    'index': None,
+    'snapshot_mtime': None,
+    'checked_at': 0.0,
+    # Orders recorded in this worker since the snapshot: [(time, [book ids]), ...]
+    'recent': [],
+    'applied': 0,
+}
+
+
+def init_app(app):
+    app.config.setdefault('RECOMMENDATION_METRIC', 'cosine')
+    app.config.setdefault('RECOMMENDATION_TOP_K', 20)
+    app.config.setdefault('RECOMMENDATION_MIN_SUPPORT', 1)
+    app.config.setdefault('RECOMMENDATION_SNAPSHOT', os.path.join(app.instance_path, 'recommendations.npz'))
+    app.config.setdefault('RECOMMENDATION_REFRESH_SECONDS', 60)
+    if app.config['RECOMMENDATION_METRIC'] not in METRICS:
+        raise ValueError(f"RECOMMENDATION_METRIC must be one of {', '.join(METRICS)}")
+
+
+def build_index(app):
+    """Build a fresh index from every completed order in the database"""
+    built_at = time.time()
+    live = (
+        select(SaleItem.sale_id, SaleItem.book_id)
+        .join(Sale, SaleItem.sale_id == Sale.id)
+        .where(Sale.status == 'completed')
+    )
+    # Only completed orders are archived (see archive.py)
+    archived = select(ArchivedSaleItem.sale_id, ArchivedSaleItem.book_id)
+    # np.fromiter over the flattened tuples is much faster than np.array(rows) on Row objects
+    chunks = [np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64).reshape(-1, 2)
+              for stmt in (live, archived)
+              for rows in db.session.execute(stmt).partitions(FETCH_CHUNK)]
+    pairs = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+    return CoPurchaseIndex.from_pairs(
+        pairs[:, 0], pairs[:, 1],
+        metric=app.config['RECOMMENDATION_METRIC'],
+        top_k=app.config['RECOMMENDATION_TOP_K'],
+        min_support=app.config['RECOMMENDATION_MIN_SUPPORT'],
+        built_at=built_at,
+    )
+
+
+def _install(index, mtime):
+    """Swap in a new index and replay this worker's orders that it doesn't contain yet"""
+    _state['recent'] = [(ts, books) for ts, books in _state['recent'] if ts >= index.built_at]
+    index.add_baskets([books for _, books in _state['recent']])
+    _state['applied'] = len(_state['recent'])
+    _state['index'] = index
+    _state['snapshot_mtime'] = mtime
+
+
+def rebuild(app):
+    """Rebuild from the database, save the snapshot and use it here; returns the number of books"""
+    index = build_index(app)
+    path = app.config['RECOMMENDATION_SNAPSHOT']
+    index.save(path)
+    with _lock:
+        _install(index, os.path.getmtime(path))
+    return len(index.book_ids)
+
+
+def record_sale(book_ids):
+    """Call after an order is committed; it is added on the next lookup"""
+    with _lock:
+        _state['recent'].append((time.time(), list(book_ids)))
+
+
+def _current_index(app):
+    """This worker's index, reloaded or updated first if needed"""
+    path = app.config['RECOMMENDATION_SNAPSHOT']
+    now = time.monotonic()
+    with _lock:
+        if _state['index'] is None or now - _state['checked_at'] >= app.config['RECOMMENDATION_REFRESH_SECONDS']:
+            _state['checked_at'] = now
+            mtime = os.path.getmtime(path) if os.path.exists(path) else None
+            if mtime is not None and mtime != _state['snapshot_mtime']:
+                _install(CoPurchaseIndex.load(path), mtime)
+
+        if _state['index'] is not None:
+            pending = _state['recent'][_state['applied']:]
+            if pending:
+                _state['index'].add_baskets([books for _, books in pending])
+                _state['applied'] = len(_state['recent'])
+            return _state['index']
+
+    # No snapshot anywhere yet: build one now (only the first lookup pays for it)
+    rebuild(app)
+    return _state['index']
+
+
+def recommend(app, book_id, limit=10):
+    """[(book_id, score), ...] for the books most often bought together with book_id"""
+    index = _current_index(app)
+    with _lock:
+        return index.recommend(book_id, limit)
@@ -0,0 +1,73 @@
+# seed_bench_data.py
+# Fills a database with lots of fake books and completed orders for benchmarking.
+# Point it at a scratch database, never at the real one:
+#   DATABASE_URL=sqlite:////tmp/bench.db python seed_bench_data.py --books 2000 --sales 5000
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+
+if not os.getenv('DATABASE_URL'):
+    raise SystemExit("Set DATABASE_URL to a scratch database first (this script adds thousands of rows).")
+
+from app import app
+from models import db, Book, Sale, SaleItem, User
+
+GENRES = ['Fiction', 'Science Fiction', 'Mystery', 'History', 'Biography', 'Fantasy', 'Poetry', 'Science']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Add fake books and sales for benchmarks')
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--sales', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=365, help='spread sales over this many past days')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        user_ids = [u.id for u in User.query.all()]
+        books = [
+            dict(
+                title=f'Benchmark Book {i}',
+                author=f'Author {rng.randint(1, max(1, args.books // 5))}',
+                price=round(rng.uniform(4, 60), 2),
+                description='A book generated for load testing. ' * 4,
+                genre=rng.choice(GENRES),
+                stock_quantity=rng.randint(0, 200),
+            )
+            for i in range(args.books)
+        ]
+        db.session.execute(db.insert(Book), books)
+        db.session.commit()
+        book_rows = db.session.execute(db.select(Book.id, Book.price)).all()
+
+        now = datetime.utcnow()
+        for start in range(0, args.sales, 1000):
+            batch = min(1000, args.sales - start)
+            sales = []
+            for _ in range(batch):
+                sales.append(Sale(
+                    user_id=rng.choice(user_ids) if user_ids and rng.random() < 0.7 else None,
+                    customer_email=None,
+                    total_amount=0,
+                    sale_date=now - timedelta(seconds=rng.randint(0, args.days * 86400)),
+                    status='completed',
+                ))
+            db.session.add_all(sales)
+            db.session.flush()
+            for sale in sales:
+                total = 0
+                for book_id, price in rng.sample(book_rows, k=min(len(book_rows), rng.randint(1, 4))):
+                    quantity = rng.randint(1, 3)
+                    db.session.add(SaleItem(sale_id=sale.id, book_id=book_id,
+                                            quantity=quantity, price_at_time=price))
+                    total += price * quantity
+                sale.total_amount = round(total, 2)
+            db.session.commit()
+
+        print(f"Added {args.books} books and {args.sales} sales.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# static_assets.py
+# Build step + in-memory server for the frontend/ HTML and JS files.
+#
+# Build (run after changing anything in frontend/):
+#   python static_assets.py            writes frontend/dist/ and frontend/dist/manifest.json
+#
+# What the build does:
+#   - gives every non-HTML file a content hash in its name (api.js -> api.3f9c1e2ab4.js)
+#     so browsers can cache it forever; a new version simply gets a new name
+#   - rewrites the <script src="api.js"> references inside the HTML pages to the hashed names
+#   - keeps HTML pages under their normal names (links like href="cart.html" must keep working),
+#     they are revalidated with an ETag instead of cached forever
+#   - writes a gzip (.gz) and brotli (.br) copy of every file that gets smaller
+#
+# At startup the app loads the manifest and every file into memory once, so a request is
+# just a dictionary lookup. If the build was never run, the same work is done in memory
+# at startup so development doesn't need an extra step.
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional at runtime, the server falls back to gzip
+    brotli = None
+
+MANIFEST_NAME = 'manifest.json'
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'
+
+# Matches src="api.js", src="/api.js", href="style.css" ... but not links to other pages
+ASSET_REF = re.compile(r'''(src|href)=(["'])/?([\w.-]+\.(?:js|css|png|jpg|jpeg|gif|svg|ico|webp))\2''')
+
+
+def _content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def _content_type(name):
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type == 'application/javascript':
+        content_type += '; charset=utf-8'
+    return content_type
+
+
+def _compressed_variants(data):
+    """Return {'gzip': bytes, 'br': bytes} for the encodings that actually shrink the file"""
+    variants = {}
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        variants['gzip'] = gz
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            variants['br'] = br
+    return variants
+
+
+def build_assets(frontend_dir):
+    """
+    Fingerprint and precompress every file in frontend_dir
+    Returns (manifest, blobs): the manifest maps each URL path to its metadata,
+    blobs maps output file names to their bytes.
+    """
+    sources = {}
+    for name in sorted(os.listdir(frontend_dir)):
+        path = os.path.join(frontend_dir, name)
+        if os.path.isfile(path) and not name.startswith('.'):
+            with open(path, 'rb') as f:
+                sources[name] = f.read()
+
+    manifest = {}
+    blobs = {}
+
+    def add(url_path, out_name, data, immutable):
+        etag = _content_hash(data)
+        entry = {
+            'file': out_name,
+            'etag': etag,
+            'content_type': _content_type(url_path),
+            'cache_control': IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE,
+            'encodings': {},
+        }
+        blobs[out_name] = data
+        for encoding, compressed in _compressed_variants(data).items():
+            suffix = '.br' if encoding == 'br' else '.gz'
+            entry['encodings'][encoding] = out_name + suffix
+            blobs[out_name + suffix] = compressed
+        manifest[url_path] = entry
+
+    # Fingerprint the assets first so the HTML can point at the new names
+    hashed_names = {}
+    for name, data in sources.items():
+        if name.endswith('.html'):
+            continue
+        stem, ext = os.path.splitext(name)
+        hashed = f'{stem}.{_content_hash(data)}{ext}'
+        hashed_names[name] = hashed
+        add(hashed, hashed, data, immutable=True)
+        # The plain name still works (e.g. bookmarked or external links), it just isn't cached forever
+        manifest[name] = dict(manifest[hashed], cache_control=REVALIDATE_CACHE)
+
+    def rewrite(match):
+        attr, quote, ref = match.groups()
+        if ref not in hashed_names:
+            return match.group(0)
+        return f'{attr}={quote}/{hashed_names[ref]}{quote}'
+
+    for name, data in sources.items():
+        if not name.endswith('.html'):
+            continue
+        html = ASSET_REF.sub(rewrite, data.decode('utf-8')).encode('utf-8')
+        add(name, name, html, immutable=False)
+
+    return manifest, blobs
+
+
+def write_assets(frontend_dir, dist_dir):
+    """Run the build and write the output files plus manifest.json to dist_dir"""
+    manifest, blobs = build_assets(frontend_dir)
+    os.makedirs(dist_dir, exist_ok=True)
+    for name, data in blobs.items():
+        with open(os.path.join(dist_dir, name), 'wb') as f:
+            f.write(data)
+    with open(os.path.join(dist_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class StaticAssets:
+    """
+    Holds every frontend file (and its compressed copies) in memory
+    Create it once at startup with StaticAssets.load() and call response() per request.
+    """
+
+    def __init__(self, manifest, blobs, fallback='index.html'):
+        self.fallback = fallback
+        self.entries = {}
+        for url_path, entry in manifest.items():
+            bodies = {'identity': blobs[entry['file']]}
+            for encoding, name in entry['encodings'].items():
+                bodies[encoding] = blobs[name]
+            self.entries[url_path] = dict(entry, bodies=bodies)
+
+    @classmethod
+    def load(cls, frontend_dir):
+        """Use frontend_dir/dist/manifest.json if the build ran, otherwise build in memory"""
+        dist_dir = os.path.join(frontend_dir, 'dist')
+        manifest_path = os.path.join(dist_dir, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return cls(*build_assets(frontend_dir))
+
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        blobs = {}
+        for entry in manifest.values():
+            for name in [entry['file'], *entry['encodings'].values()]:
+                if name not in blobs:
+                    with open(os.path.join(dist_dir, name), 'rb') as f:
+                        blobs[name] = f.read()
+        return cls(manifest, blobs)
+
+    def response(self, path, request):
+        """Build the response for a URL path, falling back to index.html for unknown paths"""
+        entry = self.entries.get(path) or self.entries.get(self.fallback)
+        if entry is None:
+            return Response('Frontend not found', status=404)
+
+        # Pick the smallest encoding the client accepts
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in entry['bodies'] and request.accept_encodings.quality(candidate) > 0:
+                encoding = candidate
+                break
+
+        etag = entry['etag'] if encoding == 'identity' else f"{entry['etag']}-{encoding}"
+        headers = {
+            'Cache-Control': entry['cache_control'],
+            'Vary': 'Accept-Encoding',
+            'ETag': f'"{etag}"',
+        }
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+        return Response(entry['bodies'][encoding], headers=headers, content_type=entry['content_type'])
+
+
+if __name__ == '__main__':
+    frontend = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend'))
+    built = write_assets(frontend, os.path.join(frontend, 'dist'))
+    print(f"Built {len(built)} frontend entries into {os.path.join(frontend, 'dist')}")
@@ -0,0 +1,118 @@
+# conftest.py
+# Shared setup for the backend tests. Run them from backend/:
+#   python -m pytest -q
+#
+# The app is imported once per run against a throwaway SQLite file in a temporary
+# folder (DATABASE_URL), so the real instance/bookstore.db is never touched.
+# init_database() creates the tables and the sample users (admin/admin123 and
+# user/user123) like on a first start. The maintenance scheduler and the job workers
+# are switched off so nothing runs behind a test's back; tests that need a job to run
+# call jobs.run_one() themselves.
+#
+# Every test starts with no orders, notifications, idempotency keys or jobs. Books are
+# left alone: tests make their own with make_book().
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+TMP_DIR = tempfile.mkdtemp(prefix='bookstore-tests-')
+atexit.register(shutil.rmtree, TMP_DIR, ignore_errors=True)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMP_DIR, 'bookstore.db')
+os.environ['ARCHIVE_DATABASE_URL'] = 'sqlite:///' + os.path.join(TMP_DIR, 'bookstore-archive.db')
+os.environ['MAINTENANCE_SCHEDULER'] = '0'
+os.environ['JOB_WORKERS'] = '0'
+
+# The backend modules import each other by their plain names (import models, ...)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import app as flask_app  # noqa: E402  (needs the environment above)
+from models import (db, ArchivedSale, ArchivedSaleItem, BackgroundJob, Book, IdempotencyKey,  # noqa: E402
+                    Notification, Sale, SaleItem, User)
+
+
+@pytest.fixture(scope='session')
+def app():
+    return flask_app
+
+
+@pytest.fixture(autouse=True)
+def app_context(app):
+    """Each test runs inside an app context, starting from empty order tables"""
+    with app.app_context():
+        for model in (SaleItem, Notification, Sale, ArchivedSaleItem, ArchivedSale, IdempotencyKey, BackgroundJob):
+            db.session.execute(db.delete(model))
+        db.session.commit()
+        yield
+        db.session.rollback()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def refresh():
+    """End the test's read transaction so it sees what the requests committed"""
+    db.session.rollback()
+    db.session.expire_all()
+
+
+def auth_headers(user):
+    return {'Authorization': f'Bearer {user.generate_token()}'}
+
+
+@pytest.fixture
+def admin():
+    return User.query.filter_by(username='admin').one()
+
+
+@pytest.fixture
+def customer():
+    return User.query.filter_by(username='user').one()
+
+
+@pytest.fixture
+def admin_headers(admin):
+    return auth_headers(admin)
+
+
+@pytest.fixture
+def customer_headers(customer):
+    return auth_headers(customer)
+
+
+@pytest.fixture
+def make_book():
+    """make_book(stock_quantity=5, price=12.5, ...) -> a committed Book with a unique ISBN"""
+    def make(**fields):
+        book = Book(**{
+            'title': f'Test Book {uuid.uuid4().hex[:8]}',
+            'author': 'Test Author',
+            'isbn': uuid.uuid4().hex[:13],
+            'price': 10.0,
+            'stock_quantity': 50,
+            **fields,
+        })
+        db.session.add(book)
+        db.session.commit()
+        return book
+    return make
+
+
+@pytest.fixture
+def make_sale():
+    """make_sale(sale_date=..., status='completed', user_id=None, total_amount=10.0, book=None) -> a committed Sale"""
+    def make(book=None, quantity=1, **fields):
+        sale = Sale(**{'total_amount': 10.0, 'status': 'completed', **fields})
+        db.session.add(sale)
+        db.session.flush()
+        if book is not None:
+            db.session.add(SaleItem(sale_id=sale.id, book_id=book.id, quantity=quantity, price_at_time=book.price))
+        db.session.commit()
+        return sale
+    return make
@@ -0,0 +1,81 @@
+# Moving old orders into the archive database (archive.py) and reading them back
+from datetime import datetime, timedelta
+
+from archive import archive_sales
+from conftest import refresh
+from models import db, ArchivedSale, ArchivedSaleItem, Notification, Sale, SaleItem
+
+LONG_AGO = datetime.utcnow() - timedelta(days=400)
+
+
+def test_old_completed_orders_move_with_their_items(app, make_book, make_sale):
+    book = make_book()
+    old = make_sale(sale_date=LONG_AGO, book=book, quantity=3).id
+    recent = make_sale(sale_date=datetime.utcnow(), book=book).id
+    old_cancelled = make_sale(sale_date=LONG_AGO, status='cancelled').id
+    # Still referenced by a notification: waits until that is purged
+    noticed = make_sale(sale_date=LONG_AGO).id
+    db.session.add(Notification(type='LOW_STOCK', message='low', sale_id=noticed))
+    db.session.commit()
+
+    assert archive_sales(app) == 1
+    refresh()
+
+    assert db.session.get(Sale, old) is None
+    assert SaleItem.query.filter_by(sale_id=old).count() == 0
+    archived = db.session.get(ArchivedSale, old)
+    assert archived.sale_date == LONG_AGO and archived.archived_at is not None
+    assert [(item.book_id, item.quantity) for item in ArchivedSaleItem.query.filter_by(sale_id=old)] == [(book.id, 3)]
+    assert {sale.id for sale in Sale.query} == {recent, old_cancelled, noticed}
+
+    # Nothing left to do on the next run
+    assert archive_sales(app) == 0
+
+
+def test_get_sale_by_id_falls_through_to_the_archive(app, client, customer, customer_headers, admin_headers,
+                                                     make_book, make_sale):
+    book = make_book()
+    mine = make_sale(sale_date=LONG_AGO, book=book, quantity=2, user_id=customer.id).id
+    someone_elses = make_sale(sale_date=LONG_AGO, book=book).id
+    archive_sales(app)
+
+    response = client.get(f'/api/sales/{mine}', headers=customer_headers)
+    assert response.status_code == 200
+    data = response.get_json()['data']
+    assert data['id'] == mine and data['user_id'] == customer.id
+    assert [(item['book_id'], item['quantity']) for item in data['items']] == [(book.id, 2)]
+
+    assert client.get(f'/api/sales/{someone_elses}', headers=customer_headers).status_code == 403
+    assert client.get(f'/api/sales/{someone_elses}', headers=admin_headers).status_code == 200
+    assert client.get('/api/sales/999999', headers=admin_headers).status_code == 404
+
+
+def test_lists_and_counts_merge_live_and_archived_orders(app, client, admin_headers, make_sale):
+    archived = [make_sale(sale_date=LONG_AGO + timedelta(days=i), total_amount=1.0).id for i in range(3)]
+    archive_sales(app)
+    live = [make_sale(sale_date=datetime.utcnow() - timedelta(hours=i), total_amount=2.0).id for i in range(3)]
+    newest_first = live + archived[::-1]
+
+    everything = client.get('/api/sales', headers=admin_headers).get_json()
+    assert [sale['id'] for sale in everything['data']] == newest_first
+
+    # Pages of 4 cross from the live table into the archive
+    first = client.get('/api/sales?limit=4', headers=admin_headers).get_json()
+    second = client.get(f"/api/sales?limit=4&cursor={first['next_cursor']}", headers=admin_headers).get_json()
+    assert [sale['id'] for sale in first['data'] + second['data']] == newest_first
+    assert second['next_cursor'] is None
+    assert first['total'] == 6 and first['total_amount'] == 9.0
+
+    assert client.get('/api/sales/count').get_json()['total_count'] == 6
+
+
+def test_archived_order_ids_are_never_handed_out_again(app, client, make_book, make_sale):
+    book = make_book()
+    newest = make_sale(sale_date=LONG_AGO, book=book).id
+    # The newest order leaves the sales table altogether
+    assert archive_sales(app) == 1
+    assert Sale.query.count() == 0
+
+    response = client.post('/api/sales', json={'items': [{'id': book.id, 'quantity': 1}]})
+    assert response.status_code == 201
+    assert response.get_json()['data']['id'] > newest
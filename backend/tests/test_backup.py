@@ -0,0 +1,42 @@
+# Online backups (backup.py)
+import glob
+import os
+import sqlite3
+
+import backup
+
+
+def test_backups_leave_only_the_archives_and_manifests(app, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'BACKUP_DIR', str(tmp_path))
+    # A -wal/-shm pair an older version left behind
+    (tmp_path / 'main-20240101T000000000000.db.tmp-wal').write_bytes(b'')
+    (tmp_path / 'main-20240101T000000000000.db.tmp-shm').write_bytes(b'')
+
+    first = backup.backup_all(app)
+    # Nothing changed: skipped, but the copy it compared still has to be cleaned up
+    second = backup.backup_all(app)
+    assert all(manifest['skipped'] for manifest in second)
+    for manifest in first:
+        gz_path = os.path.join(str(tmp_path), manifest['file'])
+        assert backup.verify(gz_path)['sha256'] == manifest['sha256']
+
+    names = sorted(os.path.basename(path) for path in glob.glob(str(tmp_path / '*')))
+    assert names == sorted([manifest['file'] for manifest in first]
+                           + [manifest['file'][:-len('.db.gz')] + '.json' for manifest in first])
+
+
+def test_a_restored_database_keeps_wal_mode(app, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'BACKUP_DIR', str(tmp_path / 'backups'))
+    manifest = backup.backup_one(app, 'main', backup.sqlite_databases()['main'])
+    target = str(tmp_path / 'restored.db')
+    connection = sqlite3.connect(target)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.close()
+
+    backup.restore(os.path.join(str(tmp_path / 'backups'), manifest['file']), target)
+    connection = sqlite3.connect(target)
+    try:
+        assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert connection.execute('SELECT count(*) FROM users').fetchone()[0] >= 2
+    finally:
+        connection.close()
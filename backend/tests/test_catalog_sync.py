@@ -0,0 +1,110 @@
+# Catalog delta sync: GET /api/books/changes?since=N (catalog_sync.py)
+from datetime import datetime, timedelta
+
+import catalog_sync
+from conftest import refresh
+from models import db, Book, BookTombstone
+
+
+def changes(client, since, limit=None):
+    query = f'/api/books/changes?since={since}' + (f'&limit={limit}' if limit else '')
+    response = client.get(query)
+    assert response.status_code == 200
+    return response.get_json()['data']
+
+
+def sync_from(client, since, limit=None):
+    """Follow next_since until has_more is false, like a client does; returns (changed ids, deleted ids, token)"""
+    changed, deleted = [], []
+    while True:
+        page = changes(client, since, limit)
+        assert not page['reset']
+        changed += [book['id'] for book in page['changed']]
+        deleted += page['deleted']
+        since = page['next_since']
+        if not page['has_more']:
+            return changed, deleted, since
+
+
+def test_full_download_then_nothing_new(client, make_book):
+    make_book()
+    changed, deleted, token = sync_from(client, '0')
+    assert sorted(changed) == sorted(book.id for book in Book.query)
+    assert deleted == []
+    assert token == str(catalog_sync.current_sequence()[0])
+
+    assert sync_from(client, token) == ([], [], token)
+
+
+def test_edits_sales_and_deletes_show_up_in_the_delta(client, admin_headers, make_book):
+    edited, sold, removed, untouched = make_book(), make_book(stock_quantity=5), make_book(), make_book()
+    edited_id, sold_id, removed_id = edited.id, sold.id, removed.id
+    token = str(catalog_sync.current_sequence()[0])
+
+    assert client.put(f'/api/books/{edited_id}', json={'price': 12.0}, headers=admin_headers).status_code == 200
+    assert client.post('/api/sales', json={'items': [{'id': sold_id, 'quantity': 1}]}).status_code == 201
+    assert client.delete(f'/api/books/{removed_id}', headers=admin_headers).status_code == 200
+
+    page = changes(client, token)
+    assert [book['id'] for book in page['changed']] == [edited_id, sold_id]
+    assert {book['id']: book['price'] for book in page['changed']}[edited_id] == 12.0
+    assert {book['id']: book['stock_quantity'] for book in page['changed']}[sold_id] == 4
+    assert page['deleted'] == [removed_id]
+    refresh()
+    assert db.session.get(BookTombstone, removed_id) is not None
+
+    # A full download leaves deleted books out instead of listing their tombstones
+    changed, deleted, _ = sync_from(client, '0')
+    assert removed_id not in changed and untouched.id in changed and deleted == []
+
+
+def test_one_big_change_is_paged_without_losing_books(client):
+    token = str(catalog_sync.current_sequence()[0])
+    # Five books in one transaction share one change number
+    books = [Book(title=f'Boxed set {i}', author='Sync Test', price=5.0, stock_quantity=1) for i in range(5)]
+    db.session.add_all(books)
+    db.session.commit()
+    ids = sorted(book.id for book in books)
+
+    first = changes(client, token, limit=2)
+    assert first['has_more'] and '-' in first['next_since']
+    changed, deleted, end = sync_from(client, token, limit=2)
+    assert changed == ids and deleted == []
+    assert end == str(catalog_sync.current_sequence()[0])
+
+
+def test_clients_older_than_the_purged_deletes_start_over(app, client, admin_headers, make_book):
+    make_book()
+    stale = str(catalog_sync.current_sequence()[0])
+    gone = make_book().id
+    client.delete(f'/api/books/{gone}', headers=admin_headers)
+    db.session.execute(db.update(BookTombstone).values(deleted_at=datetime.utcnow() - timedelta(days=365)))
+    db.session.commit()
+
+    assert catalog_sync.purge_tombstones(app) >= 1
+    page = changes(client, stale)
+    assert page['reset'] and page['next_since'] == '0'
+
+    # Up-to-date clients are fine, and a token from the future (a restored backup) resets too
+    current = catalog_sync.current_sequence()[0]
+    assert not changes(client, str(current))['reset']
+    assert changes(client, str(current + 100))['reset']
+
+
+def test_a_bad_token_is_400(client):
+    assert client.get('/api/books/changes?since=yesterday').status_code == 400
+    assert client.get('/api/books/changes?since=-4').status_code == 400
+
+
+def test_numbering_old_books_keeps_their_updated_at(make_book):
+    book_id = make_book().id
+    last_edit = datetime(2024, 5, 1, 12, 0)
+    # A book from before change numbers existed
+    db.session.execute(db.update(Book).where(Book.id == book_id).values(change_seq=None, updated_at=last_edit))
+    db.session.commit()
+
+    assert catalog_sync.stamp_unsequenced_books() == 1
+    refresh()
+    book = db.session.get(Book, book_id)
+    assert book.change_seq == catalog_sync.current_sequence()[0]
+    assert book.updated_at == last_edit
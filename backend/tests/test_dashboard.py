@@ -0,0 +1,27 @@
+# The admin dashboard: GET /api/admin/dashboard (dashboard.py)
+from datetime import datetime, timedelta
+
+from models import db, Sale
+
+
+def test_todays_numbers_count_a_checkout_of_an_old_cart(app, client, admin_headers, customer, customer_headers,
+                                                        make_book, make_sale, monkeypatch):
+    monkeypatch.setitem(app.config, 'DASHBOARD_TTL_SECONDS', 0)
+    book = make_book(price=8.0)
+    client.post(f'/api/cart/{customer.id}/add', json={'book_id': book.id, 'quantity': 2}, headers=customer_headers)
+    # The cart was last touched two days ago
+    cart = Sale.query.filter_by(user_id=customer.id, status='cart').one()
+    cart.sale_date = datetime.utcnow() - timedelta(days=2)
+    db.session.commit()
+    # Placed today but not revenue, and an order from yesterday
+    make_sale(status='pending', total_amount=50.0)
+    make_sale(sale_date=datetime.utcnow() - timedelta(days=1), total_amount=30.0)
+
+    order = client.post(f'/api/checkout/{customer.id}', headers=customer_headers).get_json()['order']
+
+    data = client.get('/api/admin/dashboard', headers=admin_headers).get_json()['data']
+    assert data['today']['orders'] == 1
+    assert data['today']['revenue'] == 16.0
+    newest = data['recent_orders'][0]
+    assert newest['id'] == order['id'] and newest['status'] == 'completed'
+    assert datetime.fromisoformat(newest['sale_date']) >= datetime.utcnow() - timedelta(minutes=1)
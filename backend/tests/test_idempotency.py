@@ -0,0 +1,167 @@
+# Idempotency-Key on POST /api/sales and /api/checkout (idempotency.py)
+import json
+from datetime import datetime, timedelta
+
+import msgpack
+
+import idempotency
+from conftest import refresh
+from models import db, Book, IdempotencyKey, Sale
+
+
+def place_order(client, book, key=None, quantity=1, **headers):
+    """POST /api/sales with exact body bytes, so a test can work out the key's fingerprint"""
+    if key:
+        headers['Idempotency-Key'] = key
+    body = json.dumps({'items': [{'id': book.id, 'quantity': quantity}], 'customer_email': 'guest@example.com'})
+    return client.post('/api/sales', data=body, content_type='application/json', headers=headers), body
+
+
+def test_retry_replays_the_first_response_without_a_second_order(client, make_book):
+    book = make_book(stock_quantity=10)
+
+    first, _ = place_order(client, book, key='order-1', quantity=2)
+    retry, _ = place_order(client, book, key='order-1', quantity=2)
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json() == first.get_json()
+    refresh()
+    assert Sale.query.count() == 1
+    assert db.session.get(Book, book.id).stock_quantity == 8
+    record = IdempotencyKey.query.one()
+    assert record.status == 'completed' and record.locked_until is None
+
+
+def test_without_the_header_every_post_is_a_new_order(client, make_book):
+    book = make_book(stock_quantity=10)
+    place_order(client, book)
+    place_order(client, book)
+    refresh()
+    assert Sale.query.count() == 2
+    assert IdempotencyKey.query.count() == 0
+
+
+def test_same_key_with_a_different_body_is_422(client, make_book):
+    book = make_book(stock_quantity=10)
+    place_order(client, book, key='order-2', quantity=1)
+    response, _ = place_order(client, book, key='order-2', quantity=3)
+    assert response.status_code == 422
+    refresh()
+    assert Sale.query.count() == 1
+
+
+def test_replay_follows_the_retrys_accept_header(client, make_book):
+    book = make_book(stock_quantity=10)
+    first, _ = place_order(client, book, key='order-3')
+    retry, _ = place_order(client, book, key='order-3', Accept='application/msgpack')
+
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(retry.data, raw=False) == first.get_json()
+
+
+def test_a_key_whose_worker_died_is_taken_over(client, make_book):
+    book = make_book(stock_quantity=10)
+    # What a worker that died mid-request leaves behind: in_progress, lease run out
+    body = json.dumps({'items': [{'id': book.id, 'quantity': 1}], 'customer_email': 'guest@example.com'})
+    db.session.add(IdempotencyKey(
+        key=idempotency._sha256('', '/api/sales', 'order-4'),
+        fingerprint=idempotency._sha256('POST', body.encode()),
+        status='in_progress',
+        expires_at=datetime.utcnow() + timedelta(days=1),
+        locked_until=datetime.utcnow() - timedelta(seconds=1),
+    ))
+    db.session.commit()
+
+    response, sent = place_order(client, book, key='order-4')
+    assert sent == body
+    assert response.status_code == 201
+    assert 'Idempotent-Replayed' not in response.headers
+    refresh()
+    assert Sale.query.count() == 1
+    assert IdempotencyKey.query.one().status == 'completed'
+
+
+def test_a_key_still_leased_is_409_after_the_wait(app, client, make_book, monkeypatch):
+    book = make_book(stock_quantity=10)
+    body = json.dumps({'items': [{'id': book.id, 'quantity': 1}], 'customer_email': 'guest@example.com'})
+    db.session.add(IdempotencyKey(
+        key=idempotency._sha256('', '/api/sales', 'order-5'),
+        fingerprint=idempotency._sha256('POST', body.encode()),
+        status='in_progress',
+        expires_at=datetime.utcnow() + timedelta(days=1),
+        locked_until=datetime.utcnow() + timedelta(minutes=1),
+    ))
+    db.session.commit()
+    monkeypatch.setitem(app.config, 'IDEMPOTENCY_WAIT_SECONDS', 0.1)
+
+    response, _ = place_order(client, book, key='order-5')
+    assert response.status_code == 409
+    refresh()
+    assert Sale.query.count() == 0
+
+
+def test_order_and_stored_response_commit_together(client, make_book, monkeypatch):
+    book = make_book(stock_quantity=10)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('database went away while storing the response')
+    # The only UPDATE on a first attempt is the one that stores the response
+    monkeypatch.setattr(idempotency, 'update', fail)
+
+    response, _ = place_order(client, book, key='order-6')
+    assert response.status_code == 500
+    refresh()
+    # No order without its stored response, and the stock is untouched
+    assert Sale.query.count() == 0
+    assert db.session.get(Book, book.id).stock_quantity == 10
+
+
+def test_server_errors_are_not_pinned_to_the_key(client, make_book):
+    book = make_book(stock_quantity=10)
+    failed, _ = place_order(client, book, key='order-7', quantity='many')
+    assert failed.status_code == 500
+    refresh()
+    assert IdempotencyKey.query.count() == 0
+
+    # Same key, fixed request: runs for real
+    response, _ = place_order(client, book, key='order-7')
+    assert response.status_code == 201
+
+
+def test_checkout_retry_places_one_order(client, customer, customer_headers, make_book):
+    book = make_book(stock_quantity=10)
+    client.post(f'/api/cart/{customer.id}/add', json={'book_id': book.id, 'quantity': 3}, headers=customer_headers)
+
+    headers = {**customer_headers, 'Idempotency-Key': 'checkout-1'}
+    first = client.post(f'/api/checkout/{customer.id}', headers=headers)
+    retry = client.post(f'/api/checkout/{customer.id}', headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.get_json() == first.get_json()
+    refresh()
+    assert Sale.query.filter_by(user_id=customer.id, status='completed').count() == 1
+    assert db.session.get(Book, book.id).stock_quantity == 7
+
+
+def test_an_error_response_keeps_none_of_the_endpoints_changes(client, customer, customer_headers, make_book):
+    plenty, short = make_book(stock_quantity=10), make_book(stock_quantity=5)
+    plenty_id, short_id = plenty.id, short.id
+    client.post(f'/api/cart/{customer.id}/add', json={'book_id': plenty_id, 'quantity': 2}, headers=customer_headers)
+    client.post(f'/api/cart/{customer.id}/add', json={'book_id': short_id, 'quantity': 4}, headers=customer_headers)
+    # Someone else buys the second book in the meantime
+    db.session.get(Book, short_id).stock_quantity = 1
+    db.session.commit()
+
+    headers = {**customer_headers, 'Idempotency-Key': 'checkout-2'}
+    response = client.post(f'/api/checkout/{customer.id}', headers=headers)
+    assert response.status_code == 400
+
+    refresh()
+    # Checkout took the first book's stock before finding the second one short
+    assert db.session.get(Book, plenty_id).stock_quantity == 10
+    assert db.session.get(Book, short_id).stock_quantity == 1
+    assert Sale.query.filter_by(user_id=customer.id, status='cart').count() == 1
+    # The 400 itself is still what a retry gets back
+    assert IdempotencyKey.query.one().response_status == 400
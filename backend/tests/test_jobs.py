@@ -0,0 +1,141 @@
+# The background job queue (jobs.py): enqueue, run, retry, dead-letter, lease
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+import recommendations
+from conftest import refresh
+from models import db, BackgroundJob, Notification
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    """Register throwaway job kinds for one test"""
+    def register(kind, function):
+        monkeypatch.setitem(jobs.HANDLERS, kind, function)
+    return register
+
+
+def note(app, payload):
+    """A handler that writes a row, so a test can see whether its changes were kept"""
+    db.session.add(Notification(type='TEST', message=payload['message']))
+
+
+def run_all(app):
+    outcomes = []
+    while (outcome := jobs.run_one(app, 'test-worker')) is not None:
+        outcomes.append(outcome)
+    return outcomes
+
+
+def test_a_job_only_exists_once_its_transaction_commits(app, handlers):
+    handlers('note', note)
+    jobs.enqueue('note', {'message': 'rolled back'})
+    db.session.rollback()
+    assert jobs.run_one(app, 'test-worker') is None
+
+    jobs.enqueue('note', {'message': 'committed'})
+    db.session.commit()
+    assert [outcome['status'] for outcome in run_all(app)] == ['done']
+
+    refresh()
+    job = BackgroundJob.query.one()
+    assert job.status == 'done' and job.attempts == 1 and job.locked_by is None
+    assert [n.message for n in Notification.query.filter_by(type='TEST')] == ['committed']
+
+
+def test_unknown_kinds_are_refused_at_enqueue():
+    with pytest.raises(ValueError):
+        jobs.enqueue('no_such_kind')
+
+
+def test_a_failing_job_is_retried_later_then_dead_lettered(app, handlers):
+    def broken(app, payload):
+        note(app, payload)
+        raise RuntimeError('mail server down')
+    handlers('broken', broken)
+    jobs.enqueue('broken', {'message': 'half done'}, max_attempts=2)
+    db.session.commit()
+
+    before = datetime.utcnow()
+    assert jobs.run_one(app, 'test-worker')['status'] == 'retry'
+    refresh()
+    job = BackgroundJob.query.one()
+    assert job.status == 'queued' and job.attempts == 1
+    assert 'mail server down' in job.last_error
+    # Backed off by JOB_RETRY_BASE_SECONDS, give or take the jitter
+    base = app.config['JOB_RETRY_BASE_SECONDS']
+    assert before + timedelta(seconds=base * 0.75) <= job.run_after <= datetime.utcnow() + timedelta(seconds=base * 1.25)
+    # Not due yet
+    assert jobs.run_one(app, 'test-worker') is None
+
+    job.run_after = datetime.utcnow()
+    db.session.commit()
+    assert jobs.run_one(app, 'test-worker')['status'] == 'dead'
+    refresh()
+    job = BackgroundJob.query.one()
+    assert job.status == 'dead' and job.attempts == 2 and job.finished_at is not None
+    # The failed attempts' writes were rolled back
+    assert Notification.query.filter_by(type='TEST').count() == 0
+
+
+def test_admins_see_and_retry_dead_jobs(app, client, admin_headers, handlers):
+    calls = []
+
+    def flaky(app, payload):
+        calls.append(payload)
+        if len(calls) == 1:
+            raise RuntimeError('first try fails')
+    handlers('flaky', flaky)
+    job = jobs.enqueue('flaky', {'n': 1}, max_attempts=1)
+    db.session.commit()
+    job_id = job.id
+    assert jobs.run_one(app, 'test-worker')['status'] == 'dead'
+
+    status = client.get('/api/admin/jobs', headers=admin_headers).get_json()
+    assert status['data']['dead'] == 1
+    assert [dead['id'] for dead in status['dead']] == [job_id]
+
+    assert client.post(f'/api/admin/jobs/{job_id}/retry', headers=admin_headers).status_code == 200
+    # Only dead jobs can be retried
+    assert client.post(f'/api/admin/jobs/{job_id}/retry', headers=admin_headers).status_code == 404
+
+    assert jobs.run_one(app, 'test-worker')['status'] == 'done'
+    assert calls == [{'n': 1}, {'n': 1}]
+
+
+def test_a_job_whose_worker_died_is_picked_up_after_its_lease(app, handlers):
+    handlers('note', note)
+    jobs.enqueue('note', {'message': 'once'})
+    db.session.commit()
+
+    # Worker A claims it and dies
+    job_id = jobs.claim(app, 'worker-a').id
+    assert jobs.run_one(app, 'worker-b') is None
+
+    db.session.execute(db.update(BackgroundJob).values(locked_until=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+    outcome = jobs.run_one(app, 'worker-b')
+    assert (outcome['id'], outcome['status'], outcome['attempt']) == (job_id, 'done', 2)
+
+    # Worker A coming back can't mark it a second time
+    assert not jobs._finish(job_id, 'worker-a', status='done')
+    db.session.rollback()
+    refresh()
+    assert Notification.query.filter_by(type='TEST').count() == 1
+
+
+
+def test_an_order_updates_this_workers_caches_after_its_commit(client, make_book):
+    book = make_book(stock_quantity=10)
+    before = len(recommendations._state['recent'])
+
+    assert client.post('/api/sales', json={'items': [{'id': book.id, 'quantity': 2}]}).status_code == 201
+    # A refused order leaves the caches alone
+    client.post('/api/sales', json={'items': [{'id': book.id, 'quantity': 500}]})
+
+    assert [books for _, books in recommendations._state['recent'][before:]] == [[book.id]]
+    # Per-process caches aren't background jobs: any process could claim those
+    refresh()
+    assert {job.kind for job in BackgroundJob.query} <= {'stock_alerts'}
@@ -0,0 +1,76 @@
+# Order history filters and keyset paging: GET /api/sales and /api/sales/user
+from datetime import datetime, timedelta
+
+
+def test_filters_by_status_total_date_and_user(client, admin_headers, customer, make_sale):
+    make_sale(sale_date=datetime(2025, 1, 10, 9), total_amount=15.0, user_id=customer.id)
+    make_sale(sale_date=datetime(2025, 1, 20, 9), total_amount=40.0)
+    make_sale(sale_date=datetime(2025, 1, 31, 23), total_amount=55.0, user_id=customer.id)
+    make_sale(sale_date=datetime(2025, 2, 1, 9), total_amount=70.0, status='cancelled')
+
+    def totals(query):
+        response = client.get(f'/api/sales?{query}', headers=admin_headers)
+        assert response.status_code == 200
+        return [sale['total_amount'] for sale in response.get_json()['data']]
+
+    assert totals('status=cancelled') == [70.0]
+    assert totals('min_total=40') == [70.0, 55.0, 40.0]
+    # A plain "to" date includes that whole day
+    assert totals('from=2025-01-15&to=2025-01-31') == [55.0, 40.0]
+    assert totals('user=user') == [55.0, 15.0]
+    assert totals(f'user={customer.id}&min_total=20') == [55.0]
+
+
+def test_bad_filter_values_are_400(client, admin_headers):
+    assert client.get('/api/sales?from=yesterday', headers=admin_headers).status_code == 400
+    assert client.get('/api/sales?min_total=lots', headers=admin_headers).status_code == 400
+    assert client.get('/api/sales?limit=5&cursor=nonsense', headers=admin_headers).status_code == 400
+
+
+def test_keyset_pages_cover_every_sale_once(client, admin_headers, make_sale):
+    start = datetime(2025, 3, 1, 12)
+    # Two pairs share a sale_date, so the pages have to be cut on the id as well
+    dates = [start, start, start + timedelta(hours=1), start + timedelta(hours=2),
+             start + timedelta(hours=2), start + timedelta(hours=3), start + timedelta(hours=4)]
+    made = [make_sale(sale_date=when, total_amount=10.0 + i) for i, when in enumerate(dates)]
+    expected = [sale.id for sale in sorted(made, key=lambda sale: (sale.sale_date, sale.id), reverse=True)]
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        query = 'limit=3' + (f'&cursor={cursor}' if cursor else '')
+        page = client.get(f'/api/sales?{query}', headers=admin_headers).get_json()
+        pages += 1
+        assert page['total'] == 7
+        assert page['total_amount'] == round(sum(10.0 + i for i in range(7)), 2)
+        seen += [sale['id'] for sale in page['data']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    assert pages == 3
+    assert seen == expected
+
+
+def test_count_0_skips_the_totals_and_fields_trims_each_order(client, admin_headers, make_sale, make_book):
+    book = make_book()
+    make_sale(book=book, quantity=2)
+
+    page = client.get('/api/sales?limit=10&count=0&fields=id,total_amount', headers=admin_headers).get_json()
+    assert 'total' not in page
+    assert page['data'] == [{'id': page['data'][0]['id'], 'total_amount': 10.0}]
+
+
+def test_user_history_only_shows_own_orders(client, customer, customer_headers, admin, make_sale):
+    own = make_sale(user_id=customer.id, total_amount=12.0)
+    make_sale(user_id=admin.id, total_amount=99.0)
+
+    response = client.get('/api/sales/user?limit=10', headers=customer_headers)
+    assert response.status_code == 200
+    assert [sale['id'] for sale in response.get_json()['data']] == [own.id]
+    # ?user= is an admin filter; customers can't use it to look at someone else's orders
+    response = client.get(f'/api/sales/user?user={admin.id}', headers=customer_headers)
+    assert [sale['id'] for sale in response.get_json()['data']] == [own.id]
+
+
+def test_sales_list_is_admin_only(client, customer_headers):
+    assert client.get('/api/sales', headers=customer_headers).status_code == 403
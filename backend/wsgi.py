@@ -0,0 +1,7 @@
+# wsgi.py
+# Production entry point. WSGI servers (gunicorn, waitress) import `app` from here
+# instead of running app.py directly, so the development server never starts.
+#   gunicorn -c gunicorn.conf.py wsgi:app
+from app import app
+
+application = app
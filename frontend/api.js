@@ -62,19 +62,46 @@
   function addBook(b) { return api("/books", { method: "POST", body: b }); }
   function editBook(id, b) { return api("/books/" + encodeURIComponent(id), { method: "PUT", body: b }); }
   function delBook(id) { return api("/books/" + encodeURIComponent(id), { method: "DELETE" }); }
+  function getRecommendations(id, params) { return api("/books/" + encodeURIComponent(id) + "/recommendations" + qs(params)); }
+  function suggestBooks(prefix, params) { return api("/books/suggest" + qs(Object.assign({ prefix: prefix }, params))); }
+  function getFacets(params) { return api("/books/facets" + qs(params)); }
+  function getBookChanges(since, params) { return api("/books/changes" + qs(Object.assign({ since: since || 0 }, params))); }
+
+  // Turn {from: "2025-01-01", limit: 50} into "?from=2025-01-01&limit=50" (skips empty values)
+  function qs(params) {
+    var parts = [];
+    Object.keys(params || {}).forEach(function (k) {
+      var v = params[k];
+      if (v !== undefined && v !== null && v !== "") parts.push(encodeURIComponent(k) + "=" + encodeURIComponent(v));
+    });
+    return parts.length ? "?" + parts.join("&") : "";
+  }
 
   // Sales
-  function createSale(saleData) { return api("/sales", { method: "POST", body: saleData }); }
-  function getAllSales() { return api("/sales"); }
-  function getUserSales() { return api("/sales/user"); }
+  // params (optional): from, to, status, min_total, user (admin), limit, cursor, count
+  // Pass the same idempotencyKey when retrying a failed submit so the order is only placed once
+  function createSale(saleData, idempotencyKey) {
+    var headers = idempotencyKey ? { "Idempotency-Key": idempotencyKey } : {};
+    return api("/sales", { method: "POST", body: saleData, headers: headers });
+  }
+  function getAllSales(params) { return api("/sales" + qs(params)); }
+  function getUserSales(params) { return api("/sales/user" + qs(params)); }
   function getSalesCount() { return api("/sales/count"); }
 
+  // Inventory
+  function getLowStock(params) { return api("/inventory/low-stock" + qs(params)); }
+  function getReorderSuggestions(params) { return api("/inventory/reorder-suggestions" + qs(params)); }
+
+  // Admin headline numbers (today's orders and revenue, unseen notifications, stock, recent orders)
+  function getDashboard() { return api("/admin/dashboard"); }
+
   // Expose to pages
   window.API = {
     setBase(url) { API_BASE = url; },
     api, getToken, setToken, clearToken,
     login, register, profile, logout,
-    getBooks, getBook, addBook, editBook, delBook,
-    createSale, getAllSales, getUserSales, getSalesCount
+    getBooks, getBook, addBook, editBook, delBook, getRecommendations, suggestBooks, getFacets, getBookChanges,
+    createSale, getAllSales, getUserSales, getSalesCount,
+    getLowStock, getReorderSuggestions, getDashboard
   };
 })();
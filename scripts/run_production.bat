@@ -0,0 +1,26 @@
+@echo off
+REM scripts\run_production.bat
+REM Production backend launcher for Windows (waitress; gunicorn does not run on Windows).
+REM Tune with GUNICORN_THREADS and PORT.
+cd /d "%~dp0..\backend"
+
+REM Create venv if not present
+if not exist .venv (
+  echo Creating virtual environment...
+  py -m venv .venv
+)
+
+REM Activate venv
+call .venv\Scripts\activate
+
+REM Install requirements
+echo Installing dependencies...
+pip install --disable-pip-version-check -q -r requirements.txt
+
+echo Building frontend assets...
+python static_assets.py
+
+if "%PORT%"=="" set PORT=5000
+if "%GUNICORN_THREADS%"=="" set GUNICORN_THREADS=8
+echo Starting production backend at http://localhost:%PORT% ...
+waitress-serve --listen=0.0.0.0:%PORT% --threads=%GUNICORN_THREADS% wsgi:app
@@ -0,0 +1,37 @@
+#!/bin/bash
+# scripts/run_production.sh
+# Production backend launcher for macOS/Linux (gunicorn, several workers).
+#   ./scripts/run_production.sh          start the server
+#   ./scripts/run_production.sh reload   gracefully reload a running server
+# Tune with WEB_CONCURRENCY, GUNICORN_THREADS, GUNICORN_PRELOAD and PORT (see backend/gunicorn.conf.py).
+
+# Move to backend directory relative to this script
+cd "$(dirname "$0")/../backend" || { echo "Backend folder not found."; exit 1; }
+
+if [ "$1" = "reload" ]; then
+  if [ ! -f instance/gunicorn.pid ]; then
+    echo "No running server found (instance/gunicorn.pid missing)."
+    exit 1
+  fi
+  kill -HUP "$(cat instance/gunicorn.pid)" && echo "Reload signal sent."
+  exit $?
+fi
+
+# Create venv if missing
+if [ ! -d ".venv" ]; then
+  echo "Creating virtual environment..."
+  python3 -m venv .venv || python -m venv .venv || { echo "Failed to create venv"; exit 1; }
+fi
+
+# Activate venv
+# shellcheck disable=SC1091
+source .venv/bin/activate || { echo "Failed to activate venv"; exit 1; }
+
+echo "Installing dependencies from requirements.txt ..."
+pip install --disable-pip-version-check -q -r requirements.txt || { echo "pip install failed"; exit 1; }
+
+echo "Building frontend assets ..."
+python static_assets.py || { echo "Frontend build failed"; exit 1; }
+
+echo "Starting production backend at http://localhost:${PORT:-5000} ..."
+exec gunicorn -c gunicorn.conf.py wsgi:app